@@ -1,64 +1,66 @@
-from flask import Flask, flash, render_template, redirect, url_for, request, session
-from models import db, UserTable, Comment, CommentSection, Party, Post, get_comments_of_post, insert_BLOB_user, time_since_post, time_since_jam_session, ratio_table, count_likes
+from flask import Flask, flash, render_template, redirect, url_for, request, session, jsonify, abort, g
+from models import db, UserTable, Comment, CommentSection, Party, Post, get_comments_of_post, insert_BLOB_user, time_since_post, time_since_jam_session, ratio_table, count_likes, rebuild_ratios, cast_vote, regrid_jam_sessions, rebuild_member_counts, rebuild_comment_counts, change_stamps, user_resolver, user_displays
 import os
 from datetime import datetime, timedelta
-from time import time, sleep 
 import boto3
 from boto3 import logging
-from bucket_wrapper import BucketWrapper
-from flask_bcrypt import Bcrypt
-from flask_session import Session
+from aws_clients import aws
+from auth import passwords, login_throttle, HasherBusy
+from math import ceil
+from session_store import init_session, renew_session
 from werkzeug.security import generate_password_hash
-from sqlalchemy import desc
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import desc, func
+from sqlalchemy.exc import IntegrityError
 from blueprints.jam_session.jam_sessions import jam_sessions_bp
 from blueprints.uploader.upload import upload_bp
 from blueprints.profile.profile import profile_bp
+from feed import load_feed_posts, load_comment_page
+from fragments import render_post_cards, render_post_detail
+from http_cache import http_cache
+from query_stats import query_inspector
+from media_index import media_index
 import traceback
+import click
+import multiprocessing
+from jobs import run_worker, job_thread
+from cleanup import reaper
+from migrate import migrate
+from sweeper import sweeper
+from blueprints.uploader.thumbnail_generator import backfill_thumbnails
 
 app = Flask(__name__)
 app.app_context().push()
 
 app.config.from_pyfile('config.py')
 
+# Behind a load balancer remote_addr is the balancer, the client ip (login throttling keys on it) is forwarded
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
 app.register_blueprint(jam_sessions_bp, url_prefix='/sessions')
 app.register_blueprint(upload_bp, url_prefix='/upload')
 app.register_blueprint(profile_bp, url_prefix='/profile')
 
 
 
-bcrypt = Bcrypt(app)
+passwords.init_app(app)
+login_throttle.init_app(app)
 
-Session(app)
+init_session(app)
 
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 
 app.permanent_session_lifetime = timedelta(minutes=30)
 
 db.init_app(app)
-
-# Create AWS session
-aws = boto3.Session(
-                aws_access_key_id= os.getenv('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key= os.getenv('AWS_SECRET_ACCESS_KEY'),
-            )
-
-# Create clients from session
-s3_client = aws.client('s3')
-s3_resource = aws.resource('s3')
-s3_distr = aws.client('cloudfront')
-s3_transcoder = aws.client('elastictranscoder', 'us-east-1')
-
-# Get CloudFront distribution
-distribution = s3_distr.get_distribution(Id="E2CLJ3WM17V7LF")
-
-# URL for distribution, append object keys to url to access 
-distribution_url = f'https://{distribution["Distribution"]["DomainName"]}/'
-
-# Get specific bucket from s3
-riff_bucket = s3_resource.Bucket('riffbucket-itsc3155')
-
-# Wrap bucket to access specific funcionality
-bucket_wrapper = BucketWrapper(riff_bucket)
+query_inspector.init_app(app)
+reaper.init_app(app)
+sweeper.init_app(app)
+job_thread.init_app(app)
+sweeper.task(reaper.resume_pending)
+http_cache.init_app(app)
+user_displays.init_app(app)
 
 boto3.set_stream_logger('', logging.INFO)
 logger = logging.getLogger()
@@ -68,35 +70,67 @@ def homepage():
 
     if not session.get('id'):
         return redirect('/login')
+
+    # Nothing new in the feed since the browser's copy, 304 before any loading
+    http_cache.check('feed', change_stamps('feed'), http_cache.time_bucket())
     
     if session.get('id'):
-        user = UserTable.query.get(session.get("id"))
+        user = user_resolver().get(session.get("id"))
         if not user:
             print("User not found, redirecting to login")
             return redirect('/login')
 
-    videos = []
-    posts = Post.query.order_by(desc(Post.date_posted)).all()
+    posts, next_cursor = load_feed_posts(limit=app.config['FEED_PAGE_SIZE'])
 
     # Either path will load all posts, however only the videos on cloud will load on prod and vice-versa
     if app.config['FLASK_ENV'] == 'prod':
-        return render_template('index.html', posts=posts, distribution_url=distribution_url, UserTable=UserTable)    
+        distribution_url = aws.distribution_url()
     else:
+        distribution_url = f'{app.config["UPLOAD_PATH"]}/'
+        videos = media_index(f'{app.config["UPLOAD_PATH"]}/videos').snapshot()
         for post in posts:
-            try:
-                if f'{post.video_id}.mp4' in os.listdir(f'{app.config["UPLOAD_PATH"]}/videos'):
-                    post_index = os.listdir(f'{app.config["UPLOAD_PATH"]}/videos').index(f'{post.video_id}.mp4')
-                    videos.append(os.listdir(f'{app.config["UPLOAD_PATH"]}/videos')[post_index])   
-                    user_name = UserTable.query.get(post.user_id).user_name
-            except FileNotFoundError as e:
-                print(e)
+            if f'{post.video_id}.mp4' not in videos:
                 print(f'{post.video_id}.mp4 is not in videos.')
-        return render_template('index.html', posts=posts, distribution_url=f'{app.config["UPLOAD_PATH"]}/', UserTable=UserTable) 
+
+    # Cached cards are reused as is, only changed posts are built and rendered
+    cards = render_post_cards(posts, distribution_url, app.config['COMMENTS_PAGE_SIZE'])
+    return render_template('index.html', cards=cards, next_cursor=next_cursor, distribution_url=distribution_url)
+
+# Next page of the feed for the infinite scroll, rendered cards plus the cursor to ask for after them
+@app.get('/feed')
+def get_feed_page():
+    if not session.get('id'):
+        abort(401)
+
+    try:
+        posts, next_cursor = load_feed_posts(request.args.get('cursor'), app.config['FEED_PAGE_SIZE'])
+    except ValueError:
+        abort(400)
+
+    if app.config['FLASK_ENV'] == 'prod':
+        distribution_url = aws.distribution_url()
+    else:
+        distribution_url = f'{app.config["UPLOAD_PATH"]}/'
+
+    cards = render_post_cards(posts, distribution_url, app.config['COMMENTS_PAGE_SIZE'])
+    html = render_template('_feed_page.html', cards=cards)
+
+    return jsonify(html=html, next_cursor=next_cursor)
 
 @app.context_processor
 def comment_get():
     return dict(get_post_comments=get_comments_of_post)
 
+# Templates look users up through the request's resolver, never UserTable directly
+@app.context_processor
+def users_get():
+    return dict(users=user_resolver())
+
+# The app context pushed at import is shared by requests handled on this thread, so g doesn't reset by itself
+@app.teardown_request
+def forget_users(exc):
+    g.pop('users', None)
+
 @app.context_processor
 def since_get():
     return dict(calc_time=time_since_post)
@@ -107,75 +141,85 @@ def jam_session_get_time():
 
 @app.get('/<int:post_id>')
 def get_single_post(post_id: int):
+    # Post.version covers everything on the page
+    version = db.session.query(Post.version).filter(Post.id == post_id).scalar()
+    if version is None:
+        abort(404)
+    http_cache.check('post', post_id, version)
+
     post = Post.query.get(post_id)
 
-    comment_section = CommentSection.query.filter_by(post_id=post.id).first()
-    comments = list(Comment.query.filter_by(comment_section_id=comment_section.id).all())
-    
     if app.config['FLASK_ENV'] == 'prod':
-        return render_template('single_post.html', post=post, distribution_url=distribution_url, comment_section=comment_section, comments=comments, UserTable=UserTable)
+        distribution_url = aws.distribution_url()
+    else:
+        distribution_url = f'{app.config["UPLOAD_PATH"]}/'
+
+    # Video, votes and the newest page of comments, post.comment_count has the total
+    detail = render_post_detail(post, distribution_url, app.config['COMMENTS_PAGE_SIZE'])
+    return render_template('single_post.html', detail=detail, distribution_url=distribution_url)
+
+# Older comments for "load more", rendered rows plus the cursor to ask for after them
+@app.get('/<int:post_id>/comments')
+def get_comment_page(post_id: int):
+    if not session.get('id'):
+        abort(401)
+
+    try:
+        comments, next_cursor = load_comment_page(post_id, request.args.get('cursor'), app.config['COMMENTS_PAGE_SIZE'])
+    except ValueError:
+        abort(400)
+
+    if app.config['FLASK_ENV'] == 'prod':
+        html = render_template('_comment_list.html', comments=comments, distribution_url=aws.distribution_url())
     else:
-        return render_template('single_post.html', post=post, distribution_url=f'{app.config["UPLOAD_PATH"]}/', comment_section=comment_section, comments=comments, UserTable=UserTable)
+        html = render_template('_comment_list.html', comments=comments, distribution_url=f'{app.config["UPLOAD_PATH"]}/')
+
+    return jsonify(html=html, next_cursor=next_cursor)
 
 @app.context_processor
 def ratio_counter():
     return dict(counter=count_likes)
 
-@app.post('/<int:post_id>/ratio')
-def edit_ratio(post_id: int):
-    value = request.form.get("user_rev")
-    print(value)
-    post_id = post_id
-    print(post_id)
-    print('SASSAASASSA IT WORK')
-    user_check = ratio_table.query.filter_by(post_id=post_id, user_id=session.get('id')).first()
-    if user_check is None:
-        if value == '1':
-            user_like = ratio_table(int(post_id), session.get('id'), 1)
-            db.session.add(user_like)
-            db.session.commit()
-            print('USER ADDED')
-        elif value == '0':
-            user_like = ratio_table(int(post_id), session.get('id'), -1)
-            db.session.add(user_like)
-            db.session.commit()
-        else:
-            None
+# Both vote routes share this. Form posts redirect back to the page they came
+# from, requests that ask for JSON just get the new ratio back.
+def vote(post_id: int, redirect_to: str):
+    wants_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+
+    if not session.get('id'):
+        if wants_json:
+            abort(401)
+        return redirect(url_for('get_login'))
+
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
     else:
-        if value != str(user_check.value):
-            user_check.value = value
-            db.session.commit()
-        else:
-            db.session.delete(user_check)
-            db.session.commit()
+        data = request.form
 
-    return redirect(url_for('homepage'))
+    values = {'1': 1, '0': -1}
+    value = values.get(str(data.get('user_rev')))
+
+    if value is None:
+        if wants_json:
+            abort(400)
+        return redirect(redirect_to)
+
+    try:
+        ratio = cast_vote(post_id, session.get('id'), value)
+    except IntegrityError:
+        db.session.rollback()
+        abort(404)
+
+    if wants_json:
+        return jsonify(post_id=post_id, ratio=ratio)
+    return redirect(redirect_to)
+
+@app.post('/<int:post_id>/ratio')
+def edit_ratio(post_id: int):
+    return vote(post_id, url_for('homepage'))
 
 @app.post('/<int:post_id>/ratioiso')
 def edit_ratio_iso(post_id: int):
-    value = request.form.get("user_rev")
-    post_id = post_id
-    user_check = ratio_table.query.filter_by(post_id=post_id, user_id=session.get('id')).first()
-    if user_check is None:
-        if value == '1':
-            user_like = ratio_table(int(post_id), session.get('id'), 1)
-            db.session.add(user_like)
-            db.session.commit()
-        elif value == '0':
-            user_like = ratio_table(int(post_id), session.get('id'), -1)
-            db.session.add(user_like)
-            db.session.commit()
-        else:
-            None #do nothing if neither of the 2 things are done
-    else:
-        if value != str(user_check.value):
-            user_check.value = value #update the values if they click a different button
-            db.session.commit()
-        else:
-            db.session.delete(user_check)
-            db.session.commit()
-
-    return redirect(url_for('get_single_post', post_id=post_id))
+    return vote(post_id, url_for('get_single_post', post_id=post_id))
 
 
 @app.post('/<int:post_id>')
@@ -204,7 +248,7 @@ def post_comment_iso(post_id: int):
 def get_login():
     if session.get('id'):
         try:
-            current_user = UserTable.query.get(session.get('id'))
+            current_user = user_resolver().get(session.get('id'))
             if session.get('id') == current_user.id:
                 redirect(url_for('homepage'))
         except Exception as e:
@@ -227,22 +271,34 @@ def login():
                 flash('Enter a password')
                 return redirect(url_for('get_login'))
 
+            # Throttled attempts are turned away before any database or bcrypt work
+            wait = login_throttle.hit(username, request.remote_addr)
+            if wait:
+                flash(f'Too many login attempts, try again in {ceil(wait)} seconds')
+                return redirect(url_for('get_login'))
+
             current_user = UserTable.query.filter_by(user_name=username).first()
 
-            if current_user:
-                check_pass = bcrypt.check_password_hash(current_user.password, raw_password)
+            # Unknown users still cost one hash, so response time doesn't reveal which names exist
+            check_pass = passwords.verify(current_user.password if current_user else None, raw_password)
             
             if not check_pass:
                 flash('Incorrect Username or Password')
                 return redirect(url_for('get_login'))
-        
+
+            # Hashes made with an older BCRYPT_LOG_ROUNDS are upgraded while we have the password
+            if passwords.needs_rehash(current_user.password):
+                current_user.password = passwords.hash(raw_password)
+                db.session.commit()
+
+            login_throttle.succeeded(username)
+            renew_session()
             session['id'] = current_user.id
 
             flash('Successfully Logged In')
             return redirect(url_for('homepage'))
-        except:
-            sleep(3)
-            flash('Incorrect Username or Password')
+        except HasherBusy:
+            flash('Too many people are logging in right now, try again in a moment')
             return redirect(url_for('get_login'))
         
 @app.post('/logout')
@@ -283,21 +339,111 @@ def sign_up():
             flash('Enter a password')
             return redirect(url_for('get_login'))
         
-        if UserTable.query.filter_by(user_name=username).first():
+        # Names that only differ in case are taken too, answered by user_table_lower_user_name_idx
+        if UserTable.query.filter(func.lower(UserTable.user_name) == username.lower()).first():
             flash('Username already taken.')
             return redirect(url_for('get_login'))
 
-        hashed_password = bcrypt.generate_password_hash(raw_password, 12).decode()
+        hashed_password = passwords.hash(raw_password)
 
         new_user = UserTable(first_name, last_name, username, hashed_password, email, phone)
         db.session.add(new_user)
         db.session.commit()
 
+        renew_session()
         session['id'] = new_user.id
     
         flash('Successfully Signed Up')
         return redirect(url_for('homepage'))
+    except HasherBusy:
+        flash('Too many people are signing up right now, try again in a moment')
+        return redirect(url_for('get_login'))
     except:
         flash('Unable to Sign Up\nTry Again Later.')
         return redirect(url_for('get_login'))
-    
+
+# Bring a database created from an older base.sql up to date, see migrate.py
+@app.cli.command('migrate')
+def migrate_command():
+    applied = migrate()
+    for version in applied:
+        print(f'Applied {version}')
+    print(f'{len(applied)} migrations applied')
+
+# Recompute every Post.ratio from ratio_table, e.g. after votes were changed outside the app
+@app.cli.command('rebuild-ratios')
+def rebuild_ratios_command():
+    updated = rebuild_ratios()
+    print(f'Rebuilt ratio for {updated} posts')
+
+# Recompute every Post.comment_count from the comment table
+@app.cli.command('rebuild-comment-counts')
+def rebuild_comment_counts_command():
+    updated = rebuild_comment_counts()
+    print(f'Rebuilt comment count for {updated} posts')
+
+# Recompute every JamSession.member_count from the party table
+@app.cli.command('rebuild-member-counts')
+def rebuild_member_counts_command():
+    updated = rebuild_member_counts()
+    print(f'Rebuilt member count for {updated} sessions')
+
+# Recompute every jam session's grid cell, needed after changing geo.GRID_SIZE
+@app.cli.command('regrid-sessions')
+def regrid_sessions_command():
+    updated = regrid_jam_sessions()
+    print(f'Moved {updated} sessions to their new grid cell')
+
+def _job_worker_process():
+    # Connections opened before the fork must not be shared with the parent
+    db.engine.dispose(close=False)
+    with app.app_context():
+        run_worker()
+
+# Run the background job workers, e.g. flask --app app jobs-worker --processes 2
+@app.cli.command('jobs-worker')
+@click.option('--processes', default=1, help='Number of worker processes.')
+def jobs_worker_command(processes):
+    if processes == 1:
+        run_worker()
+        return
+
+    workers = [multiprocessing.Process(target=_job_worker_process) for _ in range(processes)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+# Run the housekeeping tasks (expiring jam sessions...) once, e.g. from cron when no web process is up
+@app.cli.command('sweep')
+def sweep_command():
+    for name, result in sweeper.run_once().items():
+        print(f'{name}: {result}')
+
+# Show what the temp file reaper has left to delete
+@app.cli.command('cleanup-stats')
+def cleanup_stats_command():
+    # Retrying now instead of waiting for a request process to do it
+    reaper.run_once()
+    for name, value in reaper.metrics().items():
+        print(f'{name}: {value}')
+
+# Thumbnail every local video that doesn't have one yet, e.g. after changing THUMBNAIL_WIDTHS
+@app.cli.command('backfill-thumbnails')
+@click.option('--workers', default=None, type=int, help='Number of processes, defaults to one per CPU.')
+@click.option('--all', 'redo_all', is_flag=True, help='Regenerate thumbnails that already exist too.')
+def backfill_thumbnails_command(workers, redo_all):
+    video_dir = f'{app.config["UPLOAD_PATH"]}/videos'
+    thumbnail_dir = f'{app.config["UPLOAD_PATH"]}/thumbnails'
+    thumbnails = media_index(thumbnail_dir).snapshot()
+
+    videos = []
+    for name in sorted(media_index(video_dir).snapshot()):
+        if redo_all or f'{os.path.splitext(name)[0]}.jpg' not in thumbnails:
+            videos.append(os.path.join(video_dir, name))
+
+    results = backfill_thumbnails(videos, thumbnail_dir, workers)
+    failed = {v: e for v, e in results.items() if e}
+    for video, error in failed.items():
+        print(f'{video}: {error}')
+    print(f'Thumbnailed {len(results) - len(failed)} of {len(videos)} videos')
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+from sqlalchemy import text
+from models import db
+from sweeper import sweeper
+
+# Password hashing and login throttling.
+#
+# bcrypt is deliberately slow, so it runs on a small fixed pool of threads with
+# a bounded backlog: a burst of logins queues up to AUTH_HASH_QUEUE_LIMIT
+# requests and everything past that is turned away at once (HasherBusy)
+# instead of tying up every web worker, as is anything that waited longer
+# than AUTH_HASH_TIMEOUT. Login attempts are rate limited per username and per
+# IP with token buckets, in memory or (LOGIN_LIMITER_BACKEND = 'sql') in a
+# table shared by every worker and host. Behind a load balancer the client IP
+# comes from X-Forwarded-For, see PROXY_FIX_X_FOR.
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self) -> None:
+        self.rounds = 12
+        self.timeout = 30
+        self._pool = None
+        self._slots = None
+        self._dummy_hash = None
+
+    def init_app(self, app) -> None:
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.timeout = app.config['AUTH_HASH_TIMEOUT']
+        workers = app.config['AUTH_HASH_WORKERS']
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        # running plus waiting, past this new work is rejected rather than queued
+        self._slots = threading.BoundedSemaphore(workers + app.config['AUTH_HASH_QUEUE_LIMIT'])
+        self._dummy_hash = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            # waited AUTH_HASH_TIMEOUT on a backed up pool, same answer as a full backlog
+            raise HasherBusy()
+
+    def hash(self, password: str) -> str:
+        return self._run(self._hash, password)
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds)).decode('utf-8')
+
+    def verify(self, hashed: str, password: str) -> bool:
+        """ hashed may be None (unknown user), it still costs one bcrypt so the timing gives nothing away """
+        if hashed is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash('not a real password')
+            self._run(bcrypt.checkpw, password.encode('utf-8'), self._dummy_hash.encode('utf-8'))
+            return False
+        try:
+            return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+        except ValueError:
+            # not a bcrypt hash at all
+            return False
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """ True when the stored hash was made with a different cost than BCRYPT_LOG_ROUNDS """
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+class TokenBucketLimiter:
+    """ in-process buckets, each key gets capacity attempts refilled at per_minute """
+    def __init__(self, capacity: int, per_minute: float, max_keys: int = 100_000) -> None:
+        self.capacity = capacity
+        self.rate = per_minute / 60
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> float:
+        """ take a token, returns 0 if allowed or the seconds until the next token.
+        Attempts on an empty bucket push the refill back, down to one token of debt """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = max(min(self.capacity, tokens + (now - updated) * self.rate) - 1, -1)
+            self._buckets[key] = (tokens, now)
+            # least recently seen keys go first
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0 if tokens >= 0 else -tokens / self.rate
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+# The same bucket as one upsert, so every worker and host shares the count
+SQL_HIT = text("""
+    INSERT INTO rate_limit AS r (key, tokens, updated)
+    VALUES (:key, :capacity - 1, now())
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = GREATEST(LEAST(:capacity, r.tokens + EXTRACT(EPOCH FROM now() - r.updated) * :rate) - 1, -1),
+        updated = now()
+    RETURNING tokens
+""")
+
+class SqlTokenBucketLimiter(TokenBucketLimiter):
+    """ buckets in the rate_limit table """
+    def hit(self, key: str) -> float:
+        with db.engine.begin() as conn:
+            tokens = conn.execute(SQL_HIT, {'key': key, 'capacity': self.capacity, 'rate': self.rate}).scalar()
+        return 0 if tokens >= 0 else -tokens / self.rate
+
+    def reset(self, key: str) -> None:
+        with db.engine.begin() as conn:
+            conn.execute(text('DELETE FROM rate_limit WHERE key = :key'), {'key': key})
+
+
+def expire_rate_limits() -> int:
+    """ full buckets carry no information, drop the ones idle for an hour """
+    with db.engine.begin() as conn:
+        return conn.execute(text("DELETE FROM rate_limit WHERE updated < now() - interval '1 hour'")).rowcount
+
+
+class LoginThrottle:
+    def __init__(self) -> None:
+        self.by_user = None
+        self.by_ip = None
+
+    def init_app(self, app) -> None:
+        limiter = SqlTokenBucketLimiter if app.config['LOGIN_LIMITER_BACKEND'] == 'sql' else TokenBucketLimiter
+        self.by_user = limiter(app.config['LOGIN_USER_BURST'], app.config['LOGIN_USER_PER_MINUTE'])
+        self.by_ip = limiter(app.config['LOGIN_IP_BURST'], app.config['LOGIN_IP_PER_MINUTE'])
+        if limiter is SqlTokenBucketLimiter:
+            sweeper.task(expire_rate_limits)
+
+    def hit(self, username: str, ip: str) -> float:
+        """ seconds the caller has to wait, 0 when the attempt may go ahead """
+        return max(self.by_ip.hit(f'ip:{ip}'), self.by_user.hit(f'user:{username.lower()}'))
+
+    def succeeded(self, username: str) -> None:
+        self.by_user.reset(f'user:{username.lower()}')
+
+
+passwords = PasswordHasher()
+login_throttle = LoginThrottle()
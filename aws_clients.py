@@ -0,0 +1,100 @@
+import os
+import threading
+import boto3
+from boto3 import logging
+from flask import current_app
+from bucket_wrapper import BucketWrapper
+
+# One lazily built set of AWS clients shared by the app and every blueprint.
+# Nothing talks to AWS at import time, each gunicorn worker builds its clients
+# on first use, and tests / local runs can register stand-ins instead.
+
+
+class AwsClients:
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._session = None
+        self._objects = {}
+        self._distribution_url = None
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = boto3.Session(
+                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                )
+            return self._session
+
+    def _get(self, key, build):
+        with self._lock:
+            if key not in self._objects:
+                self._objects[key] = build()
+            return self._objects[key]
+
+    def client(self, name: str, region: str = None):
+        return self._get(name, lambda: self.session().client(name, region))
+
+    def resource(self, name: str):
+        return self._get(f'{name}_resource', lambda: self.session().resource(name))
+
+    def bucket(self, bucket_name: str) -> BucketWrapper:
+        return self._get(f'bucket:{bucket_name}', lambda: BucketWrapper(self.resource('s3').Bucket(bucket_name)))
+
+    @property
+    def s3_client(self):
+        return self.client('s3')
+
+    @property
+    def transcoder(self):
+        return self.client('elastictranscoder', current_app.config['TRANSCODER_REGION'])
+
+    def register(self, key: str, obj) -> None:
+        """ swap in a stand-in, e.g. register('s3', stub) or register('bucket:riffbucket-itsc3155', wrapper) """
+        with self._lock:
+            self._objects[key] = obj
+
+    def reset(self) -> None:
+        with self._lock:
+            self._session = None
+            self._objects = {}
+            self._distribution_url = None
+
+    def distribution_url(self) -> str:
+        """ CloudFront URL to prefix object keys with, looked up at most once per process """
+        if self._distribution_url is None:
+            with self._lock:
+                if self._distribution_url is None:
+                    self._distribution_url = self._resolve_distribution_url()
+        return self._distribution_url
+
+    def _resolve_distribution_url(self) -> str:
+        config = current_app.config
+
+        # Configured explicitly, no lookup at all
+        if config.get('DISTRIBUTION_URL'):
+            return config['DISTRIBUTION_URL']
+
+        # Resolved by an earlier process
+        cache_file = os.path.join(current_app.instance_path, config['DISTRIBUTION_URL_CACHE'])
+        try:
+            with open(cache_file) as f:
+                url = f.read().strip()
+            if url:
+                return url
+        except OSError:
+            pass
+
+        distribution = self.client('cloudfront').get_distribution(Id=config['DISTRIBUTION_ID'])
+        url = f'https://{distribution["Distribution"]["DomainName"]}/'
+
+        try:
+            os.makedirs(current_app.instance_path, exist_ok=True)
+            with open(cache_file, 'w') as f:
+                f.write(url)
+        except OSError:
+            logging.exception('Could not cache distribution url')
+        return url
+
+
+aws = AwsClients()
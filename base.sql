@@ -9,7 +9,37 @@ create table user_table (
     private boolean null default FALSE,
     phone varchar(20) null,
     prof_pic varchar(255),
-    bio varchar(500)
+    bio varchar(500),
+    avatar_version int not null default 0
+);
+
+-- sign up checks names case-insensitively
+create index user_table_lower_user_name_idx on user_table(lower(user_name));
+
+-- login sessions when SESSION_BACKEND is sql, garbage collected by expires
+drop table if exists web_session cascade ;
+create table web_session (
+    id varchar(64) primary key,
+    data text not null,
+    expires timestamp not null
+);
+create index web_session_expires_idx on web_session(expires);
+
+-- login token buckets when LOGIN_LIMITER_BACKEND is sql (see auth.py)
+drop table if exists rate_limit cascade ;
+create table rate_limit (
+    key varchar(255) primary key,
+    tokens double precision not null,
+    updated timestamptz not null
+);
+create index rate_limit_updated_idx on rate_limit(updated);
+
+-- page change stamps for ETags (see http_cache.py), one row per scope
+drop table if exists change_stamp cascade ;
+create table change_stamp (
+    scope varchar(255) primary key,
+    version bigint not null,
+    changed_at timestamptz not null
 );
 
 drop table if exists sessions cascade ;
@@ -22,17 +52,26 @@ create table sessions (
     date_posted timestamp null,
     lat double precision not null,
     long double precision not null,
+    grid_cell int not null,
+    member_count int not null default 0,
     host_id int not null,
     foreign key (host_id) references user_table(id)
 );
 
+-- the map and the expiry sweeper both range scan on date
+create index sessions_date_idx on sessions(date);
+-- "sessions near me" range scans on geo.grid_cell
+create index sessions_grid_idx on sessions(grid_cell);
+
 drop table if exists party cascade ;
 create table party(
     party_id serial primary key,
     session_id int not null,
     user_id int not null,
-    foreign key (session_id) references sessions(id),
-    foreign key (user_id) references user_table(id)
+    foreign key (session_id) references sessions(id) on delete cascade,
+    foreign key (user_id) references user_table(id),
+    -- one row per member, join relies on it for on conflict do nothing
+    constraint party_member_key unique (session_id, user_id)
 );
 
 drop table if exists post cascade;
@@ -43,9 +82,17 @@ create table post(
     msg varchar(255) null,
     ratio int not null,
     date_posted timestamp not null,
-    user_id int not null  
+    user_id int not null,
+    status varchar(20) not null default 'ready',
+    comment_count int not null default 0,
+    version int not null default 0
 );
 
+-- feed is paged by (date_posted, id), newest first
+create index post_feed_idx on post(date_posted desc, id desc);
+-- profile pages list a user's posts newest first
+create index post_user_idx on post(user_id, date_posted desc);
+
 drop table if exists ratio_table cascade;
 create table ratio_table(
     post_id int references post(id) on delete cascade,
@@ -63,13 +110,29 @@ create table comment_section(
     foreign key (post_id) references post(id)
 );
 
+create index comment_section_post_idx on comment_section(post_id);
+
 drop table if exists comment cascade ;
 create table comment(
     id serial primary key,
     comment_section_id int not null references comment_section(id) on delete cascade ,
     user_id int not null,
     message varchar(255) not null,
-    post_time timestamp null,
+    post_time timestamp not null default now(),
     foreign key (comment_section_id) references  comment_section(id),
     foreign key (user_id) references user_table(id)
 );
+
+-- comments are paged by (post_time, id), newest first, within a section
+create index comment_page_idx on comment(comment_section_id, post_time desc, id desc);
+
+
+-- migrations/ files already folded into this script, see migrate.py
+drop table if exists schema_migrations cascade ;
+create table schema_migrations(
+    version varchar(255) primary key,
+    applied_at timestamp not null default now()
+);
+insert into schema_migrations (version) values ('001_hot_path_indexes'), ('002_post_version'), ('003_change_stamp'), ('004_avatar_version'),
+    ('005_post_status'), ('006_party_cascade'), ('007_session_grid_cell'), ('008_session_member_count'),
+    ('009_web_session'), ('010_rate_limit'), ('011_comment_count');
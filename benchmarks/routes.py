@@ -0,0 +1,309 @@
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from app import app
+from aws_clients import aws
+from bucket_wrapper import BucketWrapper
+from fragments import fragment_cache
+from geo import grid_cell
+from models import db, clear_data, touch, rebuild_comment_counts, rebuild_member_counts, user_displays, \
+    UserTable, Post, CommentSection, Comment, JamSession, Party
+from sweeper import sweeper
+from tests.aws_stubs import FakeS3, FakeBucket, FakeTranscoder, FakeCloudFront
+
+# Latency and throughput of the main pages and form posts, run in process
+# through the Flask test client against a freshly seeded database. The app
+# takes its prod paths (S3 uploads, the CloudFront url, transcode jobs) with
+# the in-memory stand-ins from tests/aws_stubs.py, so no AWS account is needed.
+#
+#     python -m benchmarks.routes --posts 5000 --concurrency 8 --json before.json
+#     python -m benchmarks.routes --posts 5000 --concurrency 8 --json after.json --compare before.json
+#
+# This WIPES the database it runs against (clear_data) before seeding and when
+# it is done, point DB_NAME at a scratch database. Every client thread holds a
+# database connection while it works, keep --concurrency within the pool (15).
+
+ROUTES = {
+    # name: (what it requests, status a working request answers with)
+    'feed': ('GET /', 200),
+    'post': ('GET /<post_id>', 200),
+    'vote': ('POST /<post_id>/ratio', 200),
+    'comment': ('POST /<post_id>/iso', 302),
+    'sessions': ('GET /sessions/', 200),
+    'profile': ('GET /profile/<id>', 200),
+    'upload': ('POST /upload/new', 302),
+}
+
+
+class Seeded:
+    def __init__(self, user_ids: list, post_ids: list, video: bytes) -> None:
+        self.user_ids = user_ids
+        self.post_ids = post_ids
+        self.video = video
+
+
+def request_route(name: str, client, seeded: Seeded, rng: random.Random):
+    if name == 'feed':
+        return client.get('/')
+    if name == 'post':
+        return client.get(f'/{rng.choice(seeded.post_ids)}')
+    if name == 'vote':
+        return client.post(f'/{rng.choice(seeded.post_ids)}/ratio', json={'user_rev': rng.choice(['1', '0'])})
+    if name == 'comment':
+        return client.post(f'/{rng.choice(seeded.post_ids)}/iso', data={'comment': 'nice riff'})
+    if name == 'sessions':
+        return client.get('/sessions/')
+    if name == 'profile':
+        return client.get(f'/profile/{rng.choice(seeded.user_ids)}')
+    if name == 'upload':
+        return client.post('/upload/new', content_type='multipart/form-data', data={
+            'file': (io.BytesIO(seeded.video), 'riff.mp4'),
+            'title': 'Benchmark riff',
+            'description': 'uploaded by benchmarks.routes',
+        })
+    raise ValueError(f'Unknown route {name}')
+
+
+@contextmanager
+def stubbed_app(instance_path: str):
+    """ the app's prod paths on in-memory AWS stand-ins and a scratch instance folder, put back afterwards """
+    saved = {key: app.config[key] for key in ('FLASK_ENV', 'DISTRIBUTION_URL')}
+    saved_instance_path = app.instance_path
+    saved_start = sweeper.start
+    sql_log = logging.getLogger('riffroom.sql')
+    saved_level = sql_log.level
+
+    app.config['FLASK_ENV'] = 'prod'
+    # resolved through the fake CloudFront like a real first request would
+    app.config['DISTRIBUTION_URL'] = None
+    # job queue, fragment and distribution url caches all live in the instance folder
+    app.instance_path = instance_path
+
+    s3 = FakeS3()
+    aws.reset()
+    aws.register('s3', s3)
+    for bucket in (app.config['BUCKET_NAME'], app.config['UPLOAD_BUCKET_NAME']):
+        aws.register(f'bucket:{bucket}', BucketWrapper(FakeBucket(bucket, s3)))
+    aws.register('elastictranscoder', FakeTranscoder())
+    aws.register('cloudfront', FakeCloudFront())
+
+    # housekeeping would add its own queries to whatever route it lands in
+    sweeper.start = lambda: None
+    # query_stats logs every request in prod, only slow and repeated statements are worth seeing here
+    sql_log.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        app.config.update(saved)
+        app.instance_path = saved_instance_path
+        sweeper.start = saved_start
+        sql_log.setLevel(saved_level)
+        aws.reset()
+
+
+def seed(args, rng: random.Random) -> Seeded:
+    """ bulk inserts, the counters the ORM events keep are rebuilt once at the end """
+    now = datetime.now()
+
+    user_ids = db.session.scalars(insert(UserTable).returning(UserTable.id), [
+        {'first_name': 'Bench', 'last_name': str(i), 'user_name': f'bench{i}', 'password': 'x',
+         'email': f'bench{i}@riffroom.test', 'phone': '123-456-7890'}
+        for i in range(args.users)]).all()
+
+    post_ids = db.session.scalars(insert(Post).returning(Post.id), [
+        {'video_id': f'bench-{i}', 'title': f'Riff {i}', 'msg': 'seeded by benchmarks.routes', 'ratio': 0,
+         'date_posted': now - timedelta(minutes=rng.randrange(60 * 24 * 30)), 'user_id': rng.choice(user_ids),
+         'status': 'ready'}
+        for i in range(args.posts)]).all()
+
+    section_ids = db.session.scalars(insert(CommentSection).returning(CommentSection.id),
+                                     [{'post_id': post_id} for post_id in post_ids]).all()
+    comments = [{'comment_section_id': section_id, 'user_id': rng.choice(user_ids), 'message': 'sick tone',
+                 'post_time': now - timedelta(minutes=rng.randrange(60 * 24 * 30))}
+                for section_id in section_ids for _ in range(args.comments)]
+    if comments:
+        db.session.execute(insert(Comment), comments)
+
+    hosts = [rng.choice(range(len(user_ids))) for _ in range(args.sessions)]
+    sessions = []
+    for i, host in enumerate(hosts):
+        lat, lng = 35.22 + rng.uniform(-0.5, 0.5), -80.84 + rng.uniform(-0.5, 0.5)
+        sessions.append({'host_name': f'Bench {host}', 'title': f'Jam {i}', 'message': 'bring an amp',
+                         'date': now + timedelta(hours=rng.uniform(1, 72)), 'date_posted': now,
+                         'lat': lat, 'long': lng, 'grid_cell': grid_cell(lat, lng), 'host_id': user_ids[host]})
+    session_ids = db.session.scalars(insert(JamSession).returning(JamSession.id), sessions).all() if sessions else []
+
+    party = []
+    for session_id, host in zip(session_ids, hosts):
+        others = [u for u in user_ids if u != user_ids[host]]
+        members = [user_ids[host]] + rng.sample(others, min(args.members, len(others)))
+        party += [{'session_id': session_id, 'user_id': user_id} for user_id in members]
+    if party:
+        db.session.execute(insert(Party), party)
+
+    db.session.commit()
+    rebuild_comment_counts()
+    rebuild_member_counts()
+    touch('feed', 'sessions')
+    db.session.commit()
+
+    return Seeded(user_ids, post_ids, rng.randbytes(args.video_kb * 1024))
+
+
+def percentile(ordered: list, p: float) -> float:
+    # nearest rank
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(timings: list, errors: dict, wall: float) -> dict:
+    millis = sorted(t * 1000 for t in timings)
+    return {
+        'requests': len(millis),
+        'errors': sum(errors.values()),
+        'error_statuses': {str(status): n for status, n in sorted(errors.items())},
+        'throughput_rps': round(len(millis) / wall, 1) if wall else 0,
+        'mean_ms': round(statistics.fmean(millis), 2),
+        'p50_ms': round(percentile(millis, 50), 2),
+        'p95_ms': round(percentile(millis, 95), 2),
+        'p99_ms': round(percentile(millis, 99), 2),
+        'max_ms': round(millis[-1], 2),
+    }
+
+
+def run_client(name: str, seeded: Seeded, count: int, rng: random.Random, start: threading.Barrier):
+    timings = []
+    errors = {}
+    expected = ROUTES[name][1]
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = rng.choice(seeded.user_ids)
+        start.wait()
+        for _ in range(count):
+            began = time.perf_counter()
+            response = request_route(name, client, seeded, rng)
+            timings.append(time.perf_counter() - began)
+            if response.status_code != expected:
+                errors[response.status_code] = errors.get(response.status_code, 0) + 1
+            response.close()
+    return timings, errors
+
+
+def run_route(name: str, seeded: Seeded, args) -> dict:
+    # every route starts from cold process caches, the warm up requests fill them
+    fragment_cache().clear()
+    user_displays.clear()
+    run_client(name, seeded, args.warmup, random.Random(f'{args.seed}:{name}:warmup'), threading.Barrier(1))
+
+    # the requests split as evenly as they go over the clients, all released at once
+    counts = [args.requests // args.concurrency + (i < args.requests % args.concurrency) for i in range(args.concurrency)]
+    start = threading.Barrier(args.concurrency + 1)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_client, name, seeded, count, random.Random(f'{args.seed}:{name}:{i}'), start)
+                   for i, count in enumerate(counts)]
+        start.wait()
+        began = time.perf_counter()
+        results = [f.result() for f in futures]
+        wall = time.perf_counter() - began
+
+    timings = [t for client_timings, _ in results for t in client_timings]
+    errors = {}
+    for _, client_errors in results:
+        for status, n in client_errors.items():
+            errors[status] = errors.get(status, 0) + n
+    return summarize(timings, errors, wall)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(before: dict, after: dict) -> None:
+    print(f'\ncompared with {before.get("commit")} ({before.get("when")})')
+    for name, now in after['routes'].items():
+        then = before.get('routes', {}).get(name)
+        if not then:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            change = (now[key] - then[key]) / then[key] * 100 if then[key] else 0
+            changes.append(f'{key} {then[key]} -> {now[key]} ({change:+.0f}%)')
+        print(f'{name:>10}  ' + ', '.join(changes))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Latency and throughput of the main routes against a seeded database')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--comments', type=int, default=5, help='comments per post')
+    parser.add_argument('--sessions', type=int, default=100, help='upcoming jam sessions')
+    parser.add_argument('--members', type=int, default=5, help='members per jam session besides the host')
+    parser.add_argument('--video-kb', type=int, default=256, help='size of the file each upload sends')
+    parser.add_argument('--requests', type=int, default=500, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per route before timing')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads sending requests at once')
+    parser.add_argument('--routes', nargs='+', default=list(ROUTES), choices=ROUTES)
+    parser.add_argument('--seed', type=int, default=1, help='random seed, same seed same data and requests')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--compare', help='results file from an earlier run to print the change against')
+    parser.add_argument('--wipe', action='store_true', help='go ahead even if the database already has users in it')
+    args = parser.parse_args(argv)
+    if args.users < 1 or args.posts < 1 or args.requests < args.concurrency or args.concurrency < 1:
+        parser.error('need at least one user and post, and at least one request per client')
+    return args
+
+
+def main(argv=None) -> dict:
+    args = parse_args(argv)
+    if UserTable.query.first() is not None and not args.wipe:
+        raise SystemExit('the database already has users in it and would be wiped, pass --wipe to go ahead')
+
+    rng = random.Random(args.seed)
+    results = {
+        'commit': git_commit(),
+        'when': datetime.now().isoformat(timespec='seconds'),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('json', 'compare', 'wipe')},
+        'routes': {},
+    }
+
+    with tempfile.TemporaryDirectory() as instance_path, stubbed_app(instance_path):
+        clear_data()
+        try:
+            seeded = seed(args, rng)
+            for name in args.routes:
+                # the views still have a few debugging prints, keep them out of the report
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    results['routes'][name] = run_route(name, seeded, args)
+                print(f'{name:>10}  {ROUTES[name][0]:<22} {results["routes"][name]}')
+        finally:
+            db.session.rollback()
+            clear_data()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import statistics
+import time
+from flask import Flask, request
+from app import app
+from models import db, WebSession
+from session_store import init_session
+
+# Per-request cost of each session backend: open the session, read the user id
+# and save it again, the way every page does. "write" requests also change the
+# session (a flash message), which is what login and most form posts do.
+#
+#     python -m benchmarks.session_backends --requests 2000 --json results.json
+#
+# Needs the same database settings as the app, the sql backend uses web_session.
+
+BACKENDS = ('filesystem', 'sql', 'cookie')
+
+
+def backend_interface(backend: str):
+    # init_session on a scratch app so the real app's interface is left alone
+    scratch = Flask(__name__)
+    scratch.config.from_mapping(app.config)
+    scratch.config['SESSION_BACKEND'] = backend
+    init_session(scratch)
+    return scratch.session_interface
+
+
+def run_requests(interface, cookie: str, count: int, write: bool) -> list:
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        with app.test_request_context('/', headers={'Cookie': cookie}):
+            sess = interface.open_session(app, request)
+            sess.get('id')
+            if write:
+                sess['_flashes'] = [('message', f'flash {i}')]
+            response = app.response_class()
+            interface.save_session(app, sess, response)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def login_cookie(interface) -> str:
+    """ save a logged in session once and return the Cookie header that points at it """
+    with app.test_request_context('/'):
+        sess = interface.open_session(app, request)
+        sess['id'] = 1
+        response = app.response_class()
+        interface.save_session(app, sess, response)
+    name = app.config['SESSION_COOKIE_NAME']
+    for header in response.headers.getlist('Set-Cookie'):
+        if header.startswith(f'{name}='):
+            return header.split(';', 1)[0]
+    raise RuntimeError('backend did not set a session cookie')
+
+
+def summarize(timings: list) -> dict:
+    micros = sorted(t * 1_000_000 for t in timings)
+    return {
+        'requests': len(micros),
+        'mean_us': round(statistics.fmean(micros), 1),
+        'p50_us': round(micros[len(micros) // 2], 1),
+        'p95_us': round(micros[int(len(micros) * 0.95)], 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Per-request cost of each session backend')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        interface = backend_interface(backend)
+        cookie = login_cookie(interface)
+        # warm up connections and caches before timing
+        run_requests(interface, cookie, 50, write=False)
+        results[backend] = {
+            'read': summarize(run_requests(interface, cookie, args.requests, write=False)),
+            'write': summarize(run_requests(interface, cookie, args.requests, write=True)),
+        }
+        print(f'{backend:>10}  read {results[backend]["read"]}')
+        print(f'{"":>10}  write {results[backend]["write"]}')
+
+        # only the benchmark's own row, real sessions are left alone
+        if backend == 'sql':
+            WebSession.query.filter_by(id=cookie.split('=', 1)[1]).delete()
+            db.session.commit()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,124 @@
-from flask import Blueprint, render_template, redirect, url_for, request, abort, session, flash
+from flask import Blueprint, render_template, redirect, url_for, request, abort, session, flash, current_app, jsonify
 from dotenv import load_dotenv
 import os
+import math
 from datetime import datetime, timedelta
-from models import UserTable, db, JamSession, Party
-import boto3
+from models import UserTable, db, JamSession, Party, change_stamps, load_session_page, expire_jam_sessions, jam_sessions_in_bbox, jam_sessions_near, join_jam_session, leave_jam_session
+from aws_clients import aws
+from sweeper import sweeper
+from clusters import cluster_cache, count_tiles, tiles_in_bbox, MAX_TILES
+from roster import load_roster, build_session_cards
+from http_cache import http_cache
 
 load_dotenv()
 
 jam_sessions_bp = Blueprint('jam_sessions', __name__, template_folder='templates')
 
-#Create AWS session
-aws = boto3.Session(
-                aws_access_key_id= os.getenv('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key= os.getenv('AWS_SECRET_ACCESS_KEY'),
-            )
-
-# Create clients from session
-s3_distr = aws.client('cloudfront')
-
-# Get CloudFront distribution
-distribution = s3_distr.get_distribution(Id="E2CLJ3WM17V7LF")
-
-# URL for distribution, append object keys to url to access 
-distribution_url = f'https://{distribution["Distribution"]["DomainName"]}/'
-
 @jam_sessions_bp.get('/')
 def get_sessions():
     if not session.get('id'):
         return redirect('/login')
 
+    cursor = request.args.get('cursor')
+    # sessions also drop off the list as they expire, the time bucket keeps that from going stale
+    http_cache.check('sessions', cursor, change_stamps('sessions'), http_cache.time_bucket())
+
     MAPS_API_KEY = os.getenv('MAPS_API_KEY')
     current_date = datetime.now().strftime('%Y-%m-%dT%H:%M')
     max_date = datetime(2024, 12, 31,23)
-    active_jam_sessions = JamSession.query.all()
-
-    if active_jam_sessions:
-        for seshs in active_jam_sessions:
-            delta = datetime.now() - seshs.date
-            secs = delta.total_seconds()
-            if secs > 300:
-                db.session.delete(seshs)
-                db.session.commit()
-
-    # Used for Google Map pins
-    jam_session_data = []
-
-    if active_jam_sessions:
-        for i in active_jam_sessions:
-            result = i.serialize
-            jam_session_data.append(result)
+    # Expired sessions are filtered out here and deleted by the sweeper, never on a page view.
+    # Map pins aren't part of the page, the map asks get_nearby_sessions for what's in view
+    try:
+        jam_sessions, next_cursor = load_session_page(current_app.config['JAM_SESSION_TTL'], cursor,
+                                                      current_app.config['SESSIONS_PAGE_SIZE'])
+    except ValueError:
+        abort(400)
+    session_cards = build_session_cards(jam_sessions, session.get('id'))
 
     return render_template('jam_sessions.html', 
                         current_date=current_date, 
                         max_date=max_date, 
-                        active_jam_sessions=active_jam_sessions,
-                        jam_session_data=jam_session_data,
+                        active_jam_sessions=session_cards,
+                        cursor=cursor,
+                        next_cursor=next_cursor,
                         MAPS_API_KEY=MAPS_API_KEY,
+                        cluster_max_zoom=current_app.config['CLUSTER_MAX_ZOOM'],
                         JamSession=JamSession,
-                        Party=Party,
-                        UserTable=UserTable,
-                        distribution_url=distribution_url
+                        distribution_url=aws.distribution_url()
                         )
 
+def on_the_map(south: float, west: float, north: float, east: float) -> bool:
+    """ finite, inside lat -90..90 and lng -180..180, and south of north """
+    return all(map(math.isfinite, (south, west, north, east))) \
+        and -90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180
+
+def clamp_to_map(lat: float, lng: float) -> tuple:
+    """ the point pulled onto lat -90..90 and lng -180..180, ValueError for nan or inf """
+    if not math.isfinite(lat) or not math.isfinite(lng):
+        raise ValueError('not a point on the map')
+    return min(max(lat, -90.0), 90.0), min(max(lng, -180.0), 180.0)
+
+# Map pins for what is on screen, either a viewport
+#   /sessions/nearby?south=..&west=..&north=..&east=..
+# or a circle (radius in km)
+#   /sessions/nearby?lat=..&lng=..&radius=..
+@jam_sessions_bp.get('/nearby')
+def get_nearby_sessions():
+    if not session.get('id'):
+        abort(401)
+
+    ttl = current_app.config['JAM_SESSION_TTL']
+    limit = current_app.config['NEARBY_SESSIONS_LIMIT']
+    try:
+        if 'radius' in request.args:
+            lat, lng, radius = (float(request.args[k]) for k in ('lat', 'lng', 'radius'))
+            if not -90 <= lat <= 90 or not math.isfinite(radius) or radius <= 0:
+                abort(400)
+            lat, lng = clamp_to_map(lat, lng)
+            jam_sessions = jam_sessions_near(lat, lng, radius, ttl, limit)
+        else:
+            south, west, north, east = (float(request.args[k]) for k in ('south', 'west', 'north', 'east'))
+            south, west = clamp_to_map(south, west)
+            north, east = clamp_to_map(north, east)
+            if south > north:
+                abort(400)
+            jam_sessions = jam_sessions_in_bbox(south, west, north, east, ttl, limit)
+    except (KeyError, ValueError):
+        abort(400)
+
+    return jsonify(sessions=[s.serialize for s in jam_sessions])
+
+# Pre-clustered markers (count + centroid) for the viewport at zoom levels up to CLUSTER_MAX_ZOOM
+#   /sessions/clusters?zoom=..&south=..&west=..&north=..&east=..
+@jam_sessions_bp.get('/clusters')
+def get_session_clusters():
+    if not session.get('id'):
+        abort(401)
+
+    try:
+        zoom = int(request.args['zoom'])
+        south, west, north, east = (float(request.args[k]) for k in ('south', 'west', 'north', 'east'))
+    except (KeyError, ValueError):
+        abort(400)
+    if not 0 <= zoom <= current_app.config['CLUSTER_MAX_ZOOM'] or not on_the_map(south, west, north, east):
+        abort(400)
+    # counted before the list is built, a world sized box at street level is millions of tiles
+    if count_tiles(south, west, north, east, zoom) > MAX_TILES:
+        abort(400)
+
+    tiles = tiles_in_bbox(south, west, north, east, zoom)
+    clusters = cluster_cache().clusters(zoom, tiles, current_app.config['JAM_SESSION_TTL'])
+    return jsonify(clusters=clusters)
+
+@sweeper.task
+def expire_sessions():
+    # cluster tiles drop expired sessions on their own, see clusters.py
+    return expire_jam_sessions(current_app.config['JAM_SESSION_TTL'])
+
+@sweeper.task
+def prune_cluster_tiles():
+    return cluster_cache().prune(current_app.config['CLUSTER_TILE_MAX_AGE'])
+
 @jam_sessions_bp.post('/')
 def add_new_session():
     data = request.get_json()
@@ -88,13 +145,16 @@ def add_new_session():
     s = JamSession(title, message, date, date_posted, lat, lng, session.get('id'))
     
     db.session.add(s)
-    db.session.commit()
+    db.session.flush()
 
+    # the host is the first member, saved in the same transaction as the session
     p = Party(s.id, session.get('id'))
 
     db.session.add(p)
     db.session.commit()
 
+    cluster_cache().invalidate_point(s.lat, s.long)
+
     return redirect(url_for('jam_sessions.get_sessions'))
 
 @jam_sessions_bp.get('/<int:session_id>')
@@ -102,10 +162,12 @@ def get_single_session(session_id: int):
     if not session.get('id'):
         return redirect('/login')
 
-    jam_session = JamSession.query.get(session_id)
+    roster = load_roster(session_id)
+    if roster is None:
+        abort(404)
 
-    is_own_session = jam_session.host_id == session.get('id')
-    return render_template('single_session.html', jam_session=jam_session, Party=Party, UserTable=UserTable, is_own_session=is_own_session, distribution_url=distribution_url)
+    is_own_session = roster.jam_session.host_id == session.get('id')
+    return render_template('single_session.html', jam_session=roster.jam_session, roster=roster, is_own_session=is_own_session, distribution_url=aws.distribution_url())
 
 
 @jam_sessions_bp.post('/<int:session_id>/edit/delete')
@@ -117,42 +179,36 @@ def delete_session(session_id: int):
     else:
         db.session.delete(jam_session)
         db.session.commit()
+        cluster_cache().invalidate_point(jam_session.lat, jam_session.long)
     
     return redirect(url_for('jam_sessions.get_sessions'))
 
 @jam_sessions_bp.post('<int:session_id>/join')
 def join_session(session_id: int):
-    jam_session = JamSession.query.get(session_id)
-    party = Party.query.filter_by(session_id=jam_session.id, user_id=session.get('id')).first()
-    if not party:
-        party = Party(jam_session.id, session.get('id'))
-        db.session.add(party)
-        db.session.commit()
-        flash(f"Joined {UserTable.query.get(jam_session.host_id).user_name}'s Session!")
-        return redirect(url_for('jam_sessions.get_sessions'))
+    if not session.get('id'):
+        return redirect('/login')
+
+    result = join_jam_session(session_id, session.get('id'))
+    if result is None:
+        abort(404)
+
+    joined, host_user_name = result
+    if joined:
+        flash(f"Joined {host_user_name}'s Session!")
     else:
         flash('You are already in this session!')
-        return redirect(url_for('jam_sessions.get_sessions'))
+    return redirect(url_for('jam_sessions.get_sessions'))
 
 @jam_sessions_bp.post('<int:session_id>/leave')
 def leave_session(session_id: int):
-    party = Party.query.filter_by(session_id=session_id, user_id=session.get('id')).first()
-    if party:
-        db.session.delete(party)
-        db.session.commit()
-        return redirect(url_for('jam_sessions.get_sessions'))
-    else:
-        return redirect(url_for('jam_sessions.get_sessions'))
+    leave_jam_session(session_id, session.get('id'))
+    return redirect(url_for('jam_sessions.get_sessions'))
     
 @jam_sessions_bp.post('<int:session_id>/edit/<int:user_id>')
 def kick_user_from_session(session_id: int, user_id: int):
-    party = Party.query.filter_by(session_id=session_id, user_id=user_id).first()
-    if not party:
-        return redirect(url_for('jam_sessions.get_single_session', session_id=session_id))
-    else:
-        db.session.delete(party)
-        db.session.commit()
-        return redirect(url_for('jam_sessions.get_single_session', session_id=session_id))
+    # only removes the member if the current user hosts the session
+    leave_jam_session(session_id, user_id, host_id=session.get('id'))
+    return redirect(url_for('jam_sessions.get_single_session', session_id=session_id))
 
     
 @jam_sessions_bp.post('<int:session_id>/edit')
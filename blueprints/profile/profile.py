@@ -2,15 +2,15 @@ from flask import Blueprint, render_template, redirect, url_for, request, abort,
 from dotenv import load_dotenv
 import os
 from datetime import datetime
-from flask_bcrypt import bcrypt
-from models import db, UserTable, JamSession, Party,Post
+from auth import passwords, HasherBusy
+from models import db, UserTable, JamSession, Party,Post, bump_post_versions_for_user, change_stamps, user_displays
+from http_cache import http_cache
 from flask import current_app
-from bucket_wrapper import BucketWrapper
-import boto3
+from aws_clients import aws
 from werkzeug.utils import secure_filename
 from PIL import Image, ImageDraw, ImageFont
 from boto3 import exceptions
-import time
+from cleanup import reaper
 
 
 
@@ -20,39 +20,11 @@ load_dotenv()
 profile_bp = Blueprint('profiles', __name__, template_folder='templates', static_url_path='/static')
 
 
-#Create AWS session
-aws = boto3.Session(
-                aws_access_key_id= os.getenv('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key= os.getenv('AWS_SECRET_ACCESS_KEY'),
-            )
-
-# Create clients from session
-s3_client = aws.client('s3')
-s3_resource = aws.resource('s3')
-s3_distr = aws.client('cloudfront')
-s3_transcoder = aws.client('elastictranscoder', 'us-east-1')
-
-# Get CloudFront distribution
-distribution = s3_distr.get_distribution(Id="E2CLJ3WM17V7LF")
-
-# URL for distribution, append object keys to url to access 
-distribution_url = f'https://{distribution["Distribution"]["DomainName"]}/'
-
-# Get specific bucket from s3
-riff_bucket = s3_resource.Bucket('riffbucket-itsc3155')
-
-# Wrap bucket to access specific funcionality
-bucket_wrapper = BucketWrapper(riff_bucket)
-
-upload_bucket = s3_resource.Bucket('riffbucket-itsc3155-upload')
-upload_wrapper = BucketWrapper(upload_bucket)
-
-stashed_files = []
-
-
 @profile_bp.get('/')
 def get_profile():
     user_id = session.get('id')
+    if user_id:
+        http_cache.check('profile', user_id, change_stamps(f'user:{user_id}'), http_cache.time_bucket())
     user = UserTable.query.get(user_id)
 
     user_posts = Post.query.filter_by(user_id=user.id).order_by(Post.date_posted.desc()).all()
@@ -66,7 +38,7 @@ def get_profile():
     user_posts = Post.query.filter_by(user_id=user.id).order_by(Post.date_posted.desc()).all()
     flask_env = current_app.config['FLASK_ENV']
 
-    return render_template('user_prof.html', user=user, user_posts=user_posts, is_own_profile=True, can_edit=True, distribution_url=distribution_url if current_app.config['FLASK_ENV'] == 'prod' else '', flask_env=current_app.config['FLASK_ENV'])
+    return render_template('user_prof.html', user=user, user_posts=user_posts, is_own_profile=True, can_edit=True, distribution_url=aws.distribution_url() if current_app.config['FLASK_ENV'] == 'prod' else '', flask_env=current_app.config['FLASK_ENV'])
 @profile_bp.get('/settings')
 def get_settings():
     if not session.get('id'):
@@ -80,14 +52,15 @@ def get_settings():
     current_user = UserTable.query.get(session.get('id'))
     private_setting = current_user.private
 
-    print(f'{distribution_url}/images/pfps{current_user.id}.png')
+    print(f'{aws.distribution_url()}/images/pfps{current_user.id}.png')
 
-    return render_template('settings.html', user=current_user, private_setting=private_setting, distribution_url= distribution_url)
+    return render_template('settings.html', user=current_user, private_setting=private_setting, distribution_url=aws.distribution_url())
 
 # To view another users profile
 @profile_bp.get('/<int:user_id>')
 def view_profile(user_id: int):
     current_user_id = session.get('id')
+    http_cache.check('profile', user_id, change_stamps(f'user:{user_id}'), http_cache.time_bucket())
     user = UserTable.query.get(user_id)
 
     if not user:
@@ -101,7 +74,7 @@ def view_profile(user_id: int):
     flask_env = current_app.config['FLASK_ENV']
 
     if current_app.config['FLASK_ENV'] == 'prod':
-        return render_template('user_prof.html', user=user, user_posts=user_posts,  is_private=is_private, is_own_profile=is_own_profile, can_edit=can_edit, distribution_url=distribution_url, flask_env=flask_env) 
+        return render_template('user_prof.html', user=user, user_posts=user_posts,  is_private=is_private, is_own_profile=is_own_profile, can_edit=can_edit, distribution_url=aws.distribution_url(), flask_env=flask_env) 
     else:
         return render_template('user_prof.html', user=user, user_posts=user_posts,  is_private=is_private, is_own_profile=is_own_profile, can_edit=can_edit, distribution_url='', flask_env=flask_env)
 
@@ -156,6 +129,9 @@ def update_credentials():
 
         if changes_made:
             db.session.commit()
+            user_displays.invalidate(user.id)
+            # cached post cards show this user, render them again
+            bump_post_versions_for_user(user.id)
             flash('Credentials updated successfully', 'success')
         else:
             flash('No changes detected', 'error')
@@ -181,9 +157,8 @@ def change_password():
         new_password = request.form.get('newPassword')
 
         if current_password and new_password:
-            if bcrypt.checkpw(current_password.encode('utf-8'), user.password.encode('utf-8')):
-                hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-                user.password = hashed_password
+            if passwords.verify(user.password, current_password):
+                user.password = passwords.hash(new_password)
                 db.session.commit()
                 flash('Password updated successfully.', 'success')
             else:
@@ -193,7 +168,9 @@ def change_password():
 
         return redirect(url_for('profiles.get_settings'))
 
-
+    except HasherBusy:
+        flash('Too many people are logging in right now, try again in a moment', 'error')
+        return redirect(url_for('profiles.get_settings'))
     except Exception as e:
         flash(f'Error changing password: {e}', 'error')
         return redirect(url_for('profiles.get_settings'))
@@ -229,10 +206,13 @@ def upload_profile_photo():
             uploaded_file.save(f"{unique_filename}")
 
             try:
-                upload_wrapper.add_object(s3_client, unique_filename, f"pfps/{unique_filename}")
+                aws.bucket(current_app.config['UPLOAD_BUCKET_NAME']).add_object(aws.s3_client, unique_filename, f"pfps/{unique_filename}")
 
                 user = UserTable.query.get(user_id)
+                user.avatar_version = UserTable.avatar_version + 1
                 db.session.commit()
+                user_displays.invalidate(user_id)
+                bump_post_versions_for_user(user_id)
 
                 flash('Profile photo uploaded successfully', 'success')
             except exceptions.S3UploadFailedError as e:
@@ -240,13 +220,13 @@ def upload_profile_photo():
                 flash('Failed to upload the profile photo', 'error')
 
             copy_sources = {
-                'Bucket': 'riffbucket-itsc3155-upload',
+                'Bucket': current_app.config['UPLOAD_BUCKET_NAME'],
                 'Key': f'pfps/{unique_filename}'
             }
 
-            riff_bucket.copy(copy_sources, f'images/pfps/{unique_filename}')
+            aws.bucket(current_app.config['BUCKET_NAME']).bucket.copy(copy_sources, f'images/pfps/{unique_filename}')
 
-            remove_file(unique_filename)
+            reaper.schedule_removal(unique_filename)
         # Dev path
         else:
             file_path = os.path.join('static/uploads/pfps/', f'{user_id}.jpg')
@@ -254,7 +234,10 @@ def upload_profile_photo():
 
             user = UserTable.query.get(user_id)
             user.profile_photo_path = file_path
+            user.avatar_version = UserTable.avatar_version + 1
             db.session.commit()
+            user_displays.invalidate(user_id)
+            bump_post_versions_for_user(user_id)
 
             print("Uploaded file received:", filename)
             print("Is file allowed:", allowed_file(filename))
@@ -276,23 +259,3 @@ def delete_post(post_id):
 
     return redirect(url_for('profiles.get_profile'))
 
-
-def remove_file(filename):
-    max_remove_attempts = 5
-    attempts = 0
-    removed = False
-    while removed == False and attempts < max_remove_attempts:
-        try:
-            os.remove(filename)
-            removed = True
-            print("% s removed successfully" % filename)
-        except OSError as error:
-            print(error)
-            print('Filepath cannot be removed.')
-
-        if attempts == 5:
-            stashed_files.append(filename)
-            break
-        print(f'Removal attempt number {attempts}')
-        attempts += 1
-        time.sleep(3)
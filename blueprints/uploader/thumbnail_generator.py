@@ -1,17 +1,87 @@
-import os, sys
-from moviepy.editor import VideoFileClip
-from PIL import Image
+import os, re, subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import imageio_ffmpeg
+
+# Thumbnails are cut with the ffmpeg binary that ships with imageio-ffmpeg.
+# ffmpeg seeks straight to the middle of the video (-ss before -i) and decodes
+# a single frame, then one filter graph scales that frame to every size and
+# writes every format, so a thumbnail costs the same for a 10 second clip and
+# a 2 hour one.
+
+# The first width is the main thumbnail, saved as <name>.<ext>, the others as <name>-<width>.<ext>
+THUMBNAIL_WIDTHS = (1280, 640, 320)
+THUMBNAIL_FORMATS = {
+    'jpg': ['-q:v', '3'],
+    'webp': ['-c:v', 'libwebp', '-quality', '80'],
+}
+
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def probe_duration(video_file) -> float:
+    """ reads the duration from the container header, nothing is decoded """
+    result = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-i', video_file],
+                            capture_output=True, text=True)
+    match = DURATION_PATTERN.search(result.stderr)
+    if not match:
+        raise OSError(f'Could not read the duration of {video_file}')
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def thumbnail_paths(video_file, output_dir, widths=THUMBNAIL_WIDTHS, formats=THUMBNAIL_FORMATS) -> dict:
+    name = os.path.splitext(os.path.basename(video_file))[0]
+    paths = {}
+    for i, width in enumerate(widths):
+        suffix = '' if i == 0 else f'-{width}'
+        for ext in formats:
+            paths[(width, ext)] = os.path.join(output_dir, f'{name}{suffix}.{ext}')
+    return paths
+
+
+def generate_thumbnails(video_file, output_dir, widths=THUMBNAIL_WIDTHS, formats=THUMBNAIL_FORMATS, at=None) -> list:
+    """ every size and format of one frame (the middle one unless at is given) in a single ffmpeg run """
+    if not os.path.exists(video_file):
+        raise OSError(f'Could not load file from given path! {video_file}')
+
+    if at is None:
+        at = probe_duration(video_file) / 2
+
+    paths = thumbnail_paths(video_file, output_dir, widths, formats)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # split the one decoded frame into a branch per output, never upscaling small videos
+    branches = [f'[t{i}]' for i in range(len(paths))]
+    filters = [f'[0:v]split={len(paths)}{"".join(branches)}']
+    outputs = []
+    for i, ((width, ext), path) in enumerate(paths.items()):
+        filters.append(f"{branches[i]}scale=w='min({width},iw)':h=-2[o{i}]")
+        outputs += ['-map', f'[o{i}]', '-frames:v', '1', *formats[ext], path]
+
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-v', 'error', '-y',
+               '-ss', f'{at:.3f}', '-i', video_file,
+               '-filter_complex', ';'.join(filters), *outputs]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise OSError(f'ffmpeg could not thumbnail {video_file}: {result.stderr.strip()}')
+
+    return list(paths.values())
+
 
 def generate_thumbnail(video_file, output_dir) -> None:
     try:
-        if os.path.exists:
-            file_output_name = video_file[16:-4]
-            clip = VideoFileClip(video_file)
-            frame = int((clip.duration)+1) // 2
-            thumbnail = clip.get_frame(frame)
-            new_image_file = os.path.join(output_dir, f'{file_output_name}.jpg')
-            new_image = Image.fromarray(thumbnail)
-            new_image.save(new_image_file)
+        generate_thumbnails(video_file, output_dir)
     except OSError:
         print('Could not load file from given path!')
         raise
+
+
+def backfill_thumbnails(video_files, output_dir, workers=None) -> dict:
+    """ thumbnail many videos across a process pool, returns {video: error or None} """
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate_thumbnails, v, output_dir): v for v in video_files}
+        for future in as_completed(futures):
+            error = future.exception()
+            results[futures[future]] = str(error) if error else None
+    return results
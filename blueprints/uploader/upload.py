@@ -1,15 +1,17 @@
-from flask import Blueprint, flash, render_template, redirect, url_for, request, abort, session
+from flask import Blueprint, flash, render_template, redirect, url_for, request, abort, session, jsonify
 from dotenv import load_dotenv
 import os
+import shutil
 from datetime import datetime
-from models import db, Post, CommentSection
+from models import db, Post, CommentSection, touch
 from werkzeug.utils import secure_filename
 from flask import current_app
-import boto3
-from bucket_wrapper import BucketWrapper
-from blueprints.uploader.thumbnail_generator import generate_thumbnail
+from aws_clients import aws
+from bucket_wrapper import part_size_for
+from blueprints.uploader.thumbnail_generator import generate_thumbnails
+from media_index import media_index
+from jobs import handler, enqueue
 from uuid import uuid4
-from time import sleep
 from models import db, UserTable, Comment, CommentSection, Party, Post, insert_BLOB_user
 from boto3 import exceptions
 
@@ -19,30 +21,11 @@ load_dotenv()
 upload_bp = Blueprint('upload', __name__, template_folder='templates', static_folder='static')
 
 
-aws = boto3.Session(
-                aws_access_key_id= os.getenv('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key= os.getenv('AWS_SECRET_ACCESS_KEY'),
-            ) 
-
-s3_client = aws.client('s3')
-s3_resource = aws.resource('s3')
-s3_transcoder = aws.client('elastictranscoder', 'us-east-1')
-
-upload_bucket = s3_resource.Bucket('riffbucket-itsc3155-upload')
-
-upload_bucket_wrapper = BucketWrapper(upload_bucket)
-
-stashed_files = []
-
 @upload_bp.get('/')
 def get_upload_page():
     if not session.get('id'):
         return redirect('/login')
     
-    if stashed_files:
-        for f in stashed_files:
-            remove_file(f)
-    
     return render_template('upload_video.html')
 
 
@@ -61,89 +44,139 @@ def upload_video():
         title = request.form.get('title')
         message = request.form.get('description')
 
-        current_date = datetime.now().strftime('%Y-%m-%dT%H:%M')
-
         file_key = str(uuid4())
 
-    # Production path
-        if current_app.config['FLASK_ENV'] == 'prod':
-        
-            post = Post(video_id=file_key, title=title, msg=message, ratio=0, date=current_date, user_id=session.get('id'))
+        if not store_video(uploaded_file.stream, file_key, file_ext, upload_length()):
+            flash('Could not upload file.')
+            return redirect(url_for('upload.get_upload_page'))
 
+        save_post(file_key, file_ext, title, message)
             
-            uploaded_file.save(filename)
-            upload_bucket_wrapper.add_object(s3_client, filename, filename)
-            try:
-                response = s3_transcoder.create_job(
-                    PipelineId = current_app.config["PIPELINE_ID"],
-                    Input={
-                        'Key': f'{filename}',
-                        'FrameRate': 'auto',
-                        'Resolution': 'auto',
-                        'AspectRatio': 'auto',
-                        'Interlaced': 'auto',
-                        'Container': 'auto',
-                    },
-                    Output={
-                        'Key': f'{file_key}.mp4',
-                        'ThumbnailPattern': 'thumbnails/' + file_key + '-{count}',
-                        'Rotate': 'auto',
-                        'PresetId': '1351620000001-000010',
-                    },
-                    OutputKeyPrefix='videos/'
-                )
-
-
-                remove_file(filename)
-
-                db.session.add(post)
-                
-                db.session.commit() 
-
-                comment_section = CommentSection(post.id)
-
-                db.session.add(comment_section)
-
-                db.session.commit()    
-            except exceptions.S3UploadFailedError as ex:
-                print(f'Could not upload file. {ex}')
-            return redirect(url_for('profiles.get_profile'))
-    # Development Path
-        else:
-            post = Post(video_id=file_key, title=title, msg=message, ratio=0, date=current_date, user_id=session.get('id'))
-            
-            db.session.add(post)
-        
-            uploaded_file.save(os.path.join('static/uploads/videos/', f'{file_key}.mp4'))
-            generate_thumbnail(f'{current_app.config["UPLOAD_PATH"]}/videos/{file_key}.mp4', f'{current_app.config["UPLOAD_PATH"]}/thumbnails/')
+        return redirect(url_for('profiles.get_profile'))
 
-            db.session.commit()
+# Same as /new but the request body is the raw file, so it is piped to storage
+# as it arrives instead of being parsed into a form and spooled to disk first
+@upload_bp.post('/stream')
+def stream_video():
+    if not session.get('id'):
+        abort(401)
 
-            comment_section = CommentSection(post.id)
+    filename = secure_filename(request.args.get('filename', ''))
+    file_ext = os.path.splitext(filename)[1]
+    if filename == '' or file_ext not in current_app.config["UPLOAD_EXTENSIONS"]:
+        abort(400)
 
-            db.session.add(comment_section)
+    title = request.args.get('title')
+    message = request.args.get('description')
 
-            db.session.commit()
-            
-        return redirect(url_for('profiles.get_profile'))
+    file_key = str(uuid4())
+
+    if not store_video(request.stream, file_key, file_ext, upload_length()):
+        abort(502)
+
+    post = save_post(file_key, file_ext, title, message)
+
+    return jsonify(post_id=post.id, video_id=file_key, redirect=url_for('profiles.get_profile')), 201
 
 
-def remove_file(filename):
-    max_remove_attempts = 5
-    attempts = 0
-    removed = False
-    while removed == False and attempts < max_remove_attempts:
-        try:
-            os.remove(filename)
-            removed = True
-            print("% s removed successfully" % filename)
-        except OSError as error:
-            print(error)
-            print('Filepath cannot be removed.')
-
-        if attempts == 5:
-            stashed_files.append(filename)
-            break
-        print(f'Removal attempt number {attempts}')
-        attempts += 1
-        sleep(3)
+def upload_length() -> int:
+    # the file can't be bigger than the body, a chunked body has no length up front but is cut off at MAX_CONTENT_LENGTH
+    return request.content_length or current_app.config['MAX_CONTENT_LENGTH']
+
+
+# Only the part that needs the request body happens here, the rest is queued
+# for the job workers so the request returns as soon as the file is stored
+def store_video(stream, file_key, file_ext, length) -> bool:
+    # Production path
+    if current_app.config['FLASK_ENV'] == 'prod':
+        input_key = f'{file_key}{file_ext}'
+        part_size = part_size_for(length, current_app.config['UPLOAD_PART_SIZE'])
+        uploaded = aws.bucket(current_app.config['UPLOAD_BUCKET_NAME']).upload_stream(
+            aws.s3_client, stream, input_key, part_size)
+        return uploaded
+    # Development Path
+    else:
+        with open(os.path.join(f'{current_app.config["UPLOAD_PATH"]}/videos', f'{file_key}.mp4'), 'wb') as f:
+            shutil.copyfileobj(stream, f, current_app.config['UPLOAD_CHUNK_SIZE'])
+        media_index(f'{current_app.config["UPLOAD_PATH"]}/videos').add(f'{file_key}.mp4')
+        return True
+
+
+def save_post(file_key, file_ext, title, message) -> Post:
+    current_date = datetime.now().strftime('%Y-%m-%dT%H:%M')
+
+    # dev only cuts a thumbnail, audio has no frame to cut so it is ready as is
+    audio_in_dev = current_app.config['FLASK_ENV'] != 'prod' and file_ext in current_app.config['AUDIO_EXTENSIONS']
+
+    post = Post(video_id=file_key, title=title, msg=message, ratio=0, date=current_date, user_id=session.get('id'),
+                status='ready' if audio_in_dev else 'processing')
+    db.session.add(post)
+    db.session.flush()
+
+    comment_section = CommentSection(post.id)
+    db.session.add(comment_section)
+
+    db.session.commit()
+
+    if current_app.config['FLASK_ENV'] == 'prod':
+        enqueue('transcode', {'post_id': post.id, 'input_key': f'{file_key}{file_ext}', 'file_key': file_key})
+    elif not audio_in_dev:
+        enqueue('thumbnail', {'post_id': post.id, 'file_key': file_key})
+    return post
+
+
+def set_post_status(post_id, status):
+    # a bulk update skips the Post events, so the version and change stamps are bumped here
+    user_id = db.session.execute(Post.__table__.update().where(Post.id == post_id)
+                                 .values(status=status, version=Post.version + 1).returning(Post.user_id)).scalar()
+    if user_id is not None:
+        touch('feed', f'user:{user_id}')
+    db.session.commit()
+
+def upload_failed(payload, error):
+    print(f'Processing post {payload["post_id"]} failed: {error}')
+    set_post_status(payload['post_id'], 'failed')
+
+
+@handler('transcode', on_failure=upload_failed)
+def transcode_job(payload):
+    file_key = payload['file_key']
+    response = aws.transcoder.create_job(
+        PipelineId = current_app.config["PIPELINE_ID"],
+        Input={
+            'Key': payload['input_key'],
+            'FrameRate': 'auto',
+            'Resolution': 'auto',
+            'AspectRatio': 'auto',
+            'Interlaced': 'auto',
+            'Container': 'auto',
+        },
+        Output={
+            'Key': f'{file_key}.mp4',
+            'ThumbnailPattern': 'thumbnails/' + file_key + '-{count}',
+            'Rotate': 'auto',
+            'PresetId': '1351620000001-000010',
+        },
+        OutputKeyPrefix='videos/'
+    )
+    enqueue('check_transcode', {'post_id': payload['post_id'], 'job_id': response['Job']['Id']},
+            current_app.config['TRANSCODE_POLL_INTERVAL'])
+
+@handler('check_transcode', on_failure=upload_failed)
+def check_transcode_job(payload):
+    status = aws.transcoder.read_job(Id=payload['job_id'])['Job']['Status']
+    if status in ('Submitted', 'Progressing'):
+        enqueue('check_transcode', payload, current_app.config['TRANSCODE_POLL_INTERVAL'])
+    elif status == 'Complete':
+        set_post_status(payload['post_id'], 'ready')
+    else:
+        upload_failed(payload, f'transcoder job {payload["job_id"]} ended as {status}')
+
+@handler('thumbnail', on_failure=upload_failed)
+def thumbnail_job(payload):
+    file_key = payload['file_key']
+    thumbnails = generate_thumbnails(f'{current_app.config["UPLOAD_PATH"]}/videos/{file_key}.mp4', f'{current_app.config["UPLOAD_PATH"]}/thumbnails/')
+    for path in thumbnails:
+        media_index(f'{current_app.config["UPLOAD_PATH"]}/thumbnails').add(os.path.basename(path))
+    set_post_status(payload['post_id'], 'ready')
+
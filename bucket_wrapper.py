@@ -2,6 +2,10 @@ import boto3
 from botocore.exceptions import ClientError
 from boto3 import logging
 import sys
+import math
+
+# S3 refuses to complete a multipart upload with more parts than this
+MAX_PARTS = 10_000
 
 class BucketWrapper:
     def __init__(self, s3_bucket) -> None:
@@ -59,7 +63,57 @@ class BucketWrapper:
             return False
         else:
             return True
-        
 
+    def upload_stream(self, client, stream, object_id, part_size=8 * 1_048_576) -> bool:
+        """ multipart upload straight from a file-like object, holding at most one part in memory """
+        s3_client = client
+        try:
+            upload = s3_client.create_multipart_upload(Bucket=self.name, Key=object_id)
+        except ClientError:
+            # nothing was started, so there is nothing to abort
+            logging.exception('Could not start upload.')
+            return False
+        upload_id = upload['UploadId']
+        parts = []
+        try:
+            part_number = 1
+            while True:
+                part = read_part(stream, part_size)
+                # Every part but the last has to be full size, an empty file is one empty part
+                if not part and parts:
+                    break
+                response = s3_client.upload_part(Bucket=self.name, Key=object_id, UploadId=upload_id,
+                                                  PartNumber=part_number, Body=part)
+                parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+                part_number += 1
+                if len(part) < part_size:
+                    break
+
+            s3_client.complete_multipart_upload(Bucket=self.name, Key=object_id, UploadId=upload_id,
+                                                MultipartUpload={'Parts': parts})
+        except ClientError:
+            logging.exception('Could not upload stream.')
+            s3_client.abort_multipart_upload(Bucket=self.name, Key=object_id, UploadId=upload_id)
+            return False
+        except BaseException:
+            # e.g. the client went away mid upload, don't leave the parts billed in the bucket
+            s3_client.abort_multipart_upload(Bucket=self.name, Key=object_id, UploadId=upload_id)
+            raise
+        else:
+            return True
+
+
+def read_part(stream, part_size) -> bytes:
+    """ read until part_size bytes or the end of the stream, streams may return short reads """
+    part = bytearray()
+    while len(part) < part_size:
+        chunk = stream.read(part_size - len(part))
+        if not chunk:
+            break
+        part += chunk
+    return bytes(part)
 
 
+def part_size_for(length, part_size) -> int:
+    """ part_size, or bigger if length bytes would not fit in MAX_PARTS parts of it """
+    return max(part_size, math.ceil(length / MAX_PARTS))
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Deletes temporary files without ever making a request wait. schedule_removal()
+# tries once and returns; files that can't be removed yet (still open, locked
+# on Windows, ...) go into a manifest in the instance folder and a background
+# thread retries them with exponential backoff. The manifest is SQLite so every
+# worker process can share it and files survive a restart; the sweeper starts
+# the thread (resume_pending) when an earlier or crashed process left some.
+
+
+class FileReaper:
+    def __init__(self) -> None:
+        self.path = None
+        self.base_delay = 3
+        self.max_delay = 600
+        self.max_attempts = 10
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics = {'removed': 0, 'retried': 0, 'gave_up': 0, 'scheduled': 0}
+
+    def init_app(self, app) -> None:
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.path = os.path.join(app.instance_path, app.config['CLEANUP_MANIFEST_PATH'])
+        self.base_delay = app.config['CLEANUP_BASE_DELAY']
+        self.max_delay = app.config['CLEANUP_MAX_DELAY']
+        self.max_attempts = app.config['CLEANUP_MAX_ATTEMPTS']
+        with self._connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute('''
+                create table if not exists pending_removals (
+                    path text primary key,
+                    attempts integer not null default 0,
+                    next_try real not null,
+                    last_error text null,
+                    added_at real not null
+                )''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def schedule_removal(self, path: str) -> bool:
+        """ remove path now if possible, otherwise leave it to the reaper. Returns whether it is gone already """
+        self._count('scheduled')
+        if self._try_remove(path):
+            return True
+
+        with self._connect() as conn:
+            conn.execute('insert or ignore into pending_removals (path, next_try, added_at) values (?, ?, ?)',
+                         (os.path.abspath(path), time.time() + self.base_delay, time.time()))
+        self.start()
+        self._wake.set()
+        return False
+
+    def _try_remove(self, path: str, error_out: list = None) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            if error_out is not None:
+                error_out.append(str(error))
+            return False
+        self._count('removed')
+        return True
+
+    def run_once(self) -> float:
+        """ retry every due file, returns seconds until the next one is due (or None if none are left) """
+        now = time.time()
+        with self._connect() as conn:
+            due = conn.execute('select path, attempts from pending_removals where next_try <= ?', (now,)).fetchall()
+
+        for path, attempts in due:
+            errors = []
+            if self._try_remove(path, errors):
+                with self._connect() as conn:
+                    conn.execute('delete from pending_removals where path = ?', (path,))
+                continue
+
+            attempts += 1
+            if attempts >= self.max_attempts:
+                print(f'[{datetime.now()}] giving up on removing {path}: {errors[0]}')
+                self._count('gave_up')
+                with self._connect() as conn:
+                    conn.execute('delete from pending_removals where path = ?', (path,))
+                continue
+
+            self._count('retried')
+            delay = min(self.base_delay * 2 ** attempts, self.max_delay)
+            with self._connect() as conn:
+                conn.execute('update pending_removals set attempts = ?, next_try = ?, last_error = ? where path = ?',
+                             (attempts, time.time() + delay, errors[0], path))
+
+        with self._connect() as conn:
+            next_try = conn.execute('select min(next_try) from pending_removals').fetchone()[0]
+        return None if next_try is None else max(next_try - time.time(), 0)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                wait = self.run_once()
+            except sqlite3.Error as error:
+                print(f'[{datetime.now()}] cleanup manifest error: {error}')
+                wait = self.max_delay
+            self._wake.clear()
+            self._wake.wait(self.max_delay if wait is None else wait)
+
+    def start(self) -> None:
+        """ start the background thread once per process, it also picks up files left by earlier processes """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='file-reaper', daemon=True)
+                self._thread.start()
+
+    def resume_pending(self) -> int:
+        """ sweeper task, starts the thread for files waiting in the manifest, returns how many there were """
+        if self._thread is not None and self._thread.is_alive():
+            return 0
+        with self._connect() as conn:
+            pending = conn.execute('select count(*) from pending_removals').fetchone()[0]
+        if pending:
+            self.start()
+        return pending
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._metrics[name] += 1
+
+    def metrics(self) -> dict:
+        """ this process's counters plus what is still waiting in the shared manifest """
+        with self._lock:
+            metrics = dict(self._metrics)
+        with self._connect() as conn:
+            metrics['pending'], metrics['oldest_pending'] = conn.execute(
+                'select count(*), min(added_at) from pending_removals').fetchone()
+        return metrics
+
+
+reaper = FileReaper()
@@ -0,0 +1,196 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from itertools import chain
+from flask import current_app
+from sqlalchemy import func, or_
+from geo import cell_ranges
+from models import db, JamSession, jam_session_cutoff
+
+# Server side clustering for the jam session map. Below CLUSTER_MAX_ZOOM the map
+# shows one marker per cluster (count + centroid) instead of one pin per
+# session. The world is cut into tiles of 360 / 2**zoom degrees and every tile
+# into CLUSTER_CELLS x CLUSTER_CELLS clusters; a tile is one GROUP BY over the
+# grid_cell index.
+#
+# Tiles are cached in a SQLite file in the instance folder so every web process
+# shares them. Creating or deleting a session drops the tiles under it at every
+# zoom level, and each tile remembers when its first session expires, so expiry
+# needs no invalidation at all. Dropping a tile also bumps its generation, and a
+# build only stores its result if the generation it started with is still the
+# current one, so a build that read the database before the change committed
+# can't put the stale tile back.
+
+CLUSTER_CELLS = 4
+
+# a viewport wider than this many tiles is asking for the wrong zoom
+MAX_TILES = 64
+
+
+def tile_degrees(zoom: int) -> float:
+    return 360 / 2 ** zoom
+
+def tile_of(lat: float, lng: float, zoom: int) -> tuple:
+    degrees = tile_degrees(zoom)
+    # lng 180 and lat 90 are on the last tile's edge, not the start of one past it
+    return min(int((lng + 180) // degrees), math.ceil(360 / degrees) - 1), \
+        min(int((lat + 90) // degrees), math.ceil(180 / degrees) - 1)
+
+def _tile_ranges(south: float, west: float, north: float, east: float, zoom: int) -> tuple:
+    """ ([column ranges], row range) the box touches, two column ranges when it crosses the antimeridian """
+    degrees = tile_degrees(zoom)
+    columns = math.ceil(360 / degrees)
+    first_x, first_y = tile_of(south, west, zoom)
+    last_x, last_y = tile_of(north, east, zoom)
+
+    if west <= east:
+        xs = [range(first_x, last_x + 1)]
+    else:
+        xs = [range(first_x, columns), range(0, last_x + 1)]
+    return xs, range(first_y, last_y + 1)
+
+def count_tiles(south: float, west: float, north: float, east: float, zoom: int) -> int:
+    """ len(tiles_in_bbox(...)) without building the list, so oversized viewports are turned away cheaply """
+    xs, ys = _tile_ranges(south, west, north, east, zoom)
+    return sum(len(r) for r in xs) * len(ys)
+
+def tiles_in_bbox(south: float, west: float, north: float, east: float, zoom: int) -> list:
+    """ (x, y) of every tile the box touches, west > east means it crosses the antimeridian """
+    xs, ys = _tile_ranges(south, west, north, east, zoom)
+    return [(x, y) for y in ys for x in chain(*xs)]
+
+
+def build_tile(zoom: int, x: int, y: int, ttl: int) -> tuple:
+    """ (clusters, expires) for one tile, expires is when its first session drops off the map """
+    degrees = tile_degrees(zoom)
+    west, south = x * degrees - 180, y * degrees - 90
+    east, north = west + degrees, min(south + degrees, 90)
+    cell = degrees / CLUSTER_CELLS
+
+    row = func.floor((JamSession.lat - south) / cell)
+    col = func.floor((JamSession.long - west) / cell)
+    ranges = [JamSession.grid_cell.between(first, last) for first, last in cell_ranges(south, west, north, east)]
+    rows = db.session.query(func.count(JamSession.id), func.avg(JamSession.lat), func.avg(JamSession.long),
+                            func.min(JamSession.id), func.min(JamSession.date)) \
+        .filter(or_(*ranges),
+                JamSession.lat >= south, JamSession.lat < north,
+                JamSession.long >= west, JamSession.long < east,
+                JamSession.date >= jam_session_cutoff(ttl)) \
+        .group_by(row, col).all()
+
+    clusters = []
+    for count, lat, lng, first_id, _ in rows:
+        cluster = {'lat': float(lat), 'lng': float(lng), 'count': count}
+        # a lone session links straight to its page
+        if count == 1:
+            cluster['id'] = first_id
+        clusters.append(cluster)
+
+    first_date = min((r[4] for r in rows), default=None)
+    expires = first_date.timestamp() + ttl if first_date else None
+    return clusters, expires
+
+
+class ClusterCache:
+    def __init__(self, path: str, max_zoom: int) -> None:
+        self.path = path
+        self.max_zoom = max_zoom
+        with self._connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute('''
+                create table if not exists cluster_tiles (
+                    zoom integer not null,
+                    x integer not null,
+                    y integer not null,
+                    clusters text not null,
+                    expires real null,
+                    built_at real not null,
+                    primary key (zoom, x, y)
+                )''')
+            conn.execute('''
+                create table if not exists cluster_generations (
+                    zoom integer not null,
+                    x integer not null,
+                    y integer not null,
+                    generation integer not null,
+                    bumped_at real not null,
+                    primary key (zoom, x, y)
+                )''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def clusters(self, zoom: int, tiles: list, ttl: int) -> list:
+        """ clusters for every tile, building and storing the ones that are missing or expired """
+        now = time.time()
+        with self._connect() as conn:
+            cached, generations = {}, {}
+            for x, y in tiles:
+                row = conn.execute('select clusters, expires from cluster_tiles where zoom = ? and x = ? and y = ?',
+                                   (zoom, x, y)).fetchone()
+                if row and (row[1] is None or row[1] > now):
+                    cached[(x, y)] = json.loads(row[0])
+                else:
+                    # read before the build reads the database, see invalidate_point
+                    generations[(x, y)] = self._generation(conn, zoom, x, y)
+
+            clusters = []
+            for x, y in tiles:
+                if (x, y) not in cached:
+                    cached[(x, y)], expires = build_tile(zoom, x, y, ttl)
+                    # one statement, so the generation can't change between the check and the write
+                    conn.execute('''
+                        insert or replace into cluster_tiles
+                        select ?, ?, ?, ?, ?, ?
+                        where coalesce((select generation from cluster_generations where zoom = ? and x = ? and y = ?), 0) = ?''',
+                                 (zoom, x, y, json.dumps(cached[(x, y)]), expires, now,
+                                  zoom, x, y, generations[(x, y)]))
+                clusters += cached[(x, y)]
+        return clusters
+
+    def _generation(self, conn, zoom: int, x: int, y: int) -> int:
+        row = conn.execute('select generation from cluster_generations where zoom = ? and x = ? and y = ?',
+                           (zoom, x, y)).fetchone()
+        return row[0] if row else 0
+
+    def invalidate_point(self, lat: float, lng: float) -> None:
+        """ a session was created or deleted here, drop the tiles under it at every zoom level """
+        keys = [(zoom, *tile_of(lat, lng, zoom)) for zoom in range(self.max_zoom + 1)]
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('begin immediate')
+            conn.executemany('''
+                insert into cluster_generations values (?, ?, ?, 1, ?)
+                on conflict (zoom, x, y) do update set generation = generation + 1, bumped_at = excluded.bumped_at''',
+                             [(*key, now) for key in keys])
+            conn.executemany('delete from cluster_tiles where zoom = ? and x = ? and y = ?', keys)
+            conn.execute('commit')
+
+    def prune(self, max_age: float) -> int:
+        """ forget tiles nobody has rebuilt in a while, so browsing the whole world doesn't grow the file forever """
+        with self._connect() as conn:
+            # a build takes seconds at most, a generation this old can't be one a build is still holding
+            conn.execute('delete from cluster_generations where bumped_at < ?', (time.time() - max_age,))
+            return conn.execute('delete from cluster_tiles where built_at < ?', (time.time() - max_age,)).rowcount
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def cluster_cache() -> ClusterCache:
+    """ the app's tile cache, CLUSTER_CACHE_PATH is relative to the instance folder """
+    path = os.path.join(current_app.instance_path, current_app.config['CLUSTER_CACHE_PATH'])
+    with _caches_lock:
+        if path not in _caches:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _caches[path] = ClusterCache(path, current_app.config['CLUSTER_MAX_ZOOM'])
+        return _caches[path]
@@ -11,18 +11,107 @@ DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 
+# filesystem, sql or cookie, see session_store.py. Use sql or cookie with more than one web host
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'filesystem')
 SESSION_PERMANENT = False
 SESSION_TYPE = 'filesystem'
 
+# Password hashing runs on this many threads, with at most AUTH_HASH_QUEUE_LIMIT logins waiting (see auth.py)
+BCRYPT_LOG_ROUNDS = 12
+AUTH_HASH_WORKERS = 4
+AUTH_HASH_QUEUE_LIMIT = 16
+AUTH_HASH_TIMEOUT = 10
+
+# Login attempts allowed in a burst and refilled per minute. memory is per process, sql is shared by every host
+LOGIN_LIMITER_BACKEND = os.getenv('LOGIN_LIMITER_BACKEND', 'memory')
+LOGIN_USER_BURST = 5
+LOGIN_USER_PER_MINUTE = 5
+LOGIN_IP_BURST = 30
+LOGIN_IP_PER_MINUTE = 30
+# Proxies in front of the app (load balancer etc.) whose X-Forwarded-For is trusted for the client ip, 0 for none
+PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', '0'))
+
 MAX_CONTENT_LENGTH = 1_048_576 * 1_048_576
 UPLOAD_EXTENSIONS = ['.mp4', '.mov', '.mp3', '.mkv', '.webm']
+# No video frames, so no thumbnail is cut for these
+AUDIO_EXTENSIONS = ['.mp3']
 UPLOAD_PATH = 'static//uploads'
+# Uploads are streamed to S3 in parts of this size (S3 needs at least 5MB per part)
+UPLOAD_PART_SIZE = 8 * 1_048_576
+UPLOAD_CHUNK_SIZE = 1_048_576
 
 SQLALCHEMY_DATABASE_URI = \
     f'postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
 SQLALCHEMY_TRACK_MODIFICATIONS= False
 
+FEED_PAGE_SIZE = 10
+# Comments shown per post card before "load more", and per page after that
+COMMENTS_PAGE_SIZE = 10
+
+# Rendered post cards are cached by post version (see fragments.py), memory is per process, sqlite is per box
+FRAGMENT_CACHE_BACKEND = os.getenv('FRAGMENT_CACHE_BACKEND', 'memory')
+FRAGMENT_CACHE_MAX_BYTES = 32 * 1_048_576
+FRAGMENT_CACHE_PATH = 'fragments.sqlite3'
+# A sqlite hit only records its use time when the last one is older than this many seconds
+FRAGMENT_CACHE_TOUCH_INTERVAL = 60
+
+# Pages with relative times ("5 minutes ago") are answered with 304 for at most this many seconds (see http_cache.py)
+HTTP_CACHE_TIME_BUCKET = 60
+# Part of every page's ETag along with the templates, change it to drop every cached page at once
+HTTP_CACHE_VERSION = os.getenv('HTTP_CACHE_VERSION', '')
+
+# User names and avatars shown on pages are cached per process (see models.UserDisplayCache)
+USER_CACHE_SIZE = 10_000
+USER_CACHE_TTL = 60
+
+# Per request SQL stats (see query_stats.py): Server-Timing header in dev, one log line per request in prod
+SQL_SLOW_QUERY_MS = 100
+SQL_REPEAT_THRESHOLD = 5
+SQL_SLOWEST_KEPT = 5
+
+# Background jobs (see jobs.py), the queue file lives in the instance folder
+JOB_QUEUE_PATH = 'jobs.sqlite3'
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 5
+JOB_POLL_INTERVAL = 1
+JOB_TIMEOUT = 60 * 30
+TRANSCODE_POLL_INTERVAL = 15
+# Without a separate flask jobs-worker process, each web process runs the due jobs
+# on a thread of its own instead. On by default outside prod
+JOBS_IN_WEB_PROCESS = os.getenv('JOBS_IN_WEB_PROCESS', 'false' if FLASK_ENV == 'prod' else 'true').lower() == 'true'
+
+# Temp files that can't be deleted right away are retried by the reaper (see cleanup.py)
+CLEANUP_MANIFEST_PATH = 'cleanup.sqlite3'
+CLEANUP_BASE_DELAY = 3
+CLEANUP_MAX_DELAY = 60 * 10
+CLEANUP_MAX_ATTEMPTS = 10
+
+# Housekeeping tasks (see sweeper.py) run this often in each web process
+SWEEP_INTERVAL = 60
+
+# Jam sessions drop off the map this many seconds after their date
+JAM_SESSION_TTL = 60 * 5
+# Sessions per page of the list on /sessions/, soonest first
+SESSIONS_PAGE_SIZE = 50
+# Most sessions /sessions/nearby returns for one viewport
+NEARBY_SESSIONS_LIMIT = 500
+
+# Below this zoom the map shows cached clusters instead of pins (see clusters.py)
+CLUSTER_MAX_ZOOM = 13
+CLUSTER_CACHE_PATH = 'clusters.sqlite3'
+CLUSTER_TILE_MAX_AGE = 60 * 60
+
 PFP_PATH = 'images/pfps/'
 VIDEOS_PATH = 'videos/'
 
 PIPELINE_ID = '1700512479814-8qgmq1'
+
+BUCKET_NAME = 'riffbucket-itsc3155'
+UPLOAD_BUCKET_NAME = 'riffbucket-itsc3155-upload'
+TRANSCODER_REGION = 'us-east-1'
+
+# Set DISTRIBUTION_URL to skip the CloudFront lookup entirely, otherwise it is
+# looked up once from DISTRIBUTION_ID and cached in the instance folder
+DISTRIBUTION_ID = 'E2CLJ3WM17V7LF'
+DISTRIBUTION_URL = os.getenv('DISTRIBUTION_URL')
+DISTRIBUTION_URL_CACHE = 'distribution_url'
@@ -0,0 +1,148 @@
+from sqlalchemy import desc, or_, and_, select, true
+from sqlalchemy.orm import aliased
+from datetime import datetime
+from models import db, Post, Comment, CommentSection, time_since_date, user_resolver
+
+# Builds everything the post cards need in a fixed number of queries
+# (posts, comments, users) instead of several per post. Vote and comment
+# totals come from the Post.ratio and Post.comment_count counters, and each
+# card only carries the newest page of comments; the rest are fetched a page
+# at a time with load_comment_page.
+
+
+class CommentView:
+    def __init__(self, comment_id: int, user_id: int, user_name: str, message: str) -> None:
+        self.id = comment_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.message = message
+
+    def __repr__(self) -> str:
+        return f'{self.user_name}: {self.message}'
+
+
+class PostCard:
+    def __init__(self, post: Post, author_name: str, score: int, comments: list, comments_cursor: str = None) -> None:
+        self.id = post.id
+        self.video_id = post.video_id
+        self.title = post.title
+        self.msg = post.msg
+        self.date_posted = post.date_posted
+        self.user_id = post.user_id
+        self.author_name = author_name
+        self.score = score
+        self.time_since = time_since_date(post.date_posted)
+        self.comments = comments
+        self.comment_count = post.comment_count
+        # where "load more" picks up, None when every comment is already shown
+        self.comments_cursor = comments_cursor
+
+    def __repr__(self) -> str:
+        return f'{self.user_id}, {self.title}'
+
+
+# Cursors are the (date_posted, id) of the last post on the previous page, so
+# every page is an index range scan no matter how deep into the feed it is
+def encode_cursor(post) -> str:
+    return f'{post.date_posted.isoformat()}_{post.id}'
+
+
+# Comments page the same way on (post_time, id)
+def encode_comment_cursor(comment) -> str:
+    return f'{comment.post_time.isoformat()}_{comment.id}'
+
+
+def decode_cursor(cursor: str):
+    date_posted, post_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(date_posted), int(post_id)
+
+
+def load_feed_posts(cursor: str = None, limit: int = 10):
+    """ returns (posts, cursor of the next page or None) """
+    # Posts still being processed by the upload jobs stay out of the feed
+    query = Post.query.filter(Post.status == 'ready')
+
+    if cursor:
+        date_posted, post_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Post.date_posted < date_posted,
+            and_(Post.date_posted == date_posted, Post.id < post_id)
+        ))
+
+    # One extra row tells us whether there is another page without a count(*)
+    posts = query.order_by(desc(Post.date_posted), desc(Post.id)).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1])
+
+    return posts, next_cursor
+
+
+def load_feed_page(cursor: str = None, limit: int = 10, comment_limit: int = 10):
+    """ returns (post cards, cursor of the next page or None) """
+    posts, next_cursor = load_feed_posts(cursor, limit)
+    return build_post_cards(posts, comment_limit), next_cursor
+
+
+def _newest_comments(post_ids, limit):
+    """ (post_id, comment) rows, at most limit + 1 per post, newest first. A lateral
+    join reads each section's top rows off comment_page_idx, so a post with
+    thousands of comments costs no more than one with a handful """
+    page = select(Comment) \
+        .where(Comment.comment_section_id == CommentSection.id) \
+        .order_by(desc(Comment.post_time), desc(Comment.id)) \
+        .limit(limit + 1).correlate(CommentSection).lateral()
+    comment = aliased(Comment, page)
+    return db.session.query(CommentSection.post_id, comment) \
+        .join(page, true()) \
+        .filter(CommentSection.post_id.in_(post_ids)) \
+        .order_by(CommentSection.post_id, desc(comment.post_time), desc(comment.id)).all()
+
+
+def build_post_cards(posts, comment_limit: int = 10):
+    if not posts:
+        return []
+
+    post_ids = [p.id for p in posts]
+    comment_rows = _newest_comments(post_ids, comment_limit)
+
+    # cards go into the shared fragment cache, so the names and avatars on them come from the database
+    user_names = user_resolver().names({p.user_id for p in posts} | {c.user_id for _, c in comment_rows}, fresh=True)
+
+    comments = {post_id: [] for post_id in post_ids}
+    for post_id, c in comment_rows:
+        comments[post_id].append(c)
+
+    cards = []
+    for p in posts:
+        page, cursor = _split_page(comments[p.id], comment_limit)
+        views = [CommentView(c.id, c.user_id, user_names.get(c.user_id), c.message) for c in page]
+        cards.append(PostCard(p, user_names.get(p.user_id), p.ratio, views, cursor))
+    return cards
+
+
+def _split_page(comments, limit):
+    """ the extra row fetched past limit only says whether there is another page """
+    if len(comments) > limit:
+        comments = comments[:limit]
+        return comments, encode_comment_cursor(comments[-1])
+    return comments, None
+
+
+def load_comment_page(post_id: int, cursor: str = None, limit: int = 10):
+    """ returns (comment views newest first, cursor of the next page or None) """
+    query = Comment.query.join(CommentSection, CommentSection.id == Comment.comment_section_id) \
+        .filter(CommentSection.post_id == post_id)
+
+    if cursor:
+        post_time, comment_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Comment.post_time < post_time,
+            and_(Comment.post_time == post_time, Comment.id < comment_id)
+        ))
+
+    page, next_cursor = _split_page(query.order_by(desc(Comment.post_time), desc(Comment.id)).limit(limit + 1).all(), limit)
+    user_names = user_resolver().names({c.user_id for c in page}, fresh=True)
+    return [CommentView(c.id, c.user_id, user_names.get(c.user_id), c.message) for c in page], next_cursor
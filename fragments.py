@@ -0,0 +1,172 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import current_app, render_template
+from markupsafe import Markup
+from feed import build_post_cards, load_comment_page
+from models import time_since_date
+
+# Rendered HTML for post cards (feed) and post pages, cached by post id and
+# Post.version. Anything that changes what a card shows bumps the version
+# (votes, comments, edits, the author's profile), so a changed post simply
+# asks for a key nobody has stored yet and the stale entry ages out of the
+# cache. Only the posts that miss go through build_post_cards at all.
+#
+# FRAGMENT_CACHE_BACKEND picks where they live:
+#
+#   memory  an LRU per web process
+#   sqlite  one file in the instance folder, shared by every process on the box
+#
+# Both are bounded by FRAGMENT_CACHE_MAX_BYTES of HTML, least recently used first out.
+# sqlite only writes a hit's use time once it is FRAGMENT_CACHE_TOUCH_INTERVAL old,
+# so reads mostly stay reads instead of taking the file's write lock.
+
+
+class MemoryFragmentCache:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def set_many(self, fragments: dict) -> None:
+        with self._lock:
+            for key, html in fragments.items():
+                if key in self._entries:
+                    self.size -= len(self._entries.pop(key))
+                self._entries[key] = html
+                self.size += len(html)
+            while self.size > self.max_bytes and self._entries:
+                _, html = self._entries.popitem(last=False)
+                self.size -= len(html)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SqliteFragmentCache:
+    def __init__(self, path: str, max_bytes: int, touch_interval: float = 0) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        with self._connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute('''
+                create table if not exists fragments (
+                    key text primary key,
+                    html text not null,
+                    size integer not null,
+                    used_at real not null
+                )''')
+            conn.execute('create index if not exists fragments_used_idx on fragments(used_at)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        marks = ','.join('?' * len(keys))
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(f'select key, html, used_at from fragments where key in ({marks})', keys).fetchall()
+            stale = [key for key, _, used_at in rows if used_at < now - self.touch_interval]
+            if stale:
+                conn.execute(f'update fragments set used_at = ? where key in ({",".join("?" * len(stale))})',
+                             (now, *stale))
+        return {key: html for key, html, _ in rows}
+
+    def set_many(self, fragments: dict) -> None:
+        if not fragments:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('begin immediate')
+            conn.executemany('insert or replace into fragments values (?, ?, ?, ?)',
+                             [(key, html, len(html), now) for key, html in fragments.items()])
+            # everything past max_bytes, counting from the most recently used
+            conn.execute('''
+                delete from fragments where key in (
+                    select key from (select key, sum(size) over (order by used_at desc, key) as total from fragments)
+                    where total > ?)''', (self.max_bytes,))
+            conn.execute('commit')
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute('delete from fragments')
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def fragment_cache():
+    """ the app's fragment cache, FRAGMENT_CACHE_PATH is relative to the instance folder """
+    backend = current_app.config['FRAGMENT_CACHE_BACKEND']
+    max_bytes = current_app.config['FRAGMENT_CACHE_MAX_BYTES']
+    if backend == 'memory':
+        key = ('memory', current_app.name)
+    elif backend == 'sqlite':
+        key = os.path.join(current_app.instance_path, current_app.config['FRAGMENT_CACHE_PATH'])
+    else:
+        raise ValueError(f'Unknown FRAGMENT_CACHE_BACKEND {backend}')
+
+    with _caches_lock:
+        if key not in _caches:
+            if backend == 'memory':
+                _caches[key] = MemoryFragmentCache(max_bytes)
+            else:
+                os.makedirs(os.path.dirname(key), exist_ok=True)
+                _caches[key] = SqliteFragmentCache(key, max_bytes, current_app.config['FRAGMENT_CACHE_TOUCH_INTERVAL'])
+        return _caches[key]
+
+
+def card_key(post, distribution_url: str) -> str:
+    # the "uploaded 5 minutes ago" text is part of the card, so it is part of the key too
+    return f'card:{post.id}:{post.version}:{time_since_date(post.date_posted)}:{distribution_url}'
+
+
+def render_post_cards(posts: list, distribution_url: str, comment_limit: int = 10) -> list:
+    """ the card HTML for every post in order, building and rendering only the ones not cached """
+    cache = fragment_cache()
+    keys = {p.id: card_key(p, distribution_url) for p in posts}
+    cards = cache.get_many(list(keys.values()))
+
+    missing = [p for p in posts if keys[p.id] not in cards]
+    rendered = {keys[card.id]: render_template('_post_card.html', post=card, distribution_url=distribution_url)
+                for card in build_post_cards(missing, comment_limit)}
+    cache.set_many(rendered)
+    cards.update(rendered)
+
+    return [Markup(cards[keys[p.id]]) for p in posts]
+
+
+def render_post_detail(post, distribution_url: str, comment_limit: int = 10) -> Markup:
+    """ the single post page body: video, votes and the newest page of comments """
+    cache = fragment_cache()
+    key = f'detail:{post.id}:{post.version}:{distribution_url}'
+    html = cache.get_many([key]).get(key)
+    if html is None:
+        comments, comments_cursor = load_comment_page(post.id, limit=comment_limit)
+        html = render_template('_post_detail.html', post=post, comments=comments,
+                               comments_cursor=comments_cursor, distribution_url=distribution_url)
+        cache.set_many({key: html})
+    return Markup(html)
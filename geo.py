@@ -0,0 +1,78 @@
+import math
+
+# Jam sessions are bucketed into a fixed lat/lng grid. Cells are numbered row by
+# row (south to north, west to east), so any viewport is one contiguous range of
+# cell ids per grid row and a plain btree index on sessions.grid_cell answers it
+# with a handful of range scans, on Postgres or anything else.
+#
+# Changing GRID_SIZE changes every stored cell, run flask regrid-sessions after.
+
+GRID_SIZE = 0.1  # degrees, about 11km north-south
+GRID_ROWS = round(180 / GRID_SIZE)
+GRID_COLS = round(360 / GRID_SIZE)
+
+# past this many grid rows a viewport is scanned as one range and filtered on lat/long
+MAX_RANGES = 32
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _row(lat: float) -> int:
+    return min(max(int((lat + 90) // GRID_SIZE), 0), GRID_ROWS - 1)
+
+def _col(lng: float) -> int:
+    if not -180 <= lng <= 180:
+        lng = (lng + 180) % 360 - 180
+    return min(int((lng + 180) // GRID_SIZE), GRID_COLS - 1)
+
+def grid_cell(lat: float, lng: float) -> int:
+    return _row(lat) * GRID_COLS + _col(lng)
+
+
+def cell_ranges(south: float, west: float, north: float, east: float) -> list:
+    """ inclusive (first, last) cell id ranges covering the box, west > east means it crosses the antimeridian """
+    first_row, last_row = _row(south), _row(north)
+    if last_row - first_row + 1 > MAX_RANGES:
+        return [(first_row * GRID_COLS, last_row * GRID_COLS + GRID_COLS - 1)]
+
+    west_col, east_col = _col(west), _col(east)
+    if east - west >= 360:
+        spans = [(0, GRID_COLS - 1)]
+    elif west <= east:
+        spans = [(west_col, east_col)]
+    else:
+        spans = [(west_col, GRID_COLS - 1), (0, east_col)]
+
+    ranges = []
+    for row in range(first_row, last_row + 1):
+        for first_col, last_col in spans:
+            ranges.append((row * GRID_COLS + first_col, row * GRID_COLS + last_col))
+    return ranges
+
+
+def bbox_around(lat: float, lng: float, radius_km: float) -> tuple:
+    """ (south, west, north, east) containing every point within radius_km """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    # the box touches a pole, every longitude is in range
+    if south == -90.0 or north == 90.0:
+        return south, -180.0, north, 180.0
+
+    dlng = math.degrees(radius_km / EARTH_RADIUS_KM / math.cos(math.radians(max(abs(south), abs(north)))))
+    if dlng >= 180:
+        return south, -180.0, north, 180.0
+    west, east = lng - dlng, lng + dlng
+    # wrap back into -180..180, west > east afterwards means the antimeridian is crossed
+    west = (west + 180) % 360 - 180
+    east = (east + 180) % 360 - 180
+    return south, west, north, east
+
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """ great circle (haversine) distance """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
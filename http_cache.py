@@ -0,0 +1,82 @@
+import hashlib
+import os
+import time
+from flask import g, request, session, abort, current_app
+
+# Conditional GETs for the feed, post, profile and session pages. Each page is
+# tagged with the change stamps it depends on (models.change_stamps, or
+# Post.version for a single post) plus the viewer, so a browser refreshing a
+# page nothing has changed on gets a bodiless 304 before any ORM loading or
+# template rendering happens.
+#
+# Pages with relative times ("uploaded 5 minutes ago") also carry the current
+# HTTP_CACHE_TIME_BUCKET, so those are never more than that many seconds stale.
+#
+# Tags are salted with a hash of the templates (and HTTP_CACHE_VERSION), the
+# same on every host running the same checkout, so a tag from one worker host
+# still matches behind a load balancer while a deploy with new templates
+# invalidates them all.
+
+
+class HttpCache:
+    def __init__(self) -> None:
+        self.salt = ''
+
+    def init_app(self, app) -> None:
+        # a deploy with new templates must not be answered with the old pages
+        self.salt = self._template_hash(app, app.config['HTTP_CACHE_VERSION'])
+
+        @app.after_request
+        def _set_etag(response):
+            etag = g.pop('etag', None)
+            if etag and response.status_code == 200:
+                response.set_etag(etag)
+                # the browser keeps the page but has to ask every time
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+
+        # after_request is skipped when a view raises, don't leave the tag on a g the next request may share
+        @app.teardown_request
+        def _forget_etag(exc):
+            g.pop('etag', None)
+
+    def _template_folders(self, app) -> list:
+        folders = [os.path.join(app.root_path, app.template_folder)]
+        for blueprint in app.blueprints.values():
+            if blueprint.template_folder:
+                folders.append(os.path.join(blueprint.root_path, blueprint.template_folder))
+        return [f for f in folders if os.path.isdir(f)]
+
+    def _template_hash(self, app, version: str) -> str:
+        """ sha1 of every template's path and contents, mtimes differ between checkouts so they aren't used """
+        digest = hashlib.sha1(version.encode('utf-8'))
+        for folder in self._template_folders(app):
+            for root, dirs, names in os.walk(folder):
+                dirs.sort()
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    digest.update(os.path.relpath(path, app.root_path).encode('utf-8'))
+                    with open(path, 'rb') as f:
+                        digest.update(f.read())
+        return digest.hexdigest()
+
+    def time_bucket(self) -> int:
+        return int(time.time() // current_app.config['HTTP_CACHE_TIME_BUCKET'])
+
+    def check(self, *parts) -> None:
+        """ tag the page with parts and the viewer, aborts with 304 when the browser already has it """
+        # flashed messages are shown once, a page that has some is never answered from cache
+        if session.get('_flashes'):
+            return
+        etag = hashlib.sha1(repr((self.salt, session.get('id'), parts)).encode('utf-8')).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            abort(response)
+        g.etag = etag
+
+
+http_cache = HttpCache()
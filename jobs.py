@@ -0,0 +1,260 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app
+from models import db
+
+# Small persistent job queue for work that should not run inside a request
+# (transcoding, thumbnails). Jobs live in a local SQLite file so they survive
+# restarts, and any number of worker processes can pull from it:
+#
+#     flask --app app jobs-worker --processes 2
+#
+# Without one (JOBS_IN_WEB_PROCESS, the default outside prod) each web process
+# runs the due jobs on a thread of its own (job_thread), not on the sweeper, so
+# a transcode or thumbnail that takes a while never holds up housekeeping.
+#
+# Handlers are registered with @handler('kind') next to the code that enqueues them.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+handlers = {}
+failure_handlers = {}
+
+def handler(kind: str, on_failure=None):
+    """ register fn(payload) for a job kind, on_failure(payload, error) runs once retries run out """
+    def register(fn):
+        handlers[kind] = fn
+        if on_failure:
+            failure_handlers[kind] = on_failure
+        return fn
+    return register
+
+
+class Job:
+    def __init__(self, row) -> None:
+        self.id = row['id']
+        self.kind = row['kind']
+        self.payload = json.loads(row['payload'])
+        self.state = row['state']
+        self.attempts = row['attempts']
+        self.error = row['error']
+
+    def __repr__(self) -> str:
+        return f'{self.id}, {self.kind}, {self.state}'
+
+
+class JobQueue:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute('''
+                create table if not exists jobs (
+                    id integer primary key autoincrement,
+                    kind text not null,
+                    payload text not null,
+                    state text not null default 'queued',
+                    attempts integer not null default 0,
+                    run_after real not null,
+                    claimed_at real null,
+                    error text null,
+                    created_at real not null,
+                    updated_at real not null
+                )''')
+            conn.execute('create index if not exists jobs_ready_idx on jobs(state, run_after)')
+
+    @contextmanager
+    def _connect(self):
+        # autocommit mode, transactions are opened explicitly where they matter
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, kind: str, payload: dict, delay: float = 0) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'insert into jobs (kind, payload, run_after, created_at, updated_at) values (?, ?, ?, ?, ?)',
+                (kind, json.dumps(payload), now + delay, now, now))
+            return cursor.lastrowid
+
+    def claim(self):
+        """ take the oldest due job, begin immediate makes this safe across worker processes """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('begin immediate')
+            try:
+                row = conn.execute(
+                    'select * from jobs where state = ? and run_after <= ? order by run_after, id limit 1',
+                    (QUEUED, now)).fetchone()
+                if row is not None:
+                    conn.execute('update jobs set state = ?, attempts = attempts + 1, claimed_at = ?, updated_at = ? where id = ?',
+                                 (RUNNING, now, now, row['id']))
+                conn.execute('commit')
+            except BaseException:
+                conn.execute('rollback')
+                raise
+        if row is None:
+            return None
+        job = Job(row)
+        job.attempts += 1
+        job.state = RUNNING
+        return job
+
+    def complete(self, job: Job) -> None:
+        self._set(job.id, state=DONE, error=None)
+
+    def retry(self, job: Job, error: str, delay: float) -> None:
+        self._set(job.id, state=QUEUED, error=error, run_after=time.time() + delay)
+
+    def fail(self, job: Job, error: str) -> None:
+        self._set(job.id, state=FAILED, error=error)
+
+    def requeue_stale(self, timeout: float) -> int:
+        """ jobs left running by a worker that died go back in the queue """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute('update jobs set state = ?, run_after = ?, updated_at = ? where state = ? and claimed_at < ?',
+                                  (QUEUED, now, now, RUNNING, now - timeout))
+            return cursor.rowcount
+
+    def get(self, job_id: int):
+        with self._connect() as conn:
+            row = conn.execute('select * from jobs where id = ?', (job_id,)).fetchone()
+        return Job(row) if row else None
+
+    def counts(self) -> dict:
+        with self._connect() as conn:
+            return dict(conn.execute('select state, count(*) from jobs group by state').fetchall())
+
+    def _set(self, job_id: int, **values) -> None:
+        values['updated_at'] = time.time()
+        columns = ', '.join(f'{k} = ?' for k in values)
+        with self._connect() as conn:
+            conn.execute(f'update jobs set {columns} where id = ?', (*values.values(), job_id))
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def queue() -> JobQueue:
+    """ the app's queue, JOB_QUEUE_PATH is relative to the instance folder """
+    path = os.path.join(current_app.instance_path, current_app.config['JOB_QUEUE_PATH'])
+    with _queues_lock:
+        if path not in _queues:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _queues[path] = JobQueue(path)
+        return _queues[path]
+
+def enqueue(kind: str, payload: dict, delay: float = 0) -> int:
+    return queue().enqueue(kind, payload, delay)
+
+
+def work_once(job_queue: JobQueue = None) -> bool:
+    """ run one due job if there is one, returns whether anything ran """
+    job_queue = job_queue or queue()
+    job = job_queue.claim()
+    if job is None:
+        return False
+
+    try:
+        handlers[job.kind](job.payload)
+    except Exception as e:
+        db.session.rollback()
+        error = f'{type(e).__name__}: {e}'
+        traceback.print_exc()
+        if job.attempts < current_app.config['JOB_MAX_ATTEMPTS']:
+            # 2, 4, 8... times the base delay
+            job_queue.retry(job, error, current_app.config['JOB_RETRY_DELAY'] * 2 ** job.attempts)
+        else:
+            job_queue.fail(job, error)
+            if job.kind in failure_handlers:
+                failure_handlers[job.kind](job.payload, error)
+    else:
+        job_queue.complete(job)
+    finally:
+        db.session.remove()
+    return True
+
+
+def run_due_jobs(job_queue: JobQueue = None, limit: int = 100) -> int:
+    """ run the jobs that are due now, at most limit, returns how many ran """
+    ran = 0
+    while ran < limit and work_once(job_queue):
+        ran += 1
+    return ran
+
+
+class JobThread:
+    """ a jobs-worker on a daemon thread of the web process, for when JOBS_IN_WEB_PROCESS says there is none """
+    def __init__(self) -> None:
+        self.app = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+        # started by the first request like the sweeper, so importing the app doesn't spawn threads
+        @app.before_request
+        def _start_job_thread():
+            self.start()
+
+    def run_once(self) -> int:
+        """ run the jobs due now, returns how many ran (none while JOBS_IN_WEB_PROCESS is off) """
+        if not self.app.config['JOBS_IN_WEB_PROCESS']:
+            return 0
+        try:
+            return run_due_jobs()
+        except Exception:
+            # the queue itself failed (e.g. sqlite busy), keep the thread alive and try again later
+            db.session.rollback()
+            traceback.print_exc()
+            return 0
+        finally:
+            db.session.remove()
+
+    def _run(self) -> None:
+        with self.app.app_context():
+            while not self._stop.is_set():
+                if not self.run_once():
+                    self._stop.wait(self.app.config['JOB_POLL_INTERVAL'])
+
+    def start(self) -> None:
+        if self._thread is not None or not self.app.config['JOBS_IN_WEB_PROCESS']:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='jobs', daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+job_thread = JobThread()
+
+
+def run_worker(stop: threading.Event = None) -> None:
+    stop = stop or threading.Event()
+    job_queue = queue()
+    requeued = job_queue.requeue_stale(current_app.config['JOB_TIMEOUT'])
+    print(f'[{datetime.now()}] worker {os.getpid()} started, {requeued} stale jobs requeued')
+    while not stop.is_set():
+        if not work_once(job_queue):
+            stop.wait(current_app.config['JOB_POLL_INTERVAL'])
@@ -0,0 +1,56 @@
+import os
+import threading
+
+# In-process index of the local upload folders (dev / self hosted storage).
+# The listing is only re-read when the directory's mtime changes, and the
+# upload path adds new files directly, so membership checks are a set lookup
+# instead of an os.listdir per post.
+
+
+class MediaIndex:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._names = frozenset()
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> frozenset:
+        """ current file names, costs one stat unless the directory changed """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._names, self._mtime = frozenset(), None
+            return self._names
+
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._names = frozenset(os.listdir(self.path))
+                    self._mtime = mtime
+        return self._names
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            self._names = self._names | {name}
+
+    def discard(self, name: str) -> None:
+        with self._lock:
+            self._names = self._names - {name}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.snapshot()
+
+    def __repr__(self) -> str:
+        return f'{self.path}: {len(self._names)} files'
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def media_index(path: str) -> MediaIndex:
+    """ shared index for a folder, so the upload path and the pages see the same one """
+    path = os.path.normpath(path)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = MediaIndex(path)
+        return _indexes[path]
@@ -0,0 +1,54 @@
+import os
+from sqlalchemy import text
+from geo import grid_cell
+from models import db
+
+# Versioned schema changes for databases created from an older base.sql.
+# Every file in migrations/ is applied once, in name order, in its own
+# transaction, and recorded in schema_migrations. base.sql already contains
+# everything and records the migrations it includes, so a fresh database has
+# nothing to run.
+#
+# Backfills that need Python run right after their file, in the same transaction.
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def backfill_grid_cells(conn) -> None:
+    rows = conn.execute(text('select id, lat, long from sessions where grid_cell is null')).all()
+    if rows:
+        conn.execute(text('update sessions set grid_cell = :cell where id = :id'),
+                     [{'id': id, 'cell': grid_cell(lat, lng)} for id, lat, lng in rows])
+    conn.execute(text('alter table sessions alter column grid_cell set not null'))
+
+
+BACKFILLS = {
+    '007_session_grid_cell': backfill_grid_cells,
+}
+
+
+def available_migrations() -> list:
+    return sorted(name[:-len('.sql')] for name in os.listdir(MIGRATIONS_DIR) if name.endswith('.sql'))
+
+
+def applied_migrations(conn) -> set:
+    conn.execute(text('create table if not exists schema_migrations ('
+                      'version varchar(255) primary key, applied_at timestamp not null default now())'))
+    return {version for version, in conn.execute(text('select version from schema_migrations'))}
+
+
+def migrate(engine=None) -> list:
+    """ apply the migrations this database (the app's unless engine is given) hasn't seen yet, returns their versions """
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        pending = [v for v in available_migrations() if v not in applied_migrations(conn)]
+
+    for version in pending:
+        with open(os.path.join(MIGRATIONS_DIR, f'{version}.sql')) as f:
+            sql = f.read()
+        with engine.begin() as conn:
+            conn.exec_driver_sql(sql)
+            if version in BACKFILLS:
+                BACKFILLS[version](conn)
+            conn.execute(text('insert into schema_migrations (version) values (:version)'), {'version': version})
+    return pending
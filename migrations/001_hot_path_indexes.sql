@@ -0,0 +1,20 @@
+-- Indexes for the lookups every page load makes. Databases created from an
+-- older base.sql answered each of these with a sequential scan.
+
+-- profile pages, a user's posts newest first
+create index if not exists post_user_idx on post(user_id, date_posted desc);
+-- the feed, paged by (date_posted, id)
+create index if not exists post_feed_idx on post(date_posted desc, id desc);
+-- a post's comment section
+create index if not exists comment_section_post_idx on comment_section(post_id);
+-- a section's comments paged by (post_time, id), also serves plain comment_section_id lookups
+create index if not exists comment_page_idx on comment(comment_section_id, post_time desc, id desc);
+-- party members by session, the party_member_key constraint in base.sql already is this index.
+-- The old check-then-insert join could add the same member twice, keep the first row of each
+delete from party a using party b
+where a.session_id = b.session_id and a.user_id = b.user_id and a.party_id > b.party_id;
+create unique index if not exists party_member_key on party(session_id, user_id);
+-- the map and the expiry sweeper
+create index if not exists sessions_date_idx on sessions(date);
+-- case-insensitive user name checks
+create index if not exists user_table_lower_user_name_idx on user_table(lower(user_name));
@@ -0,0 +1,2 @@
+-- Bumped whenever a rendered post card would change, the fragment cache keys on it
+alter table post add column if not exists version int not null default 0;
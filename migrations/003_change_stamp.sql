@@ -0,0 +1,6 @@
+-- Page change stamps for ETags, one row per scope ('feed', 'sessions', 'user:<id>')
+create table if not exists change_stamp (
+    scope varchar(255) primary key,
+    version bigint not null,
+    changed_at timestamptz not null
+);
@@ -0,0 +1,2 @@
+-- Bumped by every profile photo upload, avatar urls carry it so cached copies are never shown after a change
+alter table user_table add column if not exists avatar_version int not null default 0;
@@ -0,0 +1,2 @@
+-- Uploads are 'processing' until their background jobs finish, the feed only shows 'ready' posts
+alter table post add column if not exists status varchar(20) not null default 'ready';
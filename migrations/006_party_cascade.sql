@@ -0,0 +1,3 @@
+-- Expired sessions are removed with one bulk delete, their party rows go with them
+alter table party drop constraint if exists party_session_id_fkey;
+alter table party add constraint party_session_id_fkey foreign key (session_id) references sessions(id) on delete cascade;
@@ -0,0 +1,4 @@
+-- "Sessions near me" and the map range scan on geo.grid_cell. Existing rows are
+-- filled in by migrate.py (the cell is computed in Python), which then makes it not null
+alter table sessions add column if not exists grid_cell int;
+create index if not exists sessions_grid_idx on sessions(grid_cell);
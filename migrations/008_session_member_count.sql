@@ -0,0 +1,3 @@
+-- Party sizes kept on the session row, counted once here and kept in step by join and leave
+alter table sessions add column if not exists member_count int not null default 0;
+update sessions s set member_count = (select count(*) from party p where p.session_id = s.id);
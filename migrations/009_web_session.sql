@@ -0,0 +1,7 @@
+-- Login sessions when SESSION_BACKEND is sql, garbage collected by expires
+create table if not exists web_session (
+    id varchar(64) primary key,
+    data text not null,
+    expires timestamp not null
+);
+create index if not exists web_session_expires_idx on web_session(expires);
@@ -0,0 +1,7 @@
+-- Login token buckets when LOGIN_LIMITER_BACKEND is sql (see auth.py)
+create table if not exists rate_limit (
+    key varchar(255) primary key,
+    tokens double precision not null,
+    updated timestamptz not null
+);
+create index if not exists rate_limit_updated_idx on rate_limit(updated);
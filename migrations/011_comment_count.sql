@@ -0,0 +1,12 @@
+-- Comments are paged by post_time, the ones saved without one get their post's date
+update comment c set post_time = p.date_posted
+from comment_section s join post p on p.id = s.post_id
+where s.id = c.comment_section_id and c.post_time is null;
+update comment set post_time = now() where post_time is null;
+alter table comment alter column post_time set default now();
+alter table comment alter column post_time set not null;
+
+-- Comment totals kept on the post row, counted once here and kept in step by the Comment events
+alter table post add column if not exists comment_count int not null default 0;
+update post p set comment_count = (
+    select count(*) from comment c join comment_section s on s.id = c.comment_section_id where s.post_id = p.id);
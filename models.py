@@ -1,7 +1,16 @@
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import MetaData, ForeignKeyConstraint, PrimaryKeyConstraint
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy import MetaData, ForeignKeyConstraint, PrimaryKeyConstraint, event, inspect, func, case, select, text, or_, and_
 import base64
-from datetime import datetime
+import math
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from geo import grid_cell, cell_ranges, bbox_around, distance_km, EARTH_RADIUS_KM
+from datetime import datetime, timedelta
 
 # USE ONLY FOR TESTS USE ONLY FOR TESTS USE ONLY FOR TESTS
 def clear_data():
@@ -43,14 +52,20 @@ def return_media(id):
     return image
 
 
-def get_comments_of_post(id):
-    comment_section = CommentSection.query.filter_by(post_id=id).first()
-    comments = list(Comment.query.filter_by(comment_section_id=comment_section.id).all())
-    return comments
+# Newest first, one joined query. feed.load_comment_page pages through them
+def get_comments_of_post(id, limit=None):
+    query = Comment.query.join(CommentSection, CommentSection.id == Comment.comment_section_id) \
+        .filter(CommentSection.post_id == id) \
+        .order_by(Comment.post_time.desc(), Comment.id.desc())
+    return query.limit(limit).all()
 
 def time_since_post(pid):
     postex = Post.query.get(pid)
-    delta = datetime.now() - postex.date_posted
+    return time_since_date(postex.date_posted)
+
+# Same as time_since_post but works off an already loaded date, no query
+def time_since_date(date_posted):
+    delta = datetime.now() - date_posted
     secs = delta.total_seconds()
     if secs < 60.00:
         return f'uploaded %.0f seconds ago' % secs
@@ -100,9 +115,15 @@ def time_since_post(pid):
     return None
 
 def time_since_jam_session(jam_session_id):
-    if JamSession.query.get(jam_session_id):
-        jam_session = JamSession.query.get(jam_session_id)
-        delta = datetime.now() - jam_session.date_posted
+    jam_session = JamSession.query.get(jam_session_id)
+    if jam_session:
+        return time_since_jam_session_date(jam_session.date_posted)
+    return None
+
+# Same as time_since_jam_session but works off an already loaded date, no query
+def time_since_jam_session_date(date_posted):
+    if date_posted:
+        delta = datetime.now() - date_posted
         secs = delta.total_seconds()
         if secs < 60.00:
             return f'%.0f seconds ago' % secs
@@ -164,6 +185,8 @@ class UserTable(db.Model):
     private = db.Column(db.Boolean, nullable=True, default=False)
     phone = db.Column(db.String(20), nullable=True)
     prof_pic = db.Column(db.String(255), nullable=True)
+    # bumped by every profile photo upload, see UserDisplay.avatar_path
+    avatar_version = db.Column(db.Integer, nullable=False, default=0)
     
 
     def __init__(self, first_n: str, last_n: str, user_n: str, pswd: str, email: str, phone: int) -> None:
@@ -182,6 +205,206 @@ class UserTable(db.Model):
     def __repr__(self) -> str:
         return f'{self.first_name} {self.last_name}'
     
+# What pages show about a user, without the password hash, the prof_pic column
+# or anything else on the row. Slots keep the process-wide cache below small.
+class UserDisplay:
+    __slots__ = ('id', 'user_name', 'first_name', 'last_name', 'avatar_version')
+
+    def __init__(self, user_id: int, user_name: str, first_name: str, last_name: str, avatar_version: int) -> None:
+        self.id = user_id
+        self.user_name = user_name
+        self.first_name = first_name
+        self.last_name = last_name
+        self.avatar_version = avatar_version
+
+    @property
+    def full_name(self) -> str:
+        return f'{self.first_name} {self.last_name}'
+
+    @property
+    def avatar_path(self) -> str:
+        # the version changes the url whenever a new photo is uploaded, so CDN and browser copies never go stale
+        return f'images/pfps/{self.id}.png?v={self.avatar_version}'
+
+    def __repr__(self) -> str:
+        return f'{self.id}, {self.user_name}'
+
+
+# UserDisplay records shared by every request in this process, least recently
+# used out past max_entries and dropped after ttl seconds. The profile routes
+# invalidate a user here after changing them; other web processes see the
+# change once their copy's ttl runs out.
+class UserDisplayCache:
+    def __init__(self, max_entries: int = 10_000, ttl: float = 60) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.max_entries = app.config['USER_CACHE_SIZE']
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.clear()
+
+    def get_many(self, user_ids) -> dict:
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is None:
+                    continue
+                record, expires = entry
+                if expires <= now:
+                    del self._entries[user_id]
+                    continue
+                self._entries.move_to_end(user_id)
+                found[user_id] = record
+        return found
+
+    def set_many(self, records) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for record in records:
+                self._entries[record.id] = (record, expires)
+                self._entries.move_to_end(record.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+user_displays = UserDisplayCache()
+
+
+# Memoizes user lookups for one request: every id is resolved at most once,
+# from the process-wide user_displays cache if it has it, and prefetch loads
+# all the ids a page is about to need in one IN query. HTML that outlives the
+# request (the fragment cache, shared by every process) asks for fresh users,
+# straight from the database, since only the process that made a change has
+# dropped its cached copy.
+class UserResolver:
+    def __init__(self) -> None:
+        self._users = {}
+        self._fresh = set()
+
+    def prefetch(self, user_ids, fresh: bool = False) -> None:
+        wanted = {i for i in user_ids if i is not None}
+        missing = wanted - (self._fresh if fresh else self._users.keys())
+        if not missing:
+            return
+        if not fresh:
+            cached = user_displays.get_many(missing)
+            self._users.update(cached)
+            missing -= cached.keys()
+            if not missing:
+                return
+
+        records = [UserDisplay(*row) for row in
+                   db.session.query(UserTable.id, UserTable.user_name, UserTable.first_name, UserTable.last_name,
+                                    UserTable.avatar_version)
+                   .filter(UserTable.id.in_(missing)).all()]
+        user_displays.set_many(records)
+        for record in records:
+            self._users[record.id] = record
+        # unknown ids are remembered too, so they aren't asked for again this request
+        for user_id in missing - {record.id for record in records}:
+            self._users[user_id] = None
+        self._fresh |= missing
+
+    def get(self, user_id: int):
+        """ the UserDisplay, or None if there is no such user """
+        self.prefetch([user_id])
+        return self._users.get(user_id)
+
+    def name(self, user_id: int):
+        user = self.get(user_id)
+        return user.user_name if user else None
+
+    def avatar_path(self, user_id: int) -> str:
+        user = self.get(user_id)
+        return user.avatar_path if user else f'images/pfps/{user_id}.png'
+
+    def names(self, user_ids, fresh: bool = False) -> dict:
+        """ {id: user name} for every id, one query for the ones not seen yet """
+        self.prefetch(user_ids, fresh)
+        return {i: self._users[i].user_name for i in user_ids if self._users.get(i)}
+
+
+def user_resolver() -> UserResolver:
+    """ the current request's resolver, outside a request (CLI, workers, tests) a fresh one per call """
+    if not has_request_context():
+        return UserResolver()
+    if 'users' not in g:
+        g.users = UserResolver()
+    return g.users
+
+
+# Server side login sessions for SESSION_BACKEND = 'sql' (see session_store.py)
+class WebSession(db.Model):
+    __tablename__ = 'web_session'
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'{self.id}, {self.expires}'
+
+# One counter per cached page scope ('feed', 'sessions', 'user:<id>'), bumped
+# right after the transaction that changes that page commits, see http_cache.py
+class ChangeStamp(db.Model):
+    __tablename__ = 'change_stamp'
+    scope = db.Column(db.String(255), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+    changed_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    def __repr__(self) -> str:
+        return f'{self.scope}, {self.version}'
+
+# Sorted so two bumps of the same scopes always lock them in the same order
+TOUCH_SQL = text("""
+    INSERT INTO change_stamp AS c (scope, version, changed_at)
+    SELECT scope, 1, now() FROM unnest(CAST(:scopes AS varchar[])) AS scope ORDER BY scope
+    ON CONFLICT (scope) DO UPDATE SET version = c.version + 1, changed_at = now()
+""")
+
+def touch(*scopes) -> None:
+    """ bump the change stamps once the session's transaction commits, safe to call from flush events """
+    db.session.info.setdefault('touched', set()).update(scopes)
+
+# 'feed' and 'sessions' are a handful of rows every vote, comment and join
+# bumps. Held inside those transactions they would queue every such write on
+# the site behind each other, so they are bumped afterwards in a statement of
+# their own; a page cached in between only lives until the bump lands.
+@event.listens_for(Session, 'after_commit')
+def _bump_touched(session):
+    scopes = session.info.pop('touched', None)
+    if not scopes:
+        return
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(TOUCH_SQL, {'scopes': sorted(scopes)})
+    except SQLAlchemyError:
+        # the change itself is committed, pages just revalidate as unchanged until the next bump
+        traceback.print_exc()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_touched(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('touched', None)
+
+def change_stamps(*scopes) -> tuple:
+    """ current version of every scope in order, 0 for one never touched, in one primary key lookup """
+    rows = dict(db.session.query(ChangeStamp.scope, ChangeStamp.version).filter(ChangeStamp.scope.in_(scopes)).all())
+    return tuple(rows.get(scope, 0) for scope in scopes)
+
+
 class JamSession(db.Model):
     __tablename__ = 'sessions'
     id = db.Column(db.Integer, primary_key=True, nullable=False)
@@ -192,8 +415,13 @@ class JamSession(db.Model):
     date_posted = db.Column(db.DateTime, nullable=False)
     lat = db.Column( db.Double, nullable=False)
     long = db.Column(db.Double, nullable=False)
+    # geo.grid_cell(lat, long), kept in sync by _set_grid_cell
+    grid_cell = db.Column(db.Integer, nullable=False)
     host_id = db.Column(db.Integer, db.ForeignKey('user_table.id'), nullable=False)
-    party = db.relationship('Party', cascade="all, delete")
+    # number of party rows, kept up to date by the Party events and the join/leave statements below
+    member_count = db.Column(db.Integer, nullable=False, default=0)
+    # party rows are removed by the database (on delete cascade), so bulk deletes clean them up too
+    party = db.relationship('Party', cascade="all, delete", passive_deletes=True)
 
     
     ## create instance without host_name and just id
@@ -221,8 +449,7 @@ class JamSession(db.Model):
         }
     
     def get_user_name_id(a: int):
-        s = db.session()
-        return s.query(UserTable).filter(UserTable.id == a).first().first_name + ' ' + s.query(UserTable).filter(UserTable.id == a).first().last_name
+        return user_resolver().get(a).full_name
 
     def date_str(date: datetime):
         return date.strftime('%A %b, %d  %I:%M %p')
@@ -231,11 +458,24 @@ class JamSession(db.Model):
         return f'{self.host_name} : {self.title}'
 
 
+@event.listens_for(JamSession, 'before_insert')
+@event.listens_for(JamSession, 'before_update')
+def _set_grid_cell(mapper, connection, target):
+    target.grid_cell = grid_cell(target.lat, target.long)
+
+@event.listens_for(JamSession, 'after_insert')
+@event.listens_for(JamSession, 'after_update')
+@event.listens_for(JamSession, 'after_delete')
+def _jam_session_changed(mapper, connection, target):
+    touch('sessions')
+
+
 #class party
 class Party(db.Model):
     __tablename__ = 'party'
+    __table_args__ = (db.UniqueConstraint('session_id', 'user_id', name='party_member_key'),)
     party_id = db.Column(db.Integer, primary_key=True, nullable= False)
-    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id', ondelete='CASCADE'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user_table.id'), nullable=False)
 
     def __init__(self, sesh_id: int, user_id: int) -> None:
@@ -246,6 +486,161 @@ class Party(db.Model):
         return f'{self.session_id}, {self.user_id}'
 
 
+# Party rows added or removed through the ORM keep JamSession.member_count in step
+def _add_to_member_count(connection, session_id, delta):
+    sessions = JamSession.__table__
+    connection.execute(sessions.update().where(sessions.c.id == session_id).values(member_count=sessions.c.member_count + delta))
+    touch('sessions')
+
+@event.listens_for(Party, 'after_insert')
+def _member_joined(mapper, connection, target):
+    _add_to_member_count(connection, target.session_id, 1)
+
+@event.listens_for(Party, 'after_delete')
+def _member_left(mapper, connection, target):
+    _add_to_member_count(connection, target.session_id, -1)
+
+# Join a session in one statement. The unique (session_id, user_id) key makes a
+# second join (double click, two tabs) a no-op instead of a duplicate row, and
+# the host's user name comes back for the flash message. No row means no session.
+JOIN_SESSION_SQL = text("""
+    WITH joined AS (
+        INSERT INTO party (session_id, user_id)
+        SELECT :session_id, :user_id WHERE EXISTS (SELECT 1 FROM sessions WHERE id = :session_id)
+        ON CONFLICT (session_id, user_id) DO NOTHING
+        RETURNING session_id
+    ), counted AS (
+        UPDATE sessions SET member_count = member_count + 1
+        WHERE id IN (SELECT session_id FROM joined)
+        RETURNING id
+    )
+    SELECT EXISTS (SELECT 1 FROM joined) AS joined, u.user_name AS host_user_name
+    FROM sessions s JOIN user_table u ON u.id = s.host_id
+    WHERE s.id = :session_id
+""")
+
+# Remove a member in one statement, returns a row only if someone was removed.
+# With :host_id set it only removes members of sessions that user hosts (kicks).
+LEAVE_SESSION_SQL = text("""
+    WITH removed AS (
+        DELETE FROM party
+        WHERE session_id = :session_id AND user_id = :user_id
+          AND (CAST(:host_id AS int) IS NULL
+               OR EXISTS (SELECT 1 FROM sessions WHERE id = :session_id AND host_id = :host_id))
+        RETURNING session_id
+    )
+    UPDATE sessions SET member_count = member_count - 1
+    WHERE id IN (SELECT session_id FROM removed)
+    RETURNING member_count
+""")
+
+def join_jam_session(session_id: int, user_id: int):
+    """ returns (whether a new party row was added, host user name), or None if there is no such session """
+    row = db.session.execute(JOIN_SESSION_SQL, {'session_id': session_id, 'user_id': user_id}).first()
+    if row and row.joined:
+        touch('sessions')
+    db.session.commit()
+    return tuple(row) if row else None
+
+def leave_jam_session(session_id: int, user_id: int, host_id: int = None) -> bool:
+    """ returns whether user_id was in the party """
+    row = db.session.execute(LEAVE_SESSION_SQL, {'session_id': session_id, 'user_id': user_id, 'host_id': host_id}).first()
+    if row:
+        touch('sessions')
+    db.session.commit()
+    return row is not None
+
+# Recount every session's member_count from party in one statement
+def rebuild_member_counts() -> int:
+    sessions = JamSession.__table__
+    party = Party.__table__
+    total = select(func.count()).select_from(party).where(party.c.session_id == sessions.c.id).scalar_subquery()
+    result = db.session.execute(sessions.update().where(sessions.c.member_count != total).values(member_count=total))
+    db.session.commit()
+    return result.rowcount
+
+
+# A jam session stays on the map until ttl seconds after its start date
+def jam_session_cutoff(ttl: int) -> datetime:
+    return datetime.now() - timedelta(seconds=ttl)
+
+def active_jam_sessions(ttl: int) -> list:
+    """ sessions that haven't expired yet, whether or not the sweeper has run """
+    return JamSession.query.filter(JamSession.date >= jam_session_cutoff(ttl)).order_by(JamSession.date).all()
+
+# The list on /sessions/ is paged soonest first on (date, id)
+def load_session_page(ttl: int, cursor: str = None, limit: int = 50):
+    """ returns (active sessions, cursor of the next page or None) """
+    query = JamSession.query.filter(JamSession.date >= jam_session_cutoff(ttl))
+    if cursor:
+        date, session_id = cursor.rsplit('_', 1)
+        date, session_id = datetime.fromisoformat(date), int(session_id)
+        query = query.filter(or_(JamSession.date > date, and_(JamSession.date == date, JamSession.id > session_id)))
+
+    # one extra row says whether there is another page
+    jam_sessions = query.order_by(JamSession.date, JamSession.id).limit(limit + 1).all()
+    if len(jam_sessions) > limit:
+        jam_sessions = jam_sessions[:limit]
+        last = jam_sessions[-1]
+        return jam_sessions, f'{last.date.isoformat()}_{last.id}'
+    return jam_sessions, None
+
+def _in_bbox(south: float, west: float, north: float, east: float, ttl: int):
+    ranges = [JamSession.grid_cell.between(first, last) for first, last in cell_ranges(south, west, north, east)]
+    # cells overhang the box at its edges, lat/long trim them exactly
+    if west <= east:
+        in_lng = JamSession.long.between(west, east)
+    else:
+        in_lng = or_(JamSession.long >= west, JamSession.long <= east)
+    return JamSession.query.filter(or_(*ranges), JamSession.lat.between(south, north), in_lng,
+                                   JamSession.date >= jam_session_cutoff(ttl))
+
+def jam_sessions_in_bbox(south: float, west: float, north: float, east: float, ttl: int, limit: int) -> list:
+    """ active sessions inside the box, found through the grid_cell index """
+    return _in_bbox(south, west, north, east, ttl).order_by(JamSession.date).limit(limit).all()
+
+def _sql_distance() -> bool:
+    # least/asin/power are Postgres functions, SQLite (tests, local runs) has none of them
+    return db.engine.dialect.name == 'postgresql'
+
+def _distance_km_sql(lat: float, lng: float):
+    # geo.distance_km on the sessions' lat/long, so Postgres can sort by it before the limit
+    a = func.power(func.sin(func.radians(JamSession.lat - lat) / 2), 2) \
+        + math.cos(math.radians(lat)) * func.cos(func.radians(JamSession.lat)) \
+        * func.power(func.sin(func.radians(JamSession.long - lng) / 2), 2)
+    return 2 * EARTH_RADIUS_KM * func.asin(func.least(1.0, func.sqrt(a)))
+
+def jam_sessions_near(lat: float, lng: float, radius_km: float, ttl: int, limit: int) -> list:
+    """ active sessions within radius_km, closest first """
+    candidates = _in_bbox(*bbox_around(lat, lng, radius_km), ttl)
+    if not _sql_distance():
+        # every session in the grid cells around the circle, measured and sorted here instead
+        near = sorted((distance_km(lat, lng, s.lat, s.long), s.id, s) for s in candidates.all())
+        return [s for distance, _, s in near if distance <= radius_km][:limit]
+
+    distance = _distance_km_sql(lat, lng)
+    return candidates.filter(distance <= radius_km).order_by(distance, JamSession.id).limit(limit).all()
+
+def regrid_jam_sessions() -> int:
+    """ recompute every grid_cell, only needed after changing geo.GRID_SIZE """
+    updated = 0
+    for s in JamSession.query.all():
+        if s.grid_cell != grid_cell(s.lat, s.long):
+            s.grid_cell = grid_cell(s.lat, s.long)
+            updated += 1
+    db.session.commit()
+    return updated
+
+def expire_jam_sessions(ttl: int) -> int:
+    """ delete every expired session in one statement, returns how many went """
+    sessions = JamSession.__table__
+    result = db.session.execute(sessions.delete().where(sessions.c.date < jam_session_cutoff(ttl)))
+    if result.rowcount:
+        touch('sessions')
+    db.session.commit()
+    return result.rowcount
+
+
 class Post(db.Model):
     __tablename__ = 'post'
     id = db.Column(db.Integer, primary_key=True)
@@ -255,20 +650,55 @@ class Post(db.Model):
     ratio = db.Column(db.Integer, nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user_table.id'), nullable=False)
+    # processing while the upload jobs run, then ready (or failed)
+    status = db.Column(db.String(20), nullable=False, default='ready')
+    # number of comments, kept up to date by the Comment events below
+    comment_count = db.Column(db.Integer, nullable=False, default=0)
+    # bumped whenever anything a rendered post card shows changes, see fragments.py
+    version = db.Column(db.Integer, nullable=False, default=0)
     section = db.relationship('CommentSection', cascade='all, delete')
 
-    def __init__(self, video_id:str, title: str, msg: str, ratio: int, date: datetime, user_id: int) -> None:
+    def __init__(self, video_id:str, title: str, msg: str, ratio: int, date: datetime, user_id: int, status: str = 'ready') -> None:
         self.video_id = video_id
         self.title = title
         self.msg = msg
         self.ratio = ratio
         self.date_posted = date
         self.user_id = user_id
+        self.status = status
 
     def __repr__(self) -> str:
         return f'{self.user_id}, {self.title}'
 
 
+# Edits made through the ORM (title, message, status...) bump the version
+@event.listens_for(Post, 'before_update')
+def _post_edited(mapper, connection, target):
+    if inspect(target).session.is_modified(target, include_collections=False):
+        # an expression, the counters above move the stored version without the ORM knowing
+        target.version = Post.version + 1
+
+# New, edited and deleted posts change the feed and the author's profile
+@event.listens_for(Post, 'after_insert')
+@event.listens_for(Post, 'after_update')
+@event.listens_for(Post, 'after_delete')
+def _post_changed(mapper, connection, target):
+    touch('feed', f'user:{target.user_id}')
+
+# The author's (or a commenter's) name or photo is on the card, bump every post showing them
+def bump_post_versions_for_user(user_id: int) -> int:
+    post = Post.__table__
+    sections = CommentSection.__table__
+    comments = Comment.__table__
+    commented = select(sections.c.post_id).select_from(comments.join(sections, sections.c.id == comments.c.comment_section_id)) \
+        .where(comments.c.user_id == user_id)
+    result = db.session.execute(post.update().where(or_(post.c.user_id == user_id, post.c.id.in_(commented)))
+                                .values(version=post.c.version + 1))
+    touch('feed', f'user:{user_id}')
+    db.session.commit()
+    return result.rowcount
+
+
 class CommentSection(db.Model):
     __tablename__ = 'comment_section'
     id = db.Column(db.Integer, primary_key=True, nullable=False)
@@ -288,25 +718,55 @@ class Comment(db.Model):
     comment_section_id = db.Column(db.Integer, db.ForeignKey('comment_section.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user_table.id'), nullable=False)
     message = db.Column(db.String(255), nullable=False)
+    post_time = db.Column(db.DateTime, nullable=False)
 
-    def __init__(self, cs_id: int, user_id: int, msg: str) -> None:
+    def __init__(self, cs_id: int, user_id: int, msg: str, post_time: datetime = None) -> None:
         self.comment_section_id = cs_id
         self.user_id = user_id
         self.message = msg
+        self.post_time = post_time or datetime.now()
     
     def __repr__(self) -> str:
         return f'{self.comment_section_id}, {self.user_id}, {self.message}'
 
 
+# Comments added or removed through the ORM keep Post.comment_count in step
+def _add_to_comment_count(connection, comment_section_id, delta):
+    post = Post.__table__
+    sections = CommentSection.__table__
+    post_id = select(sections.c.post_id).where(sections.c.id == comment_section_id).scalar_subquery()
+    connection.execute(post.update().where(post.c.id == post_id)
+                       .values(comment_count=post.c.comment_count + delta, version=post.c.version + 1))
+    touch('feed')
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_added(mapper, connection, target):
+    _add_to_comment_count(connection, target.comment_section_id, 1)
+
+@event.listens_for(Comment, 'after_delete')
+def _comment_removed(mapper, connection, target):
+    _add_to_comment_count(connection, target.comment_section_id, -1)
+
+# Recount every post's comment_count from the comment table in one statement
+def rebuild_comment_counts() -> int:
+    post = Post.__table__
+    sections = CommentSection.__table__
+    comments = Comment.__table__
+    total = select(func.count()).select_from(comments.join(sections, sections.c.id == comments.c.comment_section_id)) \
+        .where(sections.c.post_id == post.c.id).scalar_subquery()
+    result = db.session.execute(post.update().where(post.c.comment_count != total).values(comment_count=total))
+    db.session.commit()
+    return result.rowcount
+
+
+# Post.ratio is kept up to date by the ratio_table events below, so this is a primary key lookup
 def count_likes(post_id):
-    ex_post = ratio_table.query.filter_by(post_id=post_id).all()
-    total = 0
-    for post in ex_post:
-        if post.value == 0:
-            total += -1
-        else:
-            total += post.value
-    return total
+    return db.session.query(Post.ratio).filter(Post.id == post_id).scalar() or 0
+
+# Dislikes used to be stored as 0, they still count as -1
+def vote_weight(value) -> int:
+    value = int(value)
+    return -1 if value == 0 else value
 
 class ratio_table(db.Model):
     __tablename__ = 'ratio_table'
@@ -322,4 +782,71 @@ class ratio_table(db.Model):
         self.value = value
 
     def __repr__(self) -> str:
-        return f'{self.post_id}, {self.user_id}, {self.value}'
\ No newline at end of file
+        return f'{self.post_id}, {self.user_id}, {self.value}'
+
+
+# Keep the denormalized Post.ratio in step with ratio_table inside the same flush/transaction
+def _add_to_ratio(connection, post_id, delta):
+    if delta:
+        post = Post.__table__
+        connection.execute(post.update().where(post.c.id == post_id).values(ratio=post.c.ratio + delta, version=post.c.version + 1))
+        touch('feed')
+
+@event.listens_for(ratio_table, 'after_insert')
+def _vote_inserted(mapper, connection, target):
+    _add_to_ratio(connection, target.post_id, vote_weight(target.value))
+
+@event.listens_for(ratio_table, 'after_update')
+def _vote_changed(mapper, connection, target):
+    history = inspect(target).attrs.value.history
+    if history.deleted:
+        _add_to_ratio(connection, target.post_id, vote_weight(target.value) - vote_weight(history.deleted[0]))
+
+@event.listens_for(ratio_table, 'after_delete')
+def _vote_deleted(mapper, connection, target):
+    _add_to_ratio(connection, target.post_id, -vote_weight(target.value))
+
+# Toggle a user's vote and return the post's new ratio in one statement:
+#  - no vote yet           -> insert it, ratio moves by value
+#  - opposite vote exists  -> flip it, ratio moves by 2 * value
+#  - same vote exists      -> remove it, ratio moves back by its weight
+# ON CONFLICT locks the existing vote row and the post row is updated in place,
+# so concurrent clicks serialize instead of losing or double counting a vote.
+# Raw SQL skips the ratio_table events above, which is why it updates post.ratio itself.
+CAST_VOTE_SQL = text("""
+    WITH vote AS (
+        INSERT INTO ratio_table AS r (post_id, user_id, value)
+        VALUES (:post_id, :user_id, :value)
+        ON CONFLICT (post_id, user_id) DO UPDATE SET value = EXCLUDED.value
+            WHERE (CASE WHEN r.value = 0 THEN -1 ELSE r.value END) <> EXCLUDED.value
+        RETURNING (xmax = 0) AS inserted
+    ), unvote AS (
+        DELETE FROM ratio_table
+        WHERE post_id = :post_id AND user_id = :user_id AND NOT EXISTS (SELECT 1 FROM vote)
+        RETURNING CASE WHEN value = 0 THEN -1 ELSE value END AS weight
+    )
+    UPDATE post SET version = version + 1, ratio = ratio + CASE
+        WHEN EXISTS (SELECT 1 FROM vote WHERE inserted) THEN :value
+        WHEN EXISTS (SELECT 1 FROM vote) THEN 2 * :value
+        ELSE -COALESCE((SELECT weight FROM unvote), 0)
+    END
+    WHERE id = :post_id
+    RETURNING ratio
+""")
+
+def cast_vote(post_id: int, user_id: int, value: int) -> int:
+    """ value is 1 for a like, -1 for a dislike """
+    ratio = db.session.execute(CAST_VOTE_SQL, {'post_id': post_id, 'user_id': user_id, 'value': value}).scalar()
+    touch('feed')
+    db.session.commit()
+    return ratio
+
+# Recount every post's ratio from ratio_table in one statement, for drift from raw SQL or cascades
+def rebuild_ratios() -> int:
+    post = Post.__table__
+    votes = ratio_table.__table__
+    total = select(func.coalesce(func.sum(case((votes.c.value == 0, -1), else_=votes.c.value)), 0)) \
+        .where(votes.c.post_id == post.c.id).scalar_subquery()
+    result = db.session.execute(post.update().where(post.c.ratio.is_distinct_from(total)).values(ratio=total))
+    db.session.commit()
+    return result.rowcount
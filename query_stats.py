@@ -0,0 +1,164 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import request
+from sqlalchemy import event
+from models import db
+
+# Counts and times every statement the app sends to the database, per request.
+# Each request gets a QueryStats; in dev the totals go out as a Server-Timing
+# header (the browser dev tools show them next to the request), in prod as one
+# JSON log line per request. Statements slower than SQL_SLOW_QUERY_MS and
+# statements repeated SQL_REPEAT_THRESHOLD times or more (the same query once
+# per row, an N+1) are called out by name.
+#
+# Recording is per thread, so the sweeper and job threads never end up in a
+# request's numbers. Tests fence off query counts with assert_max_queries.
+
+logger = logging.getLogger('riffroom.sql')
+
+_local = threading.local()
+
+
+class QueryStats:
+    def __init__(self, keep_slowest: int = 5) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest = []
+        self.statements = Counter()
+
+    def add(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.statements[statement] += 1
+        self.slowest.append((seconds, statement))
+        self.slowest.sort(key=lambda pair: pair[0], reverse=True)
+        del self.slowest[self.keep_slowest:]
+
+    def repeated(self, threshold: int) -> list:
+        """ (times, statement) run at least threshold times, most repeated first """
+        return [(times, statement) for statement, times in self.statements.most_common() if times >= threshold]
+
+    def report(self) -> str:
+        lines = [f'{self.count} queries in {self.total * 1000:.1f}ms']
+        for statement, times in self.statements.most_common():
+            lines.append(f'  {times}x {" ".join(statement.split())}')
+        return '\n'.join(lines)
+
+
+def _recorders() -> list:
+    if not hasattr(_local, 'recorders'):
+        _local.recorders = []
+    return _local.recorders
+
+
+@contextmanager
+def recording(keep_slowest: int = 5):
+    """ yields a QueryStats that records every statement run on this thread inside the block """
+    stats = QueryStats(keep_slowest)
+    _recorders().append(stats)
+    try:
+        yield stats
+    finally:
+        _recorders().remove(stats)
+
+
+@contextmanager
+def assert_max_queries(n: int):
+    """ fails the test if the block runs more than n statements, listing what it ran """
+    with recording() as stats:
+        yield stats
+    assert stats.count <= n, f'expected at most {n} queries, got {stats.report()}'
+
+
+def _short(statement: str, length: int = 300) -> str:
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + '...'
+
+
+class QueryInspector:
+    def __init__(self) -> None:
+        self.app = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_execute)
+            event.listen(db.engine, 'handle_error', self._failed)
+
+        @app.before_request
+        def _start_recording():
+            stats = QueryStats(app.config['SQL_SLOWEST_KEPT'])
+            _recorders().append(stats)
+            _local.request_stats = stats
+
+        @app.after_request
+        def _report(response):
+            stats = getattr(_local, 'request_stats', None)
+            if stats is not None:
+                self._report(stats, response)
+            return response
+
+        @app.teardown_request
+        def _stop_recording(exc):
+            stats = getattr(_local, 'request_stats', None)
+            if stats is not None:
+                _local.request_stats = None
+                if stats in _recorders():
+                    _recorders().remove(stats)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if _recorders():
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        recorders = _recorders()
+        started = conn.info.get('query_started')
+        if not recorders or not started:
+            return
+        seconds = time.perf_counter() - started.pop()
+        for stats in recorders:
+            stats.add(statement, seconds)
+
+    def _failed(self, context):
+        # no after_cursor_execute for a statement that raised, drop its start time
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    def _report(self, stats: QueryStats, response) -> None:
+        config = self.app.config
+        repeated = stats.repeated(config['SQL_REPEAT_THRESHOLD'])
+        slow = [(seconds, statement) for seconds, statement in stats.slowest
+                if seconds * 1000 >= config['SQL_SLOW_QUERY_MS']]
+
+        if config['FLASK_ENV'] == 'prod':
+            line = {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': stats.count,
+                'db_ms': round(stats.total * 1000, 1),
+            }
+            if slow:
+                line['slow'] = [{'ms': round(seconds * 1000, 1), 'sql': _short(statement)} for seconds, statement in slow]
+            if repeated:
+                line['repeated'] = [{'times': times, 'sql': _short(statement)} for times, statement in repeated]
+            logger.log(logging.WARNING if slow or repeated else logging.INFO, json.dumps(line))
+        else:
+            timings = [f'db;dur={stats.total * 1000:.1f};desc="{stats.count} queries"']
+            if slow:
+                timings.append(f'db-slowest;dur={slow[0][0] * 1000:.1f}')
+            if repeated:
+                timings.append(f'db-repeated;desc="{repeated[0][0]}x same statement"')
+            response.headers.add('Server-Timing', ', '.join(timings))
+            for times, statement in repeated:
+                logger.warning(f'{request.path} ran {times}x: {_short(statement)}')
+
+
+query_inspector = QueryInspector()
@@ -0,0 +1,89 @@
+from models import db, JamSession, Party, UserTable, time_since_jam_session_date, user_resolver
+
+# Everything the jam session pages show about hosts and party members, loaded
+# in a fixed number of joined queries instead of a Party / UserTable lookup per
+# member (single session page) or per session (session list). Party sizes
+# for the list come from JamSession.member_count.
+
+
+class MemberView:
+    def __init__(self, user_id: int, user_name: str, avatar_version: int = 0) -> None:
+        self.user_id = user_id
+        self.user_name = user_name
+        self.avatar_version = avatar_version
+
+    def __repr__(self) -> str:
+        return f'{self.user_id}, {self.user_name}'
+
+
+class SessionRoster:
+    def __init__(self, jam_session: JamSession, host_user_name: str, members: list) -> None:
+        self.jam_session = jam_session
+        self.host_user_name = host_user_name
+        self.members = members
+        self.member_ids = {m.user_id for m in members}
+
+    @property
+    def member_count(self) -> int:
+        return len(self.members)
+
+    def is_member(self, user_id: int) -> bool:
+        return user_id in self.member_ids
+
+    def __repr__(self) -> str:
+        return f'{self.jam_session.title}: {self.member_count} members'
+
+
+class SessionCard:
+    def __init__(self, jam_session: JamSession, host_user_name: str, member_count: int, joined: bool) -> None:
+        self.id = jam_session.id
+        self.title = jam_session.title
+        self.message = jam_session.message
+        self.date = jam_session.date
+        self.host_id = jam_session.host_id
+        self.host_user_name = host_user_name
+        self.member_count = member_count
+        self.joined = joined
+        self.time_since = time_since_jam_session_date(jam_session.date_posted)
+
+    def __repr__(self) -> str:
+        return f'{self.host_user_name} : {self.title}'
+
+
+def load_roster(session_id: int):
+    """ the session with its host's user name (one query) and every party member in join order (one query) """
+    row = db.session.query(JamSession, UserTable.user_name) \
+        .join(UserTable, UserTable.id == JamSession.host_id) \
+        .filter(JamSession.id == session_id).first()
+    if row is None:
+        return None
+    jam_session, host_user_name = row
+
+    members = [MemberView(user_id, user_name, avatar_version) for user_id, user_name, avatar_version in
+               db.session.query(Party.user_id, UserTable.user_name, UserTable.avatar_version)
+               .join(UserTable, UserTable.id == Party.user_id)
+               .filter(Party.session_id == session_id)
+               .order_by(Party.party_id).all()]
+
+    return SessionRoster(jam_session, host_user_name, members)
+
+
+def joined_sessions(session_ids: list, user_id: int) -> set:
+    """ which of the sessions user_id is in, one query on the (session_id, user_id) key """
+    if not session_ids or user_id is None:
+        return set()
+    return {session_id for session_id, in db.session.query(Party.session_id)
+            .filter(Party.session_id.in_(session_ids), Party.user_id == user_id).all()}
+
+
+def build_session_cards(jam_sessions: list, user_id: int = None) -> list:
+    """ list view cards, host names and the viewer's memberships for every session in two queries """
+    if not jam_sessions:
+        return []
+
+    host_ids = {s.host_id for s in jam_sessions}
+    host_names = user_resolver().names(host_ids)
+    joined = joined_sessions([s.id for s in jam_sessions], user_id)
+
+    # party sizes come from the maintained JamSession.member_count
+    return [SessionCard(s, host_names.get(s.host_id), s.member_count, s.id in joined) for s in jam_sessions]
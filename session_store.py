@@ -0,0 +1,133 @@
+import secrets
+from datetime import datetime, timezone
+from flask import current_app, session
+from flask.sessions import SessionInterface, SecureCookieSessionInterface, SecureCookieSession, session_json_serializer
+from flask_session import Session
+from flask_session.sessions import FileSystemSessionInterface
+from sqlalchemy import select, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from models import db, WebSession
+from sweeper import sweeper
+
+# Where Flask keeps the login session, picked with SESSION_BACKEND:
+#
+#   filesystem  Flask-Session files in the working directory (one box only)
+#   sql         a web_session row per browser, shared by every worker and host
+#   cookie      everything in a signed cookie, no server side storage at all
+#
+# The app only ever stores the user id (plus flash messages) in the session,
+# so the cookie backend is small, and the sql backend only writes when the
+# session actually changes or is about to expire.
+#
+# Logging in or signing up moves the session to a new id (renew_session), so an
+# id handed out before that, or planted by someone else, never reaches the
+# logged in session.
+
+
+def utcnow() -> datetime:
+    # web_session.expires is a plain timestamp, always in UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SqlSession(SecureCookieSession):
+    def __init__(self, initial=None, sid: str = None, expires: datetime = None, new: bool = False) -> None:
+        super().__init__(initial)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.old_sid = None
+
+    def renew(self) -> None:
+        """ a new sid for the same data, the row under the old one is deleted when the session is saved """
+        if not self.new:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class SqlSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def open_session(self, app, request) -> SqlSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with db.engine.connect() as conn:
+                row = conn.execute(select(WebSession.data, WebSession.expires)
+                                   .where(WebSession.id == sid, WebSession.expires > utcnow())).first()
+            if row:
+                return SqlSession(self.serializer.loads(row.data), sid=sid, expires=row.expires)
+        return SqlSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session: SqlSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # logged out / never logged in, nothing to keep
+        if not session:
+            if session.modified and (not session.new or session.old_sid):
+                with db.engine.begin() as conn:
+                    conn.execute(delete(WebSession).where(WebSession.id.in_([session.sid, session.old_sid])))
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        lifetime = app.permanent_session_lifetime
+        expires = utcnow() + lifetime
+
+        if session.modified or session.new:
+            data = self.serializer.dumps(dict(session))
+            with db.engine.begin() as conn:
+                if session.old_sid:
+                    conn.execute(delete(WebSession).where(WebSession.id == session.old_sid))
+                conn.execute(insert(WebSession).values(id=session.sid, data=data, expires=expires)
+                             .on_conflict_do_update(index_elements=[WebSession.id], set_={'data': data, 'expires': expires}))
+        elif session.expires - utcnow() < lifetime / 2:
+            # sliding expiry, but at most one write per half lifetime for a read-only session
+            with db.engine.begin() as conn:
+                conn.execute(update(WebSession).where(WebSession.id == session.sid).values(expires=expires))
+        else:
+            return
+
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain,
+                            path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def renew_session() -> None:
+    """ move the current session to a new id, call it whenever the user the session belongs to changes """
+    interface = current_app.session_interface
+    if isinstance(interface, SqlSessionInterface):
+        session.renew()
+    elif isinstance(interface, FileSystemSessionInterface):
+        interface.cache.delete(interface.key_prefix + session.sid)
+        session.sid = interface._generate_sid()
+        session.modified = True
+    # the cookie backend has no id to move, the signed cookie changes with its contents
+
+
+def expire_web_sessions() -> int:
+    """ delete every expired web_session row in one statement """
+    with db.engine.begin() as conn:
+        return conn.execute(delete(WebSession).where(WebSession.expires <= utcnow())).rowcount
+
+
+def init_session(app) -> None:
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'filesystem':
+        Session(app)
+    elif backend == 'sql':
+        app.session_interface = SqlSessionInterface()
+        sweeper.task(expire_web_sessions)
+    elif backend == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND {backend}')
@@ -0,0 +1,29 @@
+'use strict';
+
+// "Load more comments" fetches the next page of older comments and puts it
+// where the button was, with a new button if there are more after it.
+document.addEventListener('click', (event) => {
+    const button = event.target.closest('.more-comments');
+    if (!button || button.disabled) {
+        return;
+    }
+    button.disabled = true;
+
+    fetch(`${button.dataset.url}?cursor=${encodeURIComponent(button.dataset.next)}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        })
+        .then(page => {
+            button.insertAdjacentHTML('beforebegin', page.html);
+            if (page.next_cursor) {
+                button.dataset.next = page.next_cursor;
+                button.disabled = false;
+            } else {
+                button.remove();
+            }
+        })
+        .catch(() => { button.disabled = false; });
+});
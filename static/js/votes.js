@@ -0,0 +1,29 @@
+'use strict';
+
+// Send vote forms as JSON requests and update the score in place instead of
+// following the redirect and re-rendering the whole page.
+document.addEventListener('submit', (event) => {
+    const form = event.target.closest('.vote-form');
+    if (!form) {
+        return;
+    }
+    event.preventDefault();
+
+    const body = new FormData(form, event.submitter);
+    fetch(form.action, {
+        method: 'POST',
+        headers: { 'Accept': 'application/json' },
+        body: body
+    })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        })
+        .then(vote => {
+            const score = form.parentElement.querySelector('.post-score');
+            score.textContent = vote.ratio;
+        })
+        .catch(() => window.location.reload());
+});
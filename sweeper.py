@@ -0,0 +1,70 @@
+import threading
+import traceback
+from datetime import datetime
+from models import db
+
+# Runs housekeeping statements (like expiring jam sessions) on a timer in a
+# daemon thread, so no page view has to do that work. Each web process runs
+# its own sweeper; the tasks are single set-based statements, so running them
+# from several processes at once is harmless.
+
+
+class Sweeper:
+    def __init__(self) -> None:
+        self.app = None
+        self.tasks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+        # started by the first request, so importing the app (tests, CLI) doesn't spawn threads
+        @app.before_request
+        def _start_sweeper():
+            self.start()
+
+    def task(self, fn):
+        """ register fn() to run every SWEEP_INTERVAL seconds """
+        if fn not in self.tasks:
+            self.tasks.append(fn)
+        return fn
+
+    def run_once(self) -> dict:
+        """ run every task now, returns {task name: result or error} """
+        results = {}
+        for fn in self.tasks:
+            try:
+                results[fn.__name__] = fn()
+            except Exception as e:
+                db.session.rollback()
+                traceback.print_exc()
+                results[fn.__name__] = e
+            finally:
+                db.session.remove()
+        return results
+
+    def _run(self) -> None:
+        with self.app.app_context():
+            while not self._stop.is_set():
+                results = self.run_once()
+                if any(results.values()):
+                    print(f'[{datetime.now()}] sweep: {results}')
+                self._stop.wait(self.app.config['SWEEP_INTERVAL'])
+
+    def start(self) -> None:
+        if self._thread is not None or not self.tasks:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sweeper', daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+sweeper = Sweeper()
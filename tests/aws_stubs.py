@@ -0,0 +1,76 @@
+from uuid import uuid4
+
+# In-memory stand-ins for the AWS clients the app uses, register them with
+# aws_clients.aws.register(...) so tests never need network or credentials.
+
+
+class FakeS3:
+    """ keeps objects in a dict and implements the multipart calls like S3 does """
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.part_sizes = []
+        self.aborted = []
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = str(uuid4())
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        self.part_sizes.append(len(Body))
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+        assert numbers == sorted(parts), 'parts missing or out of order'
+        self.objects[(Bucket, Key)] = b''.join(parts[n] for n in numbers)
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        self.aborted.append(Key)
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, 'rb') as f:
+            self.objects[(Bucket, Key)] = f.read()
+
+    def list_objects_v2(self, Bucket, Prefix=''):
+        keys = [k for b, k in self.objects if b == Bucket and k.startswith(Prefix)]
+        return {'Contents': [{'Key': k} for k in keys]} if keys else {}
+
+
+class FakeBucket:
+    def __init__(self, name, s3):
+        self.name = name
+        self.s3 = s3
+
+    def copy(self, copy_source, key):
+        self.s3.objects[(self.name, key)] = self.s3.objects[(copy_source['Bucket'], copy_source['Key'])]
+
+
+class FakeTranscoder:
+    def __init__(self):
+        self.jobs = []
+        self.statuses = {}
+
+    def create_job(self, **job):
+        self.jobs.append(job)
+        job_id = str(len(self.jobs))
+        self.statuses[job_id] = 'Submitted'
+        return {'Job': {'Id': job_id, 'Status': 'Submitted'}}
+
+    def read_job(self, Id):
+        return {'Job': {'Id': Id, 'Status': self.statuses[Id]}}
+
+
+class FakeCloudFront:
+    def __init__(self, domain='cdn.riffroom.test'):
+        self.domain = domain
+        self.calls = 0
+
+    def get_distribution(self, Id):
+        self.calls += 1
+        return {'Distribution': {'Id': Id, 'DomainName': self.domain}}
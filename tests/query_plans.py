@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from models import db
+
+# Query plan checks: record the statements a code path sends to Postgres, then
+# EXPLAIN each one with sequential scans switched off. The planner still picks
+# a Seq Scan when no index can answer the query at all, so any that show up
+# are a missing index, however few rows the test database holds.
+
+
+@contextmanager
+def captured_statements():
+    """ yields a list that fills with (statement, parameters) for everything executed inside the block """
+    statements = []
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+
+def explain(statement: str, parameters) -> str:
+    """ the plan Postgres picks when it can't fall back on a sequential scan, nothing is executed """
+    with db.engine.connect() as conn:
+        with conn.begin() as transaction:
+            conn.exec_driver_sql('set local enable_seqscan = off')
+            rows = conn.exec_driver_sql(f'explain {statement}', parameters).all()
+            transaction.rollback()
+    return '\n'.join(row[0] for row in rows)
+
+
+def seq_scans(statements: list) -> dict:
+    """ {statement: plan} for every statement whose plan still has a Seq Scan """
+    found = {}
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+            continue
+        plan = explain(statement, parameters)
+        if 'Seq Scan' in plan:
+            found[statement] = plan
+    return found
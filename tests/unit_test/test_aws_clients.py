@@ -0,0 +1,39 @@
+import os
+from app import app
+from aws_clients import AwsClients
+from tests.aws_stubs import FakeCloudFront
+
+
+def test_distribution_url_is_resolved_once(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', None)
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+
+    #the first lookup asks cloudfront and caches the answer in the instance folder
+    clients = AwsClients()
+    cloudfront = FakeCloudFront('e2clj3wm17v7lf.cloudfront.net')
+    clients.register('cloudfront', cloudfront)
+    assert clients.distribution_url() == 'https://e2clj3wm17v7lf.cloudfront.net/'
+    assert clients.distribution_url() == 'https://e2clj3wm17v7lf.cloudfront.net/'
+    assert cloudfront.calls == 1
+    assert os.path.exists(tmp_path / app.config['DISTRIBUTION_URL_CACHE'])
+
+    #a new process (or recycled worker) reads the cached url without calling aws
+    fresh = AwsClients()
+    fresh_cloudfront = FakeCloudFront('e2clj3wm17v7lf.cloudfront.net')
+    fresh.register('cloudfront', fresh_cloudfront)
+    assert fresh.distribution_url() == 'https://e2clj3wm17v7lf.cloudfront.net/'
+    assert fresh_cloudfront.calls == 0
+
+    #a configured url wins over everything
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.example/')
+    configured = AwsClients()
+    assert configured.distribution_url() == 'https://cdn.example/'
+
+
+def test_clients_are_lazy_and_shared():
+    clients = AwsClients()
+    #nothing is built until it is asked for
+    assert clients._session is None
+    s3 = clients.client('s3')
+    assert clients.client('s3') is s3
+    assert clients.s3_client is s3
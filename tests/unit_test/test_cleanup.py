@@ -0,0 +1,91 @@
+import os
+from flask import Flask
+from cleanup import FileReaper
+
+
+def make_reaper(tmp_path, monkeypatch):
+    app = Flask(__name__, instance_path=str(tmp_path / 'instance'))
+    app.config.update(CLEANUP_MANIFEST_PATH='cleanup.sqlite3', CLEANUP_BASE_DELAY=0,
+                      CLEANUP_MAX_DELAY=0, CLEANUP_MAX_ATTEMPTS=3)
+    reaper = FileReaper()
+    reaper.init_app(app)
+    #the test drives run_once itself instead of the background thread
+    monkeypatch.setattr(reaper, 'start', lambda: None)
+    return reaper
+
+
+def test_schedule_removal(tmp_path, monkeypatch):
+    reaper = make_reaper(tmp_path, monkeypatch)
+
+    #removable files are gone before schedule_removal returns
+    temp = tmp_path / 'pfp.jpg'
+    temp.write_bytes(b'jpg')
+    assert reaper.schedule_removal(str(temp))
+    assert not temp.exists()
+
+    #missing files count as removed
+    assert reaper.schedule_removal(str(tmp_path / 'missing.jpg'))
+    assert reaper.metrics()['pending'] == 0
+
+
+def test_reaper_retries(tmp_path, monkeypatch):
+    reaper = make_reaper(tmp_path, monkeypatch)
+
+    #a directory can't be os.remove'd, so it stands in for a locked file
+    locked = tmp_path / 'locked.jpg'
+    locked.mkdir()
+    assert not reaper.schedule_removal(str(locked))
+    assert reaper.metrics()['pending'] == 1
+
+    #still locked, the retry is pushed back
+    reaper.run_once()
+    assert reaper.metrics()['retried'] == 1
+    assert reaper.metrics()['pending'] == 1
+
+    #unlocked, the next pass removes it and empties the manifest
+    os.rmdir(locked)
+    locked.write_bytes(b'jpg')
+    assert reaper.run_once() is None
+    assert not locked.exists()
+    assert reaper.metrics()['pending'] == 0
+
+
+def test_reaper_gives_up(tmp_path, monkeypatch):
+    reaper = make_reaper(tmp_path, monkeypatch)
+
+    locked = tmp_path / 'locked.jpg'
+    locked.mkdir()
+    reaper.schedule_removal(str(locked))
+
+    #after CLEANUP_MAX_ATTEMPTS the file is dropped from the manifest
+    for _ in range(3):
+        reaper.run_once()
+    metrics = reaper.metrics()
+    assert metrics['gave_up'] == 1
+    assert metrics['pending'] == 0
+
+    #the manifest is shared, a second reaper on the same folder sees the same files
+    reaper.schedule_removal(str(locked))
+    other = make_reaper(tmp_path, monkeypatch)
+    assert other.metrics()['pending'] == 1
+
+
+def test_reaper_resumes_leftovers(tmp_path, monkeypatch):
+    #an earlier process couldn't remove a file and went away
+    locked = tmp_path / 'locked.jpg'
+    locked.mkdir()
+    make_reaper(tmp_path, monkeypatch).schedule_removal(str(locked))
+
+    #a new process with nothing to remove itself still starts retrying it on the sweep
+    reaper = make_reaper(tmp_path, monkeypatch)
+    started = []
+    monkeypatch.setattr(reaper, 'start', lambda: started.append(True))
+    assert reaper.resume_pending() == 1
+    assert started == [True]
+
+    #with an empty manifest there is nothing to start
+    os.rmdir(locked)
+    reaper.run_once()
+    started.clear()
+    assert reaper.resume_pending() == 0
+    assert started == []
@@ -0,0 +1,87 @@
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, CommentSection, Comment, rebuild_comment_counts
+from feed import load_feed_page, load_comment_page
+from datetime import datetime, timedelta
+
+
+def test_comment_pages(monkeypatch):
+    #start with clearing the database
+    clear_data()
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    monkeypatch.setitem(app.config, 'COMMENTS_PAGE_SIZE', 2)
+
+    #one user posts a video with a comment section
+    newuser1 = UserTable('obamna', 'soda',
+                        'The Barock', '123',
+                        '44@gmail.com',
+                        '123-456-7890')
+    db.session.add(newuser1)
+    db.session.commit()
+    p = Post('fake_id', 'Example Post', 'example descriptions', 0, datetime.now(), newuser1.id)
+    db.session.add(p)
+    db.session.commit()
+    p_comsec = CommentSection(p.id)
+    db.session.add(p_comsec)
+    db.session.commit()
+
+    #five comments a minute apart, the last two at the same moment
+    start = datetime.now() - timedelta(minutes=10)
+    times = [start, start + timedelta(minutes=1), start + timedelta(minutes=2), start + timedelta(minutes=3), start + timedelta(minutes=3)]
+    for n, post_time in enumerate(times):
+        db.session.add(Comment(p_comsec.id, newuser1.id, f'comment {n}', post_time))
+        db.session.commit()
+
+    #assert the counter followed every insert
+    db.session.refresh(p)
+    assert p.comment_count == 5
+
+    #page through newest first, ties split by id
+    seen = []
+    page, cursor = load_comment_page(p.id, limit=2)
+    seen += page
+    while cursor:
+        page, cursor = load_comment_page(p.id, cursor, limit=2)
+        seen += page
+    assert [c.message for c in seen] == ['comment 4', 'comment 3', 'comment 2', 'comment 1', 'comment 0']
+    assert seen[0].user_name == 'The Barock'
+
+    #assert the feed card only carries the first page plus a cursor for the rest
+    cards, _ = load_feed_page(comment_limit=2)
+    assert [c.message for c in cards[0].comments] == ['comment 4', 'comment 3']
+    assert cards[0].comment_count == 5
+    page, cursor = load_comment_page(p.id, cards[0].comments_cursor, limit=2)
+    assert [c.message for c in page] == ['comment 2', 'comment 1']
+
+    #the load more endpoint answers with rendered rows and the next cursor
+    with app.test_client() as client:
+        assert client.get(f'/{p.id}/comments').status_code == 401
+        with client.session_transaction() as sess:
+            sess['id'] = newuser1.id
+        response = client.get(f'/{p.id}/comments', query_string={'cursor': cards[0].comments_cursor})
+        assert response.status_code == 200
+        assert 'comment 2' in response.json['html'] and 'comment 4' not in response.json['html']
+        assert response.json['next_cursor'] == cursor
+        assert client.get(f'/{p.id}/comments', query_string={'cursor': 'nonsense'}).status_code == 400
+
+        #the post page shows the total but only the newest page
+        response = client.get(f'/{p.id}')
+        assert b'5 Comments' in response.data
+        assert b'comment 4' in response.data and b'comment 0' not in response.data
+        assert client.get('/999999').status_code == 404
+
+    #deleting a comment moves the counter back, and a rebuild finds nothing to fix
+    db.session.delete(Comment.query.filter_by(message='comment 0').first())
+    db.session.commit()
+    db.session.refresh(p)
+    assert p.comment_count == 4
+    assert rebuild_comment_counts() == 0
+
+    #drift from outside the ORM is repaired by the rebuild
+    db.session.execute(Post.__table__.update().values(comment_count=0))
+    db.session.commit()
+    assert rebuild_comment_counts() == 1
+    db.session.refresh(p)
+    assert p.comment_count == 4
+
+    clear_data()
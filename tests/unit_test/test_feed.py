@@ -0,0 +1,79 @@
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, CommentSection, Comment, ratio_table
+from feed import load_feed_page, build_post_cards
+from datetime import datetime, timedelta
+
+
+def test_feed_cards():
+    #start with clearing the database
+    clear_data()
+    assert load_feed_page() == ([], None)
+
+    #create two users
+    newuser1 = UserTable('obamna', 'soda',
+                        'The Barock', '123',
+                        '44@gmail.com',
+                        '123-456-7890')
+    newuser2 = UserTable('Crazy', 'guy',
+                        'Crazy guy', '123',
+                        'ex@gmail.com',
+                        '123-456-1230')
+    db.session.add(newuser1)
+    db.session.add(newuser2)
+    db.session.commit()
+
+    #newuser1 makes an older and a newer post, each with a comment section
+    old_post = Post('old_id', 'Old Post', 'old desc', 0, datetime.now() - timedelta(days=2), newuser1.id)
+    new_post = Post('new_id', 'New Post', 'new desc', 0, datetime.now(), newuser1.id)
+    db.session.add(old_post)
+    db.session.add(new_post)
+    db.session.commit()
+    old_cs = CommentSection(old_post.id)
+    new_cs = CommentSection(new_post.id)
+    db.session.add(old_cs)
+    db.session.add(new_cs)
+    db.session.commit()
+
+    #newuser2 comments on and likes the new post, newuser1 dislikes the old one
+    db.session.add(Comment(new_cs.id, newuser2.id, 'Cool'))
+    db.session.add(Comment(new_cs.id, newuser1.id, 'Thanks'))
+    db.session.add(ratio_table(new_post.id, newuser2.id, 1))
+    db.session.add(ratio_table(old_post.id, newuser1.id, -1))
+    db.session.commit()
+
+    cards, next_cursor = load_feed_page()
+    assert next_cursor is None
+
+    #assert the cards come back newest first with names, scores and comments filled in
+    assert [c.title for c in cards] == ['New Post', 'Old Post']
+    assert cards[0].author_name == 'The Barock'
+    assert cards[0].score == 1
+    assert cards[1].score == -1
+    assert [str(c) for c in cards[0].comments] == ['The Barock: Thanks', 'Crazy guy: Cool']
+    assert cards[0].comment_count == 2
+    assert cards[0].comments_cursor is None
+    assert cards[1].comments == []
+    assert cards[1].time_since == 'uploaded 2 days ago'
+
+    #assert an empty post list needs no queries at all
+    assert build_post_cards([]) == []
+
+    #page through the feed one post at a time
+    first_page, cursor = load_feed_page(limit=1)
+    assert [c.title for c in first_page] == ['New Post']
+    assert cursor == f'{new_post.date_posted.isoformat()}_{new_post.id}'
+    second_page, cursor = load_feed_page(cursor, limit=1)
+    assert [c.title for c in second_page] == ['Old Post']
+    assert cursor is None
+
+    #posts made at the same moment are still split cleanly by id
+    same_time = Post('same_id', 'Same Time Post', 'same desc', 0, old_post.date_posted, newuser2.id)
+    db.session.add(same_time)
+    db.session.commit()
+    first_page, cursor = load_feed_page(limit=2)
+    second_page, cursor = load_feed_page(cursor, limit=2)
+    assert [c.title for c in first_page + second_page] == ['New Post', 'Same Time Post', 'Old Post']
+    assert cursor is None
+
+    clear_data()
@@ -0,0 +1,115 @@
+import pytest
+from contextlib import contextmanager
+from app import app
+import fragments
+from models import UserTable, clear_data, db, Post, CommentSection, Comment, cast_vote, bump_post_versions_for_user
+from fragments import MemoryFragmentCache, SqliteFragmentCache, render_post_cards, fragment_cache
+from tests.query_plans import captured_statements
+from datetime import datetime
+
+
+def test_fragment_caches(tmp_path):
+    #the memory cache drops the least recently used html once it is over max_bytes
+    cache = MemoryFragmentCache(max_bytes=10)
+    cache.set_many({'a': 'aaaa', 'b': 'bbbb'})
+    assert cache.get_many(['a']) == {'a': 'aaaa'}
+    cache.set_many({'c': 'cccc'})
+    assert cache.get_many(['a', 'b', 'c']) == {'a': 'aaaa', 'c': 'cccc'}
+    assert cache.size == 8
+
+    #the sqlite cache does the same across connections
+    cache = SqliteFragmentCache(str(tmp_path / 'fragments.sqlite3'), max_bytes=10)
+    cache.set_many({'a': 'aaaa', 'b': 'bbbb'})
+    assert cache.get_many(['a']) == {'a': 'aaaa'}
+    cache.set_many({'c': 'cccc'})
+    assert SqliteFragmentCache(cache.path, 10).get_many(['a', 'b', 'c']) == {'a': 'aaaa', 'c': 'cccc'}
+
+
+def test_sqlite_hits_touch_rarely(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(fragments.time, 'time', lambda: clock[0])
+    cache = SqliteFragmentCache(str(tmp_path / 'fragments.sqlite3'), max_bytes=100, touch_interval=60)
+    cache.set_many({'a': 'aaaa', 'b': 'bbbb'})
+    statements = []
+    real_connect = cache._connect
+
+    @contextmanager
+    def traced():
+        with real_connect() as conn:
+            conn.set_trace_callback(statements.append)
+            yield conn
+    monkeypatch.setattr(cache, '_connect', traced)
+
+    #assert hits within the interval are plain reads
+    clock[0] += 30
+    assert cache.get_many(['a', 'b']) == {'a': 'aaaa', 'b': 'bbbb'}
+    assert not [s for s in statements if s.startswith('update')]
+
+    #assert once it has passed only the hit keys are written, and only once
+    clock[0] += 31
+    assert cache.get_many(['a']) == {'a': 'aaaa'}
+    assert cache.get_many(['a']) == {'a': 'aaaa'}
+    assert len([s for s in statements if s.startswith('update')]) == 1
+    with real_connect() as conn:
+        assert dict(conn.execute('select key, used_at from fragments')) == {'a': 1061.0, 'b': 1000.0}
+
+
+def test_post_card_versions():
+    #start with clearing the database
+    clear_data()
+
+    newuser1 = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    newuser2 = UserTable('Crazy', 'guy', 'Crazy guy', '123', 'ex@gmail.com', '123-456-1230')
+    db.session.add_all([newuser1, newuser2])
+    db.session.commit()
+    p = Post('fake_id', 'Example Post', 'example descriptions', 0, datetime.now(), newuser1.id)
+    db.session.add(p)
+    db.session.commit()
+    cs = CommentSection(p.id)
+    db.session.add(cs)
+    db.session.commit()
+
+    def render():
+        db.session.expire_all()
+        with app.test_request_context():
+            post = Post.query.get(p.id)
+            with captured_statements() as statements:
+                cards = render_post_cards([post], 'https://cdn.test/')
+        return str(cards[0]), len(statements)
+
+    #first render builds the card, the second one is served without touching the database
+    html, queries = render()
+    assert 'Example Post' in html and queries > 0
+    assert render() == (html, 0)
+
+    #a vote bumps the version and the new score shows up
+    cast_vote(p.id, newuser2.id, 1)
+    html, queries = render()
+    assert queries > 0
+    assert '>1</p>' in html.replace(' ', '')
+
+    #so does a comment
+    db.session.add(Comment(cs.id, newuser2.id, 'Cool'))
+    db.session.commit()
+    html, _ = render()
+    assert 'Cool' in html and '1 Comments' in html
+
+    #and an edit through the ORM, even after the counters moved the version behind its back
+    version = Post.query.get(p.id).version
+    cast_vote(p.id, newuser1.id, 1)
+    post = Post.query.get(p.id)
+    post.title = 'Edited Post'
+    db.session.commit()
+    db.session.refresh(post)
+    assert post.version == version + 2
+    html, _ = render()
+    assert 'Edited Post' in html
+
+    #profile changes bump every post the user is on, authored or commented
+    assert bump_post_versions_for_user(newuser2.id) == 1
+    assert render()[1] > 0
+    assert render()[1] == 0
+
+    with app.app_context():
+        fragment_cache().clear()
+    clear_data()
@@ -0,0 +1,147 @@
+import os
+import pytest
+from flask import Flask
+from app import app
+from models import UserTable, clear_data, db, Post, CommentSection, Comment, JamSession, cast_vote, join_jam_session, touch, change_stamps
+from sqlalchemy import text
+from sweeper import sweeper
+from http_cache import http_cache, HttpCache
+from tests.query_plans import captured_statements
+from datetime import datetime, timedelta
+
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={'If-None-Match': f'"{etag}"'})
+
+
+def test_conditional_pages(monkeypatch):
+    #start with clearing the database
+    clear_data()
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+    #a minute rolling over mid test would change every tag, hold the time bucket still
+    monkeypatch.setattr(http_cache, 'time_bucket', lambda: 0)
+
+    newuser1 = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    newuser2 = UserTable('Crazy', 'guy', 'Crazy guy', '123', 'ex@gmail.com', '123-456-1230')
+    db.session.add_all([newuser1, newuser2])
+    db.session.commit()
+    p = Post('fake_id', 'Example Post', 'example descriptions', 0, datetime.now(), newuser1.id)
+    db.session.add(p)
+    db.session.commit()
+    cs = CommentSection(p.id)
+    db.session.add(cs)
+    db.session.commit()
+    sesh = JamSession('sesh', 'come jam', datetime.now() + timedelta(hours=1), datetime.now(), 10.0, 10.0, newuser1.id)
+    db.session.add(sesh)
+    db.session.commit()
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = newuser2.id
+
+        for url in ['/', f'/{p.id}', f'/profile/{newuser1.id}', '/sessions/']:
+            response = client.get(url)
+            assert response.status_code == 200
+            etag = response.get_etag()[0]
+            assert 'no-cache' in response.headers['Cache-Control']
+
+            #assert an unchanged page is answered with a bare 304 and only the stamp lookup
+            with captured_statements() as statements:
+                response = revalidate(client, url, etag)
+            assert response.status_code == 304
+            assert response.data == b''
+            assert len(statements) <= 1
+
+        #a vote changes the feed and the post page
+        feed_etag = client.get('/').get_etag()[0]
+        post_etag = client.get(f'/{p.id}').get_etag()[0]
+        profile_etag = client.get(f'/profile/{newuser1.id}').get_etag()[0]
+        cast_vote(p.id, newuser2.id, 1)
+        assert revalidate(client, '/', feed_etag).status_code == 200
+        assert revalidate(client, f'/{p.id}', post_etag).status_code == 200
+        #but not the author's profile, votes aren't shown there
+        assert revalidate(client, f'/profile/{newuser1.id}', profile_etag).status_code == 304
+
+        #a comment changes the post page
+        post_etag = client.get(f'/{p.id}').get_etag()[0]
+        db.session.add(Comment(cs.id, newuser2.id, 'Cool'))
+        db.session.commit()
+        assert revalidate(client, f'/{p.id}', post_etag).status_code == 200
+
+        #a new post changes its author's profile
+        db.session.add(Post('other_id', 'Another Post', 'desc', 0, datetime.now(), newuser1.id))
+        db.session.commit()
+        response = revalidate(client, f'/profile/{newuser1.id}', profile_etag)
+        assert response.status_code == 200 and b'Another Post' in response.data
+
+        #joining a session changes the session list
+        sessions_etag = client.get('/sessions/').get_etag()[0]
+        join_jam_session(sesh.id, newuser2.id)
+        assert revalidate(client, '/sessions/', sessions_etag).status_code == 200
+
+        #another viewer never gets this viewer's copy
+        feed_etag = client.get('/').get_etag()[0]
+        with client.session_transaction() as sess:
+            sess['id'] = newuser1.id
+        assert revalidate(client, '/', feed_etag).status_code == 200
+
+        #a pending flash message is always rendered
+        feed_etag = client.get('/').get_etag()[0]
+        with client.session_transaction() as sess:
+            sess['_flashes'] = [('message', 'Successfully Logged In')]
+        response = revalidate(client, '/', feed_etag)
+        assert response.status_code == 200 and b'Successfully Logged In' in response.data
+
+    clear_data()
+
+
+def test_stamps_bumped_after_commit():
+    #start with clearing the database
+    clear_data()
+    touch('feed')
+    db.session.commit()
+    before = change_stamps('feed')[0]
+
+    #a write in progress doesn't hold the feed stamp, other writers bump it without waiting
+    newuser = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(newuser)
+    db.session.flush()
+    touch('feed')
+    with db.engine.begin() as other:
+        other.execute(text("set local lock_timeout = '1s'"))
+        other.execute(text("update change_stamp set version = version + 1 where scope = 'feed'"))
+
+    #the stamp moves once the write commits
+    db.session.commit()
+    assert change_stamps('feed')[0] == before + 2
+
+    #and not at all for a write that is rolled back
+    touch('feed')
+    db.session.rollback()
+    db.session.commit()
+    assert change_stamps('feed')[0] == before + 2
+
+    #clearing the database at the end
+    clear_data()
+
+
+def test_salt_follows_template_contents(tmp_path):
+    def salt(checkout, version=''):
+        scratch = Flask(__name__, root_path=str(checkout))
+        return HttpCache()._template_hash(scratch, version)
+
+    #two checkouts of the same templates made at different times, as on two hosts behind a balancer
+    for checkout, mtime in [('a', 1_000_000), ('b', 2_000_000)]:
+        (tmp_path / checkout / 'templates').mkdir(parents=True)
+        page = tmp_path / checkout / 'templates' / 'index.html'
+        page.write_text('<p>feed</p>')
+        os.utime(page, (mtime, mtime))
+
+    #assert they tag pages the same
+    assert salt(tmp_path / 'a') == salt(tmp_path / 'b')
+
+    #assert new template contents or a new HTTP_CACHE_VERSION change the tags
+    assert salt(tmp_path / 'a', 'v2') != salt(tmp_path / 'b')
+    (tmp_path / 'b' / 'templates' / 'index.html').write_text('<p>new feed</p>')
+    assert salt(tmp_path / 'a') != salt(tmp_path / 'b')
@@ -0,0 +1,87 @@
+import pytest
+import time
+from sweeper import sweeper
+from app import app
+from jobs import JobQueue, JobThread, handler, work_once, enqueue, QUEUED, RUNNING, DONE, FAILED
+
+calls = []
+failures = []
+
+@handler('test_echo')
+def echo_job(payload):
+    calls.append(payload)
+
+@handler('test_broken', on_failure=lambda payload, error: failures.append((payload, error)))
+def broken_job(payload):
+    raise RuntimeError('boom')
+
+
+def test_job_queue(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_MAX_ATTEMPTS', 2)
+    monkeypatch.setitem(app.config, 'JOB_RETRY_DELAY', 0)
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+
+    #jobs run in order and are marked done
+    first = queue.enqueue('test_echo', {'n': 1})
+    second = queue.enqueue('test_echo', {'n': 2})
+    assert work_once(queue)
+    assert work_once(queue)
+    assert not work_once(queue)
+    assert calls == [{'n': 1}, {'n': 2}]
+    assert queue.get(first).state == DONE
+    assert queue.counts() == {DONE: 2}
+
+    #delayed jobs wait their turn
+    later = queue.enqueue('test_echo', {'n': 3}, delay=60)
+    assert not work_once(queue)
+    assert queue.get(later).state == QUEUED
+
+    #failing jobs are retried and then given up on, calling the failure hook once
+    broken = queue.enqueue('test_broken', {'post_id': 7})
+    assert work_once(queue)
+    assert queue.get(broken).state == QUEUED
+    assert queue.get(broken).attempts == 1
+    assert work_once(queue)
+    job = queue.get(broken)
+    assert job.state == FAILED
+    assert job.error == 'RuntimeError: boom'
+    assert failures == [({'post_id': 7}, 'RuntimeError: boom')]
+
+
+def test_stale_jobs_are_requeued(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    job_id = queue.enqueue('test_echo', {'n': 4})
+
+    #a worker claims the job and then dies
+    assert queue.claim().id == job_id
+    assert queue.get(job_id).state == RUNNING
+    assert queue.claim() is None
+
+    assert queue.requeue_stale(timeout=-1) == 1
+    assert queue.claim().id == job_id
+
+
+def test_job_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+    calls.clear()
+    enqueue('test_echo', {'n': 5})
+    enqueue('test_echo', {'n': 6})
+    jobs = JobThread()
+    jobs.app = app
+
+    #left alone when a jobs-worker process runs them
+    monkeypatch.setitem(app.config, 'JOBS_IN_WEB_PROCESS', False)
+    assert jobs.run_once() == 0
+    jobs.start()
+    assert jobs._thread is None
+    assert calls == []
+
+    #otherwise the web process runs them on a thread of its own, not the sweeper's
+    monkeypatch.setitem(app.config, 'JOBS_IN_WEB_PROCESS', True)
+    assert not any('job' in fn.__name__ for fn in sweeper.tasks)
+    jobs.start()
+    deadline = time.time() + 10
+    while len(calls) < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    jobs.stop()
+    assert sorted(c['n'] for c in calls) == [5, 6]
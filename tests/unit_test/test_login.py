@@ -0,0 +1,162 @@
+import pytest
+import bcrypt
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app import app
+from models import UserTable, clear_data, db
+from auth import passwords, login_throttle, TokenBucketLimiter, SqlTokenBucketLimiter, PasswordHasher, HasherBusy
+
+
+def login(client, username, password, ip='10.0.0.1', headers=None):
+    response = client.post('/login', data={'username': username, 'password': password},
+                           environ_base={'REMOTE_ADDR': ip}, headers=headers)
+    with client.session_transaction() as sess:
+        return sess.get('id'), sess['_flashes'][-1][1]
+
+
+def test_login(monkeypatch):
+    #start by clearing the database
+    clear_data()
+    #a fresh limiter so earlier tests don't count
+    monkeypatch.setattr(login_throttle, 'by_user', TokenBucketLimiter(3, 1))
+    monkeypatch.setattr(login_throttle, 'by_ip', TokenBucketLimiter(10, 1))
+
+    #an account hashed at a lower cost than BCRYPT_LOG_ROUNDS
+    old_hash = bcrypt.hashpw(b'hunter2', bcrypt.gensalt(4)).decode()
+    user = UserTable('obamna', 'soda', 'barock', old_hash, '44@gmail.com', '123-456-7890')
+    db.session.add(user)
+    db.session.commit()
+
+    with app.test_client() as client:
+        #unknown users and wrong passwords get the same answer, no sleep involved
+        assert login(client, 'nobody', 'hunter2') == (None, 'Incorrect Username or Password')
+        assert login(client, 'barock', 'wrong') == (None, 'Incorrect Username or Password')
+
+        #the right password logs in and upgrades the hash to the current cost
+        assert login(client, 'barock', 'hunter2') == (user.id, 'Successfully Logged In')
+        db.session.refresh(user)
+        assert user.password.startswith(f'$2b${app.config["BCRYPT_LOG_ROUNDS"]}$')
+        assert not passwords.needs_rehash(user.password)
+        client.post('/logout')
+
+        #a successful login clears the username's bucket, then 3 bad tries use it up
+        for _ in range(3):
+            assert login(client, 'barock', 'wrong')[1] == 'Incorrect Username or Password'
+        user_id, message = login(client, 'barock', 'hunter2')
+        assert user_id is None and message.startswith('Too many login attempts')
+
+        #the same IP is throttled across usernames too
+        for i in range(10):
+            login(client, f'spray{i}', 'wrong', ip='10.0.0.2')
+        assert login(client, 'barock', 'hunter2', ip='10.0.0.2')[1].startswith('Too many login attempts')
+
+    clear_data()
+
+
+def test_login_behind_proxy(monkeypatch):
+    #start by clearing the database
+    clear_data()
+    monkeypatch.setattr(login_throttle, 'by_user', TokenBucketLimiter(3, 1))
+    monkeypatch.setattr(login_throttle, 'by_ip', TokenBucketLimiter(10, 1))
+    #what PROXY_FIX_X_FOR = 1 sets up at import
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+
+    user = UserTable('obamna', 'soda', 'barock', passwords.hash('hunter2'), '44@gmail.com', '123-456-7890')
+    db.session.add(user)
+    db.session.commit()
+
+    with app.test_client() as client:
+        #every request comes from the balancer, the client ip is forwarded
+        balancer = '10.0.0.254'
+        for i in range(10):
+            login(client, f'spray{i}', 'wrong', ip=balancer, headers={'X-Forwarded-For': '203.0.113.7'})
+        assert login(client, 'barock', 'hunter2', ip=balancer,
+                     headers={'X-Forwarded-For': '203.0.113.7'})[1].startswith('Too many login attempts')
+
+        #so one client using up its bucket doesn't lock out everyone else
+        assert login(client, 'barock', 'hunter2', ip=balancer,
+                     headers={'X-Forwarded-For': '198.51.100.3'}) == (user.id, 'Successfully Logged In')
+
+    clear_data()
+
+
+def test_slow_hasher(monkeypatch):
+    #start by clearing the database
+    clear_data()
+    monkeypatch.setattr(login_throttle, 'by_user', TokenBucketLimiter(3, 1))
+    monkeypatch.setattr(login_throttle, 'by_ip', TokenBucketLimiter(10, 1))
+    user = UserTable('obamna', 'soda', 'barock', passwords.hash('hunter2'), '44@gmail.com', '123-456-7890')
+    db.session.add(user)
+    db.session.commit()
+
+    #the only hashing thread is stuck, so every hash waits out AUTH_HASH_TIMEOUT
+    stuck = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=1)
+    pool.submit(stuck.wait)
+    monkeypatch.setattr(passwords, '_pool', pool)
+    monkeypatch.setattr(passwords, 'timeout', 0.05)
+    try:
+        with app.test_client() as client:
+            #assert the login and password change pages answer instead of erroring
+            assert login(client, 'barock', 'hunter2') == (None, 'Too many people are logging in right now, try again in a moment')
+
+            with client.session_transaction() as sess:
+                sess['id'] = user.id
+            response = client.post('/profile/change_password', data={'currentPassword': 'hunter2', 'newPassword': 'new'})
+            assert response.status_code == 302
+            with client.session_transaction() as sess:
+                assert sess['_flashes'][-1][1] == 'Too many people are logging in right now, try again in a moment'
+    finally:
+        stuck.set()
+        pool.shutdown()
+        monkeypatch.undo()
+
+    #and the password was left as it was
+    db.session.refresh(user)
+    assert passwords.verify(user.password, 'hunter2')
+
+    clear_data()
+
+
+def test_token_buckets():
+    limiter = TokenBucketLimiter(2, 60)
+    #a burst of 2, then a wait of about a second (60 per minute)
+    assert limiter.hit('a') == 0
+    assert limiter.hit('a') == 0
+    assert 0 < limiter.hit('a') <= 1
+    #keys don't share buckets
+    assert limiter.hit('b') == 0
+
+    #the sql limiter shares one bucket between every process
+    with app.app_context():
+        shared = SqlTokenBucketLimiter(2, 60)
+        shared.reset('test:a')
+        assert shared.hit('test:a') == 0
+        assert SqlTokenBucketLimiter(2, 60).hit('test:a') == 0
+        assert shared.hit('test:a') > 0
+        shared.reset('test:a')
+
+
+def test_hasher_backlog():
+    scratch = Flask(__name__)
+    scratch.config.update(BCRYPT_LOG_ROUNDS=4, AUTH_HASH_WORKERS=1, AUTH_HASH_QUEUE_LIMIT=0, AUTH_HASH_TIMEOUT=10)
+    hasher = PasswordHasher()
+    hasher.init_app(scratch)
+
+    #hash and verify round trip on the pool
+    hashed = hasher.hash('secret')
+    assert hasher.verify(hashed, 'secret')
+    assert not hasher.verify(hashed, 'nope')
+    assert not hasher.verify(None, 'secret')
+    assert not hasher.verify('not a hash', 'secret')
+
+    #with the only worker busy and no backlog allowed, the next hash is rejected straight away
+    hasher._slots.acquire()
+    try:
+        with pytest.raises(HasherBusy):
+            hasher.hash('secret')
+    finally:
+        hasher._slots.release()
+    assert hasher.verify(hasher.hash('secret'), 'secret')
@@ -0,0 +1,29 @@
+import os
+from media_index import MediaIndex, media_index
+
+
+def test_media_index(tmp_path):
+    videos = tmp_path / 'videos'
+
+    #a missing folder is just empty
+    index = MediaIndex(str(videos))
+    assert 'a.mp4' not in index
+
+    videos.mkdir()
+    (videos / 'a.mp4').write_bytes(b'')
+    #the new folder is picked up on the next lookup
+    assert 'a.mp4' in index
+    assert index.snapshot() == frozenset({'a.mp4'})
+
+    #files the upload path adds show up straight away
+    index.add('b.mp4')
+    assert 'b.mp4' in index
+
+    #files changed behind the app's back are seen once the folder's mtime moves
+    os.remove(videos / 'a.mp4')
+    stat = os.stat(videos)
+    os.utime(videos, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert 'a.mp4' not in index
+
+    #the same folder always maps to the same shared index
+    assert media_index(str(videos)) is media_index(str(videos) + '/')
@@ -0,0 +1,63 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from app import app
+from geo import grid_cell
+from migrate import migrate
+from models import db
+
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'baseline_base.sql')
+
+SCHEMA_SQL = text("""
+    select table_name, column_name, data_type, is_nullable, column_default from information_schema.columns
+    where table_schema = 'public' order by table_name, column_name
+""")
+INDEXES_SQL = text("select tablename, indexname from pg_indexes where schemaname = 'public' order by 1, 2")
+FOREIGN_KEYS_SQL = text("""
+    select conrelid::regclass::text, confrelid::regclass::text, confdeltype from pg_constraint
+    where contype = 'f' and connamespace = 'public'::regnamespace order by 1, 2, 3
+""")
+
+
+def schema(conn) -> tuple:
+    return tuple(conn.execute(q).all() for q in (SCHEMA_SQL, INDEXES_SQL, FOREIGN_KEYS_SQL))
+
+
+def test_migrate_baseline_database():
+    #a scratch database made from the original base.sql, next to the test database
+    name = f'{db.engine.url.database}_migrate'
+    admin = create_engine(db.engine.url, isolation_level='AUTOCOMMIT')
+    with admin.connect() as conn:
+        conn.execute(text(f'drop database if exists {name}'))
+        conn.execute(text(f'create database {name}'))
+    old = create_engine(db.engine.url.set(database=name))
+    try:
+        with old.begin() as conn:
+            with open(BASELINE) as f:
+                conn.exec_driver_sql(f.read())
+            #data the old app could write, a member joined twice and a comment without a time
+            conn.execute(text("insert into user_table (id, user_name, password, email) values (1, 'a', 'x', 'a@x'), (2, 'b', 'x', 'b@x')"))
+            conn.execute(text("insert into sessions (id, host_name, title, message, date, lat, long, host_id) "
+                              "values (1, 'a', 'jam', 'hi', :date, 35.2, -80.8, 1)"), {'date': datetime.now() + timedelta(hours=1)})
+            conn.execute(text('insert into party (session_id, user_id) values (1, 1), (1, 2), (1, 2)'))
+            conn.execute(text("insert into post (id, video_id, title, ratio, date_posted, user_id) values (1, 'v', 't', 0, :date, 1)"),
+                         {'date': datetime(2023, 1, 1)})
+            conn.execute(text('insert into comment_section (id, post_id) values (1, 1)'))
+            conn.execute(text("insert into comment (comment_section_id, user_id, message) values (1, 2, 'hi'), (1, 1, 'yo')"))
+
+        #assert every migration applies and the result is the schema base.sql makes
+        assert len(migrate(old)) > 0
+        assert migrate(old) == []
+        with old.connect() as conn, db.engine.connect() as current:
+            assert schema(conn) == schema(current)
+
+            #and the counters and cells are filled in from the old rows
+            assert conn.execute(text('select user_id from party order by user_id')).scalars().all() == [1, 2]
+            assert conn.execute(text('select member_count, grid_cell from sessions')).one() == (2, grid_cell(35.2, -80.8))
+            assert conn.execute(text('select comment_count, status from post')).one() == (2, 'ready')
+            assert conn.execute(text('select count(*) from comment where post_time = :date'), {'date': datetime(2023, 1, 1)}).scalar() == 2
+    finally:
+        old.dispose()
+        with admin.connect() as conn:
+            conn.execute(text(f'drop database if exists {name}'))
+        admin.dispose()
@@ -0,0 +1,145 @@
+from app import app
+import models
+from models import UserTable, clear_data, db, JamSession, jam_sessions_in_bbox, jam_sessions_near, load_session_page
+from sweeper import sweeper
+from datetime import datetime, timedelta
+from geo import grid_cell, cell_ranges, bbox_around, distance_km
+
+
+def test_grid():
+    #every point falls in one of the ranges covering a box around it
+    for lat, lng in [(35.3, -80.7), (0, 0), (-89.99, 179.99), (51.5, -0.12)]:
+        cell = grid_cell(lat, lng)
+        assert any(first <= cell <= last for first, last in cell_ranges(*bbox_around(lat, lng, 1)))
+
+    #a box across the antimeridian covers both sides
+    ranges = cell_ranges(-1, 179.5, 1, -179.5)
+    assert any(first <= grid_cell(0, 179.9) <= last for first, last in ranges)
+    assert any(first <= grid_cell(0, -179.9) <= last for first, last in ranges)
+    assert not any(first <= grid_cell(0, 0) <= last for first, last in ranges)
+
+    #one degree of latitude is about 111km
+    assert round(distance_km(35, -80, 36, -80)) == 111
+
+
+def test_nearby_sessions():
+    #start by clearing the database
+    clear_data()
+    host = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(host)
+    db.session.commit()
+
+    soon = datetime.now() + timedelta(hours=1)
+    places = {
+        'campus': (35.3088, -80.7337),
+        'uptown': (35.2271, -80.8431),
+        'london': (51.5072, -0.1276),
+        'fiji': (-17.7, 179.9),
+        'samoa': (-17.7, -179.9),
+    }
+    for title, (lat, lng) in places.items():
+        db.session.add(JamSession(title, 'jam', soon, datetime.now(), lat, lng, host.id))
+    #an expired session right on campus
+    db.session.add(JamSession('over', 'jam', datetime.now() - timedelta(hours=1), datetime.now(), 35.3088, -80.7337, host.id))
+    db.session.commit()
+
+    #grid_cell is filled in on insert
+    assert JamSession.query.filter_by(title='london').first().grid_cell == grid_cell(51.5072, -0.1276)
+
+    #the campus viewport only has the campus session
+    assert [s.title for s in jam_sessions_in_bbox(35.30, -80.75, 35.32, -80.72, 300, 100)] == ['campus']
+
+    #a viewport over Charlotte has both Charlotte sessions
+    charlotte = jam_sessions_in_bbox(35.0, -81.0, 35.5, -80.5, 300, 100)
+    assert sorted(s.title for s in charlotte) == ['campus', 'uptown']
+
+    #a viewport across the date line gets both sides of it
+    pacific = jam_sessions_in_bbox(-18, 179, -17, -179, 300, 100)
+    assert sorted(s.title for s in pacific) == ['fiji', 'samoa']
+
+    #center and radius come back closest first
+    assert [s.title for s in jam_sessions_near(35.3088, -80.7337, 20, 300, 100)] == ['campus', 'uptown']
+    assert [s.title for s in jam_sessions_near(35.3088, -80.7337, 5, 300, 100)] == ['campus']
+
+    #the endpoint takes either form
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = host.id
+        response = client.get('/sessions/nearby?south=51&west=-1&north=52&east=1')
+        assert [s['title'] for s in response.get_json()['sessions']] == ['london']
+        response = client.get('/sessions/nearby?lat=35.2271&lng=-80.8431&radius=2')
+        assert [s['title'] for s in response.get_json()['sessions']] == ['uptown']
+        assert client.get('/sessions/nearby?south=a').status_code == 400
+
+        #numbers that aren't on the map are turned away or pulled back onto it, never a 500
+        assert client.get('/sessions/nearby?south=-inf&west=-1&north=52&east=1').status_code == 400
+        assert client.get('/sessions/nearby?south=51&west=nan&north=52&east=1').status_code == 400
+        assert client.get('/sessions/nearby?lat=35.2271&lng=inf&radius=2').status_code == 400
+        assert client.get('/sessions/nearby?lat=35.2271&lng=-80.8431&radius=inf').status_code == 400
+        response = client.get('/sessions/nearby?south=51&west=-1e12&north=1e12&east=1')
+        assert [s['title'] for s in response.get_json()['sessions']] == ['london']
+
+    clear_data()
+
+
+def test_nearest_in_a_dense_area(monkeypatch):
+    #start by clearing the database
+    clear_data()
+    host = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(host)
+    db.session.commit()
+
+    #plenty of sessions a few km out starting soon, the closest one starts last
+    for i in range(10):
+        db.session.add(JamSession(f'around {i}', 'jam', datetime.now() + timedelta(hours=1, minutes=i), datetime.now(),
+                                  35.3088 + 0.02 + i * 0.001, -80.7337, host.id))
+    db.session.add(JamSession('closest', 'jam', datetime.now() + timedelta(days=2), datetime.now(), 35.3089, -80.7337, host.id))
+    db.session.commit()
+
+    #assert the limit is applied after sorting by distance, not by date
+    assert [s.title for s in jam_sessions_near(35.3088, -80.7337, 20, 300, 2)] == ['closest', 'around 0']
+
+    #databases without the trig functions (SQLite) sort the grid candidates in python, same answer
+    monkeypatch.setattr(models, '_sql_distance', lambda: False)
+    assert [s.title for s in jam_sessions_near(35.3088, -80.7337, 20, 300, 2)] == ['closest', 'around 0']
+    assert [s.title for s in jam_sessions_near(35.3088, -80.7337, 0.5, 300, 2)] == ['closest']
+
+    clear_data()
+
+
+def test_session_list_pages(monkeypatch):
+    #start by clearing the database
+    clear_data()
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    monkeypatch.setitem(app.config, 'SESSIONS_PAGE_SIZE', 2)
+    host = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(host)
+    db.session.commit()
+    soon = datetime.now() + timedelta(hours=1)
+    for i in range(5):
+        db.session.add(JamSession(f'sesh {i}', 'jam', soon + timedelta(minutes=i // 2), datetime.now(), 10.0, 10.0, host.id))
+    db.session.commit()
+
+    #assert the pages walk every session soonest first, ties broken by id
+    titles, cursor = [], None
+    while True:
+        page, cursor = load_session_page(300, cursor, 2)
+        titles += [s.title for s in page]
+        if not cursor:
+            break
+    assert titles == [f'sesh {i}' for i in range(5)]
+
+    #the list page only shows one page and links the next
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = host.id
+        response = client.get('/sessions/')
+        assert b'sesh 1' in response.data and b'sesh 2' not in response.data
+        assert b'Later sessions' in response.data
+        _, cursor = load_session_page(300, None, 2)
+        response = client.get(f'/sessions/?cursor={cursor}')
+        assert b'sesh 2' in response.data and b'sesh 1' not in response.data
+        assert client.get('/sessions/?cursor=nonsense').status_code == 400
+
+    clear_data()
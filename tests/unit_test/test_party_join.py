@@ -0,0 +1,84 @@
+from app import app
+from models import UserTable, clear_data, db, JamSession, Party, join_jam_session, leave_jam_session, rebuild_member_counts
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+
+def make_session(guest_count):
+    host = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    guests = [UserTable('guest', str(i), f'guest{i}', '123', f'{i}@gmail.com', '123') for i in range(guest_count)]
+    db.session.add_all([host] + guests)
+    db.session.commit()
+    sesh = JamSession('sesh', 'come on down', datetime.now() + timedelta(hours=1), datetime.now(), 10.0, 10.0, host.id)
+    db.session.add(sesh)
+    db.session.commit()
+    #the host joins through the ORM, the event keeps member_count in step
+    db.session.add(Party(sesh.id, host.id))
+    db.session.commit()
+    db.session.refresh(sesh)
+    assert sesh.member_count == 1
+    return host, guests, sesh
+
+
+def test_join_leave_kick():
+    #start by clearing the database
+    clear_data()
+    host, guests, sesh = make_session(2)
+
+    #joining returns the host's user name for the flash message
+    assert join_jam_session(sesh.id, guests[0].id) == (True, 'The Barock')
+    #joining twice is a no-op
+    assert join_jam_session(sesh.id, guests[0].id) == (False, 'The Barock')
+    assert Party.query.filter_by(session_id=sesh.id).count() == 2
+    assert join_jam_session(-1, guests[0].id) is None
+
+    #only the host can kick
+    assert not leave_jam_session(sesh.id, guests[0].id, host_id=guests[1].id)
+    assert leave_jam_session(sesh.id, guests[0].id, host_id=host.id)
+    assert not leave_jam_session(sesh.id, guests[0].id)
+
+    #routes go through the same statements
+    with app.test_client() as client:
+        with client.session_transaction() as s:
+            s['id'] = guests[1].id
+        client.post(f'/sessions/{sesh.id}/join')
+        client.post(f'/sessions/{sesh.id}/join')
+        with client.session_transaction() as s:
+            assert s['_flashes'][-1][1] == 'You are already in this session!'
+        db.session.refresh(sesh)
+        assert sesh.member_count == 2
+        client.post(f'/sessions/{sesh.id}/leave')
+        assert client.post('/sessions/-1/join').status_code == 404
+
+    db.session.refresh(sesh)
+    assert sesh.member_count == 1
+    assert rebuild_member_counts() == 0
+
+    clear_data()
+
+
+def test_concurrent_joins():
+    clear_data()
+    host, guests, sesh = make_session(20)
+    session_id = sesh.id
+
+    def join(user_id):
+        with app.app_context():
+            return join_jam_session(session_id, user_id)[0]
+
+    #everyone joins at once and every click is counted once
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(join, [g.id for g in guests] * 2))
+    assert sum(results) == 20
+    db.session.refresh(sesh)
+    assert sesh.member_count == 21
+    assert Party.query.filter_by(session_id=session_id).count() == 21
+
+    #a count that drifted is repaired by the rebuild
+    JamSession.query.filter_by(id=session_id).update({'member_count': 0})
+    db.session.commit()
+    assert rebuild_member_counts() == 1
+    db.session.refresh(sesh)
+    assert sesh.member_count == 21
+
+    clear_data()
@@ -0,0 +1,69 @@
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, CommentSection, Comment, JamSession, Party, join_jam_session
+from feed import load_feed_page, load_comment_page
+from roster import load_roster
+from migrate import migrate, available_migrations
+from sweeper import sweeper
+from tests.query_plans import captured_statements, seq_scans
+from datetime import datetime, timedelta
+
+
+def seed():
+    users = [UserTable('user', str(i), f'user{i}', '123', f'{i}@gmail.com', '123') for i in range(5)]
+    db.session.add_all(users)
+    db.session.commit()
+    for n in range(20):
+        p = Post(f'video{n}', f'Post {n}', 'desc', 0, datetime.now() - timedelta(minutes=n), users[n % 5].id)
+        db.session.add(p)
+        db.session.commit()
+        cs = CommentSection(p.id)
+        db.session.add(cs)
+        db.session.commit()
+        db.session.add_all([Comment(cs.id, users[i].id, f'comment {i}') for i in range(3)])
+    sesh = JamSession('sesh', 'come jam', datetime.now() + timedelta(hours=1), datetime.now(), 10.0, 10.0, users[0].id)
+    db.session.add(sesh)
+    db.session.commit()
+    db.session.add_all([Party(sesh.id, u.id) for u in users])
+    db.session.commit()
+    return users, sesh
+
+
+def test_hot_queries_use_indexes(monkeypatch):
+    #start with clearing the database
+    clear_data()
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+
+    #base.sql already has every migration, running them again changes nothing
+    assert migrate() == []
+    assert '001_hot_path_indexes' in available_migrations()
+
+    users, sesh = seed()
+    post = Post.query.order_by(Post.id).first()
+
+    #the hot lookups, called directly
+    with captured_statements() as statements:
+        cards, cursor = load_feed_page(limit=5)
+        load_feed_page(cursor, limit=5)
+        load_comment_page(post.id, limit=2)
+        load_roster(sesh.id)
+        join_jam_session(sesh.id, users[1].id)
+    assert seq_scans(statements) == {}
+
+    #and through the pages, so queries added to the views are covered too
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = users[0].id
+        with captured_statements() as statements:
+            assert client.get('/').status_code == 200
+            assert client.get(f'/{post.id}').status_code == 200
+            assert client.get(f'/profile/{users[1].id}').status_code == 200
+            assert client.get(f'/sessions/{sesh.id}').status_code == 200
+            client.post('/signup', data={'email': 'a@b.c', 'username': 'USER1', 'password': 'x'})
+    assert seq_scans(statements) == {}
+
+    #assert the case-insensitive name check turned the sign up away
+    assert UserTable.query.filter_by(user_name='USER1').first() is None
+
+    clear_data()
@@ -0,0 +1,102 @@
+import json
+import logging
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, CommentSection, Comment, JamSession, user_displays
+from query_stats import assert_max_queries, recording, QueryStats
+from sweeper import sweeper
+from sqlalchemy import text
+from datetime import datetime, timedelta
+
+
+def test_query_stats(monkeypatch):
+    #start with clearing the database
+    clear_data()
+
+    #assert every statement in the block is counted
+    with recording() as stats:
+        for _ in range(3):
+            db.session.execute(text('SELECT 1')).scalar()
+    assert stats.count == 3
+    assert stats.repeated(3) == [(3, 'SELECT 1')]
+    assert stats.repeated(4) == []
+
+    #assert the fence passes under the limit and names the statements over it
+    with assert_max_queries(2):
+        db.session.execute(text('SELECT 1')).scalar()
+    with pytest.raises(AssertionError, match='SELECT 2'):
+        with assert_max_queries(1):
+            db.session.execute(text('SELECT 1')).scalar()
+            db.session.execute(text('SELECT 2')).scalar()
+
+    #only the slowest few are kept
+    stats = QueryStats(keep_slowest=2)
+    for seconds in [0.1, 0.3, 0.2]:
+        stats.add(f'q{seconds}', seconds)
+    assert stats.slowest == [(0.3, 'q0.3'), (0.2, 'q0.2')]
+
+    #clearing the database at the end
+    clear_data()
+
+
+def test_request_stats(monkeypatch, caplog):
+    #start with clearing the database
+    clear_data()
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+
+    newuser1 = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    newuser2 = UserTable('Crazy', 'guy', 'Crazy guy', '123', 'ex@gmail.com', '123-456-1230')
+    db.session.add_all([newuser1, newuser2])
+    db.session.commit()
+    for i in range(12):
+        p = Post(f'fake_id{i}', f'Post {i}', 'example descriptions', 0, datetime.now(), newuser1.id)
+        db.session.add(p)
+        db.session.commit()
+        cs = CommentSection(p.id)
+        db.session.add(cs)
+        db.session.commit()
+        db.session.add(Comment(cs.id, newuser2.id, 'Cool'))
+        db.session.commit()
+    sesh = JamSession('sesh', 'come jam', datetime.now() + timedelta(hours=1), datetime.now(), 10.0, 10.0, newuser1.id)
+    db.session.add(sesh)
+    db.session.commit()
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = newuser2.id
+
+        #assert dev responses carry the database time and query count
+        response = client.get('/')
+        assert response.status_code == 200
+        assert 'db;dur=' in response.headers['Server-Timing']
+        assert 'queries"' in response.headers['Server-Timing']
+
+        #assert the main pages stay within a fixed number of queries however many posts there are
+        for url in ['/', f'/profile/{newuser1.id}', '/sessions/']:
+            user_displays.clear()
+            with assert_max_queries(6):
+                assert client.get(url).status_code == 200
+
+        #assert the same statement run over and over is called out
+        monkeypatch.setitem(app.config, 'SQL_REPEAT_THRESHOLD', 1)
+        with caplog.at_level(logging.WARNING, logger='riffroom.sql'):
+            response = client.get('/sessions/')
+        assert 'db-repeated' in response.headers['Server-Timing']
+        assert any('/sessions/ ran' in r.getMessage() for r in caplog.records)
+        caplog.clear()
+
+        #assert prod logs one json line per request instead of the header
+        monkeypatch.setitem(app.config, 'SQL_REPEAT_THRESHOLD', 5)
+        monkeypatch.setitem(app.config, 'FLASK_ENV', 'prod')
+        with caplog.at_level(logging.INFO, logger='riffroom.sql'):
+            response = client.get(f'/profile/{newuser1.id}')
+        assert 'Server-Timing' not in response.headers
+        lines = [json.loads(r.getMessage()) for r in caplog.records if r.name == 'riffroom.sql']
+        assert len(lines) == 1
+        assert lines[0]['path'] == f'/profile/{newuser1.id}'
+        assert lines[0]['status'] == 200
+        assert lines[0]['queries'] > 0
+
+    #clearing the database at the end
+    clear_data()
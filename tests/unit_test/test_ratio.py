@@ -0,0 +1,58 @@
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, ratio_table, count_likes, rebuild_ratios
+from datetime import datetime
+
+
+def test_ratio_counter():
+    #start with clearing the database
+    clear_data()
+
+    #create a poster and two voters
+    poster = UserTable('obamna', 'soda',
+                        'The Barock', '123',
+                        '44@gmail.com',
+                        '123-456-7890')
+    voter1 = UserTable('Crazy', 'guy',
+                        'Crazy guy', '123',
+                        'ex@gmail.com',
+                        '123-456-1230')
+    voter2 = UserTable('Calm', 'guy',
+                        'Calm guy', '123',
+                        'calm@gmail.com',
+                        '123-456-1231')
+    db.session.add_all([poster, voter1, voter2])
+    db.session.commit()
+
+    p = Post('fake_id', 'Example Post', 'example descriptions', 0, datetime.now(), poster.id)
+    db.session.add(p)
+    db.session.commit()
+
+    #both voters like the post, the counter follows the inserts
+    db.session.add(ratio_table(p.id, voter1.id, 1))
+    db.session.add(ratio_table(p.id, voter2.id, 1))
+    db.session.commit()
+    assert p.ratio == 2
+    assert count_likes(p.id) == 2
+
+    #voter1 flips to a dislike the way the vote form does, with the string value
+    vote = ratio_table.query.filter_by(post_id=p.id, user_id=voter1.id).first()
+    vote.value = '0'
+    db.session.commit()
+    assert p.ratio == 0
+
+    #voter2 takes their like back
+    db.session.delete(ratio_table.query.filter_by(post_id=p.id, user_id=voter2.id).first())
+    db.session.commit()
+    assert p.ratio == -1
+
+    #a counter that drifted is put back by the rebuild
+    p.ratio = 40
+    db.session.commit()
+    assert rebuild_ratios() == 1
+    db.session.refresh(p)
+    assert p.ratio == -1
+    #nothing left to fix on a second run
+    assert rebuild_ratios() == 0
+
+    clear_data()
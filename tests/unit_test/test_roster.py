@@ -0,0 +1,78 @@
+from app import app
+from models import UserTable, clear_data, db, JamSession, Party, user_displays
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from aws_clients import aws
+from roster import load_roster, build_session_cards
+
+
+def count_queries(fn):
+    statements = []
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+    return result, len(statements)
+
+
+def test_roster(monkeypatch):
+    #start by clearing the database
+    clear_data()
+
+    host = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(host)
+    guests = [UserTable('guest', str(i), f'guest{i}', '123', f'{i}@gmail.com', '123') for i in range(10)]
+    db.session.add_all(guests)
+    db.session.commit()
+
+    #host_name is still first + last name
+    sesh = JamSession('big sesh', 'everyone', datetime.now() + timedelta(hours=1), datetime.now(), 10.0, 10.0, host.id)
+    small = JamSession('small sesh', 'just me', datetime.now() + timedelta(hours=2), datetime.now(), 10.0, 10.0, host.id)
+    db.session.add_all([sesh, small])
+    db.session.commit()
+    assert sesh.host_name == 'obamna soda'
+
+    db.session.add(Party(sesh.id, host.id))
+    db.session.add_all([Party(sesh.id, g.id) for g in guests])
+    db.session.add(Party(small.id, host.id))
+    db.session.commit()
+    sesh_id, guest_ids = sesh.id, [g.id for g in guests]
+    db.session.expire_all()
+
+    #the whole roster is two queries however big the party is
+    roster, queries = count_queries(lambda: load_roster(sesh_id))
+    assert queries == 2
+    assert roster.host_user_name == 'The Barock'
+    assert roster.member_count == 11
+    #members come back in join order, host first
+    assert [m.user_name for m in roster.members] == ['The Barock'] + [f'guest{i}' for i in range(10)]
+    assert roster.is_member(guest_ids[3])
+    assert load_roster(-1) is None
+
+    #the list view gets host names and party counts for every session in two queries
+    #(one, once the host's name is in the process-wide user cache)
+    user_displays.clear()
+    jam_sessions = JamSession.query.order_by(JamSession.date).all()
+    cards, queries = count_queries(lambda: build_session_cards(jam_sessions, guest_ids[0]))
+    assert queries == 2
+    assert [(c.title, c.host_user_name, c.member_count, c.joined) for c in cards] == \
+        [('big sesh', 'The Barock', 11, True), ('small sesh', 'The Barock', 1, False)]
+
+    #both pages render from the view objects
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    aws.reset()
+    with app.test_client() as client:
+        with client.session_transaction() as s:
+            s['id'] = guest_ids[0]
+        page = client.get(f'/sessions/{sesh_id}')
+        assert page.status_code == 200
+        assert b'guest9' in page.data and b'Leave' in page.data
+        page = client.get('/sessions/')
+        assert b'11 in party' in page.data
+        assert client.get('/sessions/-1').status_code == 404
+
+    clear_data()
+    aws.reset()
@@ -0,0 +1,44 @@
+import json
+from app import app
+from models import UserTable, clear_data, db
+from benchmarks.routes import main, percentile, ROUTES
+
+
+def test_route_benchmark(tmp_path):
+    #start with clearing the database
+    clear_data()
+    flask_env = app.config['FLASK_ENV']
+
+    #nearest rank percentiles
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+    assert percentile([7], 95) == 7
+
+    #assert it won't wipe a database that has users unless told to
+    db.session.add(UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890'))
+    db.session.commit()
+    try:
+        main(['--users', '3', '--posts', '5', '--requests', '2', '--concurrency', '1'])
+        assert False, 'expected the benchmark to refuse'
+    except SystemExit:
+        pass
+    assert UserTable.query.count() == 1
+
+    #assert a small run covers every route without errors and writes the results
+    results_file = tmp_path / 'results.json'
+    results = main(['--wipe', '--users', '5', '--posts', '12', '--comments', '2', '--sessions', '3',
+                    '--video-kb', '4', '--requests', '6', '--warmup', '1', '--concurrency', '2',
+                    '--json', str(results_file)])
+    assert set(results['routes']) == set(ROUTES)
+    for name, route in results['routes'].items():
+        assert route['requests'] == 6, name
+        assert route['errors'] == 0, (name, route['error_statuses'])
+        assert route['p50_ms'] <= route['p95_ms'] <= route['p99_ms'] <= route['max_ms']
+    assert json.loads(results_file.read_text())['settings']['posts'] == 12
+
+    #the app is left the way it was and the seeded data is gone
+    assert app.config['FLASK_ENV'] == flask_env
+    assert UserTable.query.count() == 0
+
+    #clearing the database at the end
+    clear_data()
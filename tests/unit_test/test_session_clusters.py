@@ -0,0 +1,116 @@
+import time
+from app import app
+from models import UserTable, clear_data, db, JamSession
+from datetime import datetime, timedelta
+import clusters as clusters_module
+from clusters import cluster_cache, count_tiles, tiles_in_bbox, tile_of
+
+
+def test_tiles():
+    #the whole world at zoom 0 is one tile, zoom 2 is 4 x 2
+    assert tiles_in_bbox(-90, -180, 90, 180, 0) == [(0, 0)]
+    assert len(tiles_in_bbox(-90, -180, 90, 180, 2)) == 8
+
+    #a box across the antimeridian takes the tiles on both edges
+    assert tiles_in_bbox(-1, 170, 1, -170, 3) == [(7, 1), (0, 1), (7, 2), (0, 2)]
+    assert tile_of(35.3, -80.7, 3) in tiles_in_bbox(35, -81, 36, -80, 3)
+
+    #the count matches the list without building it
+    for box in [(-90, -180, 90, 180, 2), (-1, 170, 1, -170, 3), (35, -81, 36, -80, 9)]:
+        assert count_tiles(*box) == len(tiles_in_bbox(*box))
+    assert count_tiles(-90, -180, 90, 180, 13) == 8192 * 4096
+
+    #the edges of the map belong to the last tiles, the ones a viewport there is served from
+    assert tile_of(90, 180, 2) == (3, 1)
+    assert tile_of(0, 180, 3) in tiles_in_bbox(-1, 170, 1, 180, 3)
+
+
+def test_session_clusters(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'CLUSTER_CACHE_PATH', str(tmp_path / 'clusters.sqlite3'))
+    #start by clearing the database
+    clear_data()
+    host = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(host)
+    db.session.commit()
+
+    soon = datetime.now() + timedelta(hours=1)
+    for lat, lng in [(35.3088, -80.7337), (35.3090, -80.7340), (35.2271, -80.8431)]:
+        db.session.add(JamSession('charlotte', 'jam', soon, datetime.now(), lat, lng, host.id))
+    db.session.add(JamSession('london', 'jam', soon, datetime.now(), 51.5072, -0.1276, host.id))
+    db.session.commit()
+    london = JamSession.query.filter_by(title='london').first()
+
+    def clusters(zoom=2, bbox='south=-80&west=-180&north=80&east=180'):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['id'] = host.id
+            response = client.get(f'/sessions/clusters?zoom={zoom}&{bbox}')
+        return sorted((c['count'], c.get('id')) for c in response.get_json()['clusters'])
+
+    def client_status(zoom, bbox='south=-80&west=-180&north=80&east=180'):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['id'] = host.id
+            return client.get(f'/sessions/clusters?zoom={zoom}&{bbox}').status_code
+
+    #charlotte is one cluster of 3, london a single session that links to its page
+    assert clusters() == [(1, london.id), (3, None)]
+    #further in, uptown and campus split apart
+    assert sorted(c for c, _ in clusters(12, 'south=35.2&west=-80.9&north=35.35&east=-80.7')) == [1, 2]
+    #the whole world at street level is too many tiles
+    assert client_status(9) == 400
+    assert client_status(13) == 400
+    #and boxes off the map or not made of numbers are turned away before any tiles are worked out
+    assert client_status(2, 'south=-1e12&west=-180&north=80&east=180') == 400
+    assert client_status(2, 'south=-80&west=-1e12&north=80&east=180') == 400
+    assert client_status(2, 'south=nan&west=-180&north=80&east=180') == 400
+    assert client_status(2, 'south=-80&west=-180&north=80&east=inf') == 400
+
+    #tiles are cached, a session added behind the cache's back isn't seen
+    db.session.add(JamSession('sneaky', 'jam', soon, datetime.now(), 35.31, -80.73, host.id))
+    db.session.commit()
+    assert clusters() == [(1, london.id), (3, None)]
+
+    #creating a session through the app drops the tiles under it
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = host.id
+        client.post('/sessions/', json={'title': 'new', 'message': 'jam', 'lat': 35.3, 'lng': -80.7, 'date': soon.isoformat()})
+    assert clusters() == [(1, london.id), (5, None)]
+
+    #a tile rebuilds itself once its first session expires, no invalidation needed
+    ttl = app.config['JAM_SESSION_TTL']
+    db.session.add(JamSession('ending', 'jam', datetime.now() - timedelta(seconds=ttl - 1), datetime.now(), -33.86, 151.2, host.id))
+    db.session.commit()
+    cluster_cache().invalidate_point(-33.86, 151.2)
+    assert (1, JamSession.query.filter_by(title='ending').first().id) in clusters()
+    time.sleep(1.1)
+    assert clusters() == [(1, london.id), (5, None)]
+
+    #a build that read the database before a change committed doesn't store its stale tile
+    real_build = clusters_module.build_tile
+    builds = []
+    def racing_build(zoom, x, y, ttl):
+        built = real_build(zoom, x, y, ttl)
+        builds.append((zoom, x, y))
+        if len(builds) == 1:
+            db.session.add(JamSession('racer', 'jam', soon, datetime.now(), 51.51, -0.12, host.id))
+            db.session.commit()
+            cluster_cache().invalidate_point(51.51, -0.12)
+        return built
+    monkeypatch.setattr(clusters_module, 'build_tile', racing_build)
+    cluster_cache().invalidate_point(51.51, -0.12)
+    london_box = 'south=51.4&west=-0.6&north=51.9&east=-0.05'
+    assert clusters(9, london_box) == [(1, london.id)]
+    #the next request builds it again and sees the new session
+    assert clusters(9, london_box) == [(2, None)]
+    assert len(builds) == 2
+    #and then it is cached
+    assert clusters(9, london_box) == [(2, None)]
+    assert len(builds) == 2
+    monkeypatch.setattr(clusters_module, 'build_tile', real_build)
+
+    #prune only forgets tiles older than the max age
+    assert cluster_cache().prune(60) == 0
+
+    clear_data()
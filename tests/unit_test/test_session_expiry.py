@@ -0,0 +1,52 @@
+from app import app
+from models import UserTable, clear_data, db, JamSession, Party, active_jam_sessions, expire_jam_sessions
+from datetime import datetime, timedelta
+from sweeper import sweeper
+from aws_clients import aws
+
+
+def test_session_expiry(monkeypatch):
+    #start by clearing the database
+    clear_data()
+
+    host = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    guest = UserTable('Crazy', 'guy', 'Crazy guy', '123', 'ex@gmail.com', '123-456-1230')
+    db.session.add_all([host, guest])
+    db.session.commit()
+
+    #one session started an hour ago, one starts in an hour
+    old = JamSession('old sesh', 'over', datetime.now() - timedelta(hours=1), datetime.now(), 10.0, 10.0, host.id)
+    new = JamSession('new sesh', 'soon', datetime.now() + timedelta(hours=1), datetime.now(), 10.0, 10.0, host.id)
+    db.session.add_all([old, new])
+    db.session.commit()
+    db.session.add_all([Party(old.id, host.id), Party(old.id, guest.id), Party(new.id, host.id)])
+    db.session.commit()
+    old_id, new_id = old.id, new.id
+
+    #the read path hides the expired session before anything is deleted
+    assert [s.id for s in active_jam_sessions(300)] == [new_id]
+    assert JamSession.query.count() == 2
+
+    #a page view doesn't write anything (the sweeper thread is kept out of this test)
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    aws.reset()
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = host.id
+        response = client.get('/sessions/')
+    assert response.status_code == 200
+    assert b'new sesh' in response.data and b'old sesh' not in response.data
+    assert JamSession.query.count() == 2
+
+    #one delete removes the expired session and its party rows go with it
+    assert expire_jam_sessions(300) == 1
+    assert [s.id for s in JamSession.query.all()] == [new_id]
+    assert Party.query.filter_by(session_id=old_id).count() == 0
+    assert Party.query.filter_by(session_id=new_id).count() == 1
+
+    #nothing left to expire, the sweeper's task is a no-op now
+    assert sweeper.run_once()['expire_sessions'] == 0
+
+    clear_data()
+    aws.reset()
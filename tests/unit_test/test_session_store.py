@@ -0,0 +1,105 @@
+import pytest
+from app import app
+from auth import passwords, login_throttle, TokenBucketLimiter
+from models import UserTable, clear_data, db, WebSession
+from datetime import timedelta
+from flask.sessions import SecureCookieSessionInterface
+from session_store import SqlSessionInterface, expire_web_sessions, utcnow
+
+
+def test_sql_sessions(monkeypatch):
+    #start by clearing the database
+    clear_data()
+    monkeypatch.setattr(app, 'session_interface', SqlSessionInterface())
+
+    with app.test_client() as client:
+        #pages that don't touch the session don't create one
+        client.get('/upload/')
+        assert WebSession.query.count() == 0
+
+        #logging in writes one row, the cookie only holds its id
+        with client.session_transaction() as sess:
+            sess['id'] = 1
+        row = WebSession.query.one()
+        assert client.get_cookie(app.config['SESSION_COOKIE_NAME']).value == row.id
+        assert client.get('/upload/').status_code == 200
+
+        #reading the session doesn't write it again
+        expires = row.expires
+        client.get('/upload/')
+        db.session.expire_all()
+        assert WebSession.query.one().expires == expires
+
+        #until it gets close to expiring
+        WebSession.query.update({'expires': utcnow() + timedelta(minutes=1)})
+        db.session.commit()
+        client.get('/upload/')
+        db.session.expire_all()
+        assert WebSession.query.one().expires > utcnow() + timedelta(minutes=20)
+
+        #an expired row is a logged out user, and gets garbage collected
+        WebSession.query.update({'expires': utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+        assert client.get('/upload/').status_code == 302
+        assert expire_web_sessions() == 1
+
+        #logging out deletes the row
+        with client.session_transaction() as sess:
+            sess['id'] = 1
+        assert WebSession.query.count() == 1
+        client.post('/logout')
+        assert WebSession.query.count() == 0
+
+    clear_data()
+
+
+def test_cookie_sessions(monkeypatch):
+    monkeypatch.setattr(app, 'session_interface', SecureCookieSessionInterface())
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = 1
+        #the whole session is in the signed cookie
+        assert client.get('/upload/').status_code == 200
+        assert WebSession.query.count() == 0
+
+        #a tampered cookie is no session at all
+        cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+        client.set_cookie(app.config['SESSION_COOKIE_NAME'], cookie.value[:-2] + 'xx')
+        assert client.get('/upload/').status_code == 302
+
+
+@pytest.mark.parametrize('interface', [SqlSessionInterface(), app.session_interface])
+def test_login_renews_session_id(monkeypatch, interface):
+    #start by clearing the database
+    clear_data()
+    monkeypatch.setattr(app, 'session_interface', interface)
+    monkeypatch.setattr(login_throttle, 'by_user', TokenBucketLimiter(3, 1))
+    monkeypatch.setattr(login_throttle, 'by_ip', TokenBucketLimiter(10, 1))
+    user = UserTable('obamna', 'soda', 'barock', passwords.hash('hunter2'), '44@gmail.com', '123-456-7890')
+    db.session.add(user)
+    db.session.commit()
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+
+    with app.test_client() as client:
+        #a session from before the login, e.g. one an attacker planted in the victim's browser
+        with client.session_transaction() as sess:
+            sess['seen_login'] = True
+        planted = client.get_cookie(cookie_name).value
+
+        client.post('/login', data={'username': 'barock', 'password': 'hunter2'})
+        with client.session_transaction() as sess:
+            assert sess['id'] == user.id
+            assert sess['seen_login']
+
+        #assert the logged in session lives under a new id and the old one is gone
+        assert client.get_cookie(cookie_name).value != planted
+        if isinstance(interface, SqlSessionInterface):
+            assert [row.id for row in WebSession.query.all()] == [client.get_cookie(cookie_name).value]
+
+    #assert the planted id doesn't reach the logged in session
+    with app.test_client() as attacker:
+        attacker.set_cookie(cookie_name, planted)
+        assert attacker.get('/upload/').status_code == 302
+
+    clear_data()
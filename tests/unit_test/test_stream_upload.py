@@ -0,0 +1,157 @@
+import io
+import pytest
+from botocore.exceptions import ClientError
+from app import app
+from aws_clients import aws
+import bucket_wrapper
+from bucket_wrapper import BucketWrapper, part_size_for
+from models import UserTable, clear_data, db, Post, CommentSection
+from tests.aws_stubs import FakeS3, FakeBucket, FakeTranscoder
+from jobs import work_once
+
+
+class TrickleStream(io.BytesIO):
+    """ hands out at most 3 bytes per read, like a socket would """
+    def read(self, size=-1):
+        return super().read(min(size, 3) if size and size > 0 else 3)
+
+
+def test_upload_stream_parts():
+    s3 = FakeS3()
+    wrapper = BucketWrapper(FakeBucket('uploads', s3))
+    data = bytes(range(23))
+
+    #the body goes up in full sized parts with a short last one
+    assert wrapper.upload_stream(s3, TrickleStream(data), 'vid.mp4', part_size=5)
+    assert s3.part_sizes == [5, 5, 5, 5, 3]
+    assert s3.objects[('uploads', 'vid.mp4')] == data
+
+    #an empty file is still a valid upload
+    assert wrapper.upload_stream(s3, io.BytesIO(b''), 'empty.mp4', part_size=5)
+    assert s3.objects[('uploads', 'empty.mp4')] == b''
+
+
+def test_part_size_for():
+    #assert the configured size is kept until the upload would need more than 10,000 parts
+    assert part_size_for(10, 5) == 5
+    assert part_size_for(1_048_576 * 1_048_576, 8 * 1_048_576) == 109_951_163
+    assert part_size_for(1_048_576 * 1_048_576, 8 * 1_048_576) * 10_000 >= 1_048_576 * 1_048_576
+
+
+def test_upload_stream_aborts_on_error():
+    class FailingS3(FakeS3):
+        def upload_part(self, **kwargs):
+            if kwargs['PartNumber'] == 2:
+                raise ClientError({'Error': {'Code': 'InternalError'}}, 'UploadPart')
+            return super().upload_part(**kwargs)
+
+    s3 = FailingS3()
+    wrapper = BucketWrapper(FakeBucket('uploads', s3))
+    assert not wrapper.upload_stream(s3, io.BytesIO(b'x' * 12), 'vid.mp4', part_size=5)
+    assert s3.aborted == ['vid.mp4']
+    assert s3.uploads == {}
+
+    #an upload that can't even be started (no permission, no bucket) fails the same way
+    class DeniedS3(FakeS3):
+        def create_multipart_upload(self, **kwargs):
+            raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'CreateMultipartUpload')
+
+    s3 = DeniedS3()
+    assert not BucketWrapper(FakeBucket('uploads', s3)).upload_stream(s3, io.BytesIO(b'x' * 12), 'vid.mp4', part_size=5)
+    assert s3.aborted == []
+
+
+def test_stream_endpoint(monkeypatch, tmp_path):
+    clear_data()
+    user = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(user)
+    db.session.commit()
+
+    s3 = FakeS3()
+    transcoder = FakeTranscoder()
+    monkeypatch.setitem(app.config, 'FLASK_ENV', 'prod')
+    monkeypatch.setitem(app.config, 'UPLOAD_PART_SIZE', 1024)
+    monkeypatch.setitem(app.config, 'TRANSCODE_POLL_INTERVAL', 0)
+    #the jobs are run by hand below, not by a job thread an earlier test started
+    monkeypatch.setitem(app.config, 'JOBS_IN_WEB_PROCESS', False)
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+    monkeypatch.setattr(aws, '_objects', {
+        's3': s3,
+        'elastictranscoder': transcoder,
+        f'bucket:{app.config["UPLOAD_BUCKET_NAME"]}': BucketWrapper(FakeBucket(app.config['UPLOAD_BUCKET_NAME'], s3)),
+    })
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['id'] = user.id
+
+    #unknown extensions are turned away before anything is stored
+    response = client.post('/upload/stream?filename=evil.exe', data=b'x')
+    assert response.status_code == 400
+
+    body = b'\x00video' * 1000
+    response = client.post('/upload/stream?filename=my%20clip.mp4&title=Clip&description=desc', data=body,
+                           content_type='video/mp4')
+    assert response.status_code == 201
+    upload = response.get_json()
+
+    #the body landed in the upload bucket under the post's key, in bounded parts
+    assert s3.objects[(app.config['UPLOAD_BUCKET_NAME'], f'{upload["video_id"]}.mp4')] == body
+    assert max(s3.part_sizes) == 1024
+
+    #and the post was saved with its comment section, waiting on the transcode
+    post = Post.query.get(upload['post_id'])
+    assert post.title == 'Clip'
+    assert post.status == 'processing'
+    assert CommentSection.query.filter_by(post_id=post.id).first() is not None
+    assert transcoder.jobs == []
+
+    #a worker picks the upload up and starts the transcode
+    assert work_once()
+    assert transcoder.jobs[0]['Input']['Key'] == f'{upload["video_id"]}.mp4'
+
+    #the post is ready once the transcoder reports it finished
+    assert work_once()
+    assert Post.query.get(upload['post_id']).status == 'processing'
+    transcoder.statuses['1'] = 'Complete'
+    assert work_once()
+    assert Post.query.get(upload['post_id']).status == 'ready'
+    assert not work_once()
+
+    #a body too big for the part limit at that size gets bigger parts
+    monkeypatch.setattr(bucket_wrapper, 'MAX_PARTS', 2)
+    sent = len(s3.part_sizes)
+    response = client.post('/upload/stream?filename=big.mp4&title=Big', data=body, content_type='video/mp4')
+    assert response.status_code == 201
+    assert s3.part_sizes[sent:] == [len(body) // 2, len(body) // 2]
+
+    clear_data()
+
+
+def test_dev_audio_upload(monkeypatch, tmp_path):
+    clear_data()
+    user = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(user)
+    db.session.commit()
+
+    (tmp_path / 'uploads' / 'videos').mkdir(parents=True)
+    monkeypatch.setitem(app.config, 'FLASK_ENV', 'dev')
+    monkeypatch.setitem(app.config, 'UPLOAD_PATH', str(tmp_path / 'uploads'))
+    monkeypatch.setitem(app.config, 'JOBS_IN_WEB_PROCESS', False)
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['id'] = user.id
+
+    #audio has no frame for a thumbnail, so it is ready right away and nothing is queued
+    response = client.post('/upload/stream?filename=riff.mp3&title=Riff', data=b'\x00audio', content_type='audio/mpeg')
+    assert response.status_code == 201
+    assert Post.query.get(response.get_json()['post_id']).status == 'ready'
+    assert not work_once()
+
+    #video still waits for its thumbnail
+    response = client.post('/upload/stream?filename=clip.mp4&title=Clip', data=b'\x00video', content_type='video/mp4')
+    assert Post.query.get(response.get_json()['post_id']).status == 'processing'
+
+    clear_data()
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import imageio_ffmpeg
+from PIL import Image
+from blueprints.uploader.thumbnail_generator import probe_duration, generate_thumbnails, backfill_thumbnails
+
+
+def make_video(path, seconds=6, size='854x480'):
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-v', 'error', '-y', '-f', 'lavfi',
+                    '-i', f'testsrc=duration={seconds}:size={size}:rate=25', '-pix_fmt', 'yuv420p', str(path)],
+                   check=True)
+    return str(path)
+
+
+def test_generate_thumbnails(tmp_path):
+    video = make_video(tmp_path / 'abc-123.mp4')
+    assert probe_duration(video) == 6
+
+    #one run writes every size in every format, named after the video not a slice of its path
+    paths = generate_thumbnails(video, str(tmp_path / 'thumbnails'))
+    names = sorted(os.path.basename(p) for p in paths)
+    assert names == ['abc-123-320.jpg', 'abc-123-320.webp', 'abc-123-640.jpg', 'abc-123-640.webp',
+                     'abc-123.jpg', 'abc-123.webp']
+
+    #small videos are never scaled up
+    assert Image.open(tmp_path / 'thumbnails' / 'abc-123.jpg').size == (854, 480)
+    assert Image.open(tmp_path / 'thumbnails' / 'abc-123-320.webp').size == (320, 180)
+
+
+def test_backfill_thumbnails(tmp_path):
+    videos = [make_video(tmp_path / f'{i}.mp4', seconds=2) for i in range(3)]
+    broken = tmp_path / 'broken.mp4'
+    broken.write_bytes(b'not a video')
+
+    results = backfill_thumbnails(videos + [str(broken)], str(tmp_path / 'thumbnails'), workers=2)
+    assert all(results[v] is None for v in videos)
+    assert results[str(broken)] is not None
+    assert os.path.exists(tmp_path / 'thumbnails' / '2-320.jpg')
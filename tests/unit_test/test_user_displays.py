@@ -0,0 +1,89 @@
+import io
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, UserDisplay, UserDisplayCache, UserResolver, user_displays, bump_post_versions_for_user
+from aws_clients import aws
+from sweeper import sweeper
+from tests.query_plans import captured_statements
+from datetime import datetime
+
+
+def test_display_cache_bounds(monkeypatch):
+    cache = UserDisplayCache(max_entries=2, ttl=60)
+    records = [UserDisplay(i, f'user{i}', 'user', str(i), 0) for i in range(3)]
+
+    #the least recently used record goes first
+    cache.set_many(records[:2])
+    assert cache.get_many([0]) == {0: records[0]}
+    cache.set_many(records[2:])
+    assert cache.get_many([0, 1, 2]) == {0: records[0], 2: records[2]}
+
+    #records past their ttl are gone
+    now = [1000.0]
+    monkeypatch.setattr('models.time.monotonic', lambda: now[0])
+    cache.set_many(records[:1])
+    now[0] += 61
+    assert cache.get_many([0]) == {}
+
+    #records only carry the display fields
+    with pytest.raises(AttributeError):
+        records[0].password = 'x'
+
+
+def test_display_cache_invalidation(monkeypatch):
+    #start with clearing the database
+    clear_data()
+    user_displays.clear()
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+
+    newuser1 = UserTable('obamna', 'soda', 'The Barock', '123', '44@gmail.com', '123-456-7890')
+    db.session.add(newuser1)
+    db.session.commit()
+    db.session.add(Post('fake_id', 'Example Post', 'example descriptions', 0, datetime.now(), newuser1.id))
+    db.session.commit()
+
+    #the first request loads the record, later requests don't touch user_table at all
+    assert UserResolver().get(newuser1.id).avatar_path == f'images/pfps/{newuser1.id}.png?v=0'
+    with captured_statements() as statements:
+        assert UserResolver().get(newuser1.id).full_name == 'obamna soda'
+    assert statements == []
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = newuser1.id
+
+        #changing credentials drops the cached record
+        client.post('/profile/update_credentials', data={'first_name': 'Barack'})
+        assert UserResolver().get(newuser1.id).full_name == 'Barack soda'
+
+        #a new photo bumps the avatar version, and the feed card links the new url
+        class FakeBucket:
+            def __init__(self):
+                self.bucket = self
+            def add_object(self, *args):
+                pass
+            def copy(self, *args):
+                pass
+        monkeypatch.setitem(app.config, 'FLASK_ENV', 'prod')
+        aws.reset()
+        aws.register('s3', object())
+        aws.register(f'bucket:{app.config["UPLOAD_BUCKET_NAME"]}', FakeBucket())
+        aws.register(f'bucket:{app.config["BUCKET_NAME"]}', FakeBucket())
+        client.post('/profile/upload', data={'file': (io.BytesIO(b'png'), 'me.png')}, content_type='multipart/form-data')
+        assert UserResolver().get(newuser1.id).avatar_version == 1
+        response = client.get('/')
+        assert f'images/pfps/{newuser1.id}.png?v=1'.encode() in response.data
+
+        #a rename made by another process leaves this process's cached record as it was
+        assert UserResolver().get(newuser1.id).user_name == 'The Barock'
+        db.session.execute(UserTable.__table__.update().where(UserTable.id == newuser1.id).values(user_name='Barack44'))
+        db.session.commit()
+        bump_post_versions_for_user(newuser1.id)
+        assert UserResolver().get(newuser1.id).user_name == 'The Barock'
+        #but the card rebuilt for the new version, which every process shares, has the new name
+        response = client.get('/')
+        assert b'Barack44' in response.data and b'The Barock' not in response.data
+
+    aws.reset()
+    clear_data()
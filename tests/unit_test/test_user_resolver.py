@@ -0,0 +1,75 @@
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, CommentSection, Comment, JamSession, UserResolver, user_resolver, user_displays
+from sweeper import sweeper
+from tests.query_plans import captured_statements
+from flask import render_template_string
+from datetime import datetime, timedelta
+
+
+def user_queries(statements):
+    return [s for s, _ in statements if 'FROM user_table' in s]
+
+
+def test_user_resolver(monkeypatch):
+    #start with clearing the database
+    clear_data()
+    monkeypatch.setitem(app.config, 'DISTRIBUTION_URL', 'https://cdn.test/')
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+
+    users = [UserTable('user', str(i), f'user{i}', '123', f'{i}@gmail.com', '123') for i in range(4)]
+    db.session.add_all(users)
+    db.session.commit()
+    ids = [u.id for u in users]
+
+    #assert a prefetch is one IN query, and nothing after it asks again
+    user_displays.clear()
+    resolver = UserResolver()
+    with captured_statements() as statements:
+        resolver.prefetch(ids + [None])
+        assert resolver.name(ids[0]) == 'user0'
+        assert resolver.get(ids[1]).full_name == 'user 1'
+        assert resolver.names(ids[2:]) == {ids[2]: 'user2', ids[3]: 'user3'}
+    assert len(statements) == 1
+
+    #unknown ids come back as None and are only looked up once
+    with captured_statements() as statements:
+        assert resolver.get(999999) is None
+        assert resolver.get(999999) is None
+    assert len(statements) == 1
+
+    #outside a request every call gets a fresh resolver, inside one they share it
+    assert user_resolver() is not user_resolver()
+    with app.test_request_context():
+        assert user_resolver() is user_resolver()
+        assert render_template_string('{{ users.name(id) }}', id=ids[0]) == 'user0'
+
+    #every user writes a post and comments on the others
+    for author in users:
+        p = Post(f'video{author.id}', f'Post {author.id}', 'desc', 0, datetime.now(), author.id)
+        db.session.add(p)
+        db.session.commit()
+        cs = CommentSection(p.id)
+        db.session.add(cs)
+        db.session.commit()
+        db.session.add_all([Comment(cs.id, u.id, 'nice') for u in users if u is not author])
+        db.session.commit()
+
+    #assert the whole feed page, current user included, looks users up once
+    user_displays.clear()
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['id'] = ids[0]
+        with captured_statements() as statements:
+            assert client.get('/').status_code == 200
+        assert len(user_queries(statements)) == 2
+
+        #a new session's host name comes from the resolver too
+        with app.test_request_context():
+            user_resolver().prefetch(ids)
+            with captured_statements() as statements:
+                sesh = JamSession('sesh', 'come jam', datetime.now() + timedelta(hours=1), datetime.now(), 10.0, 10.0, ids[1])
+            assert sesh.host_name == 'user 1'
+            assert statements == []
+
+    clear_data()
@@ -0,0 +1,81 @@
+import pytest
+from app import app
+from models import UserTable, clear_data, db, Post, ratio_table, cast_vote
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+def make_users(count):
+    users = [UserTable('voter', str(i), f'voter{i}', '123', f'v{i}@gmail.com', '123-456-7890') for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def test_vote_routes():
+    #start with clearing the database
+    clear_data()
+    poster, voter = make_users(2)
+    p = Post('fake_id', 'Example Post', 'example descriptions', 0, datetime.now(), poster.id)
+    db.session.add(p)
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['id'] = voter.id
+
+    #json mode returns the new ratio instead of redirecting
+    response = client.post(f'/{p.id}/ratio', data={'user_rev': '1'}, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    assert response.get_json() == {'post_id': p.id, 'ratio': 1}
+
+    #flipping to a dislike moves the ratio by two
+    response = client.post(f'/{p.id}/ratioiso', json={'user_rev': '0'})
+    assert response.get_json()['ratio'] == -1
+    assert ratio_table.query.filter_by(post_id=p.id, user_id=voter.id).first().value == -1
+
+    #pressing dislike again takes the vote back
+    response = client.post(f'/{p.id}/ratio', json={'user_rev': '0'})
+    assert response.get_json()['ratio'] == 0
+    assert ratio_table.query.filter_by(post_id=p.id, user_id=voter.id).first() is None
+
+    #plain form posts still redirect back to the page they came from
+    response = client.post(f'/{p.id}/ratioiso', data={'user_rev': '1'})
+    assert response.status_code == 302
+    assert response.location.endswith(f'/{p.id}')
+    db.session.refresh(p)
+    assert p.ratio == 1
+
+    #bad values and missing posts are rejected
+    assert client.post(f'/{p.id}/ratio', json={'user_rev': '7'}).status_code == 400
+    assert client.post('/999999/ratio', json={'user_rev': '1'}).status_code == 404
+
+    clear_data()
+
+
+def test_concurrent_votes():
+    clear_data()
+    users = make_users(20)
+    p = Post('fake_id', 'Example Post', 'example descriptions', 0, datetime.now(), users[0].id)
+    db.session.add(p)
+    db.session.commit()
+    post_id = p.id
+
+    def like(user_id):
+        with app.app_context():
+            return cast_vote(post_id, user_id, 1)
+
+    #everyone likes the post at once, no like is lost
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(like, [u.id for u in users]))
+    db.session.refresh(p)
+    assert p.ratio == 20
+
+    #one user mashing the like button ends up with a counter matching their final vote
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        list(pool.map(like, [users[0].id] * 9))
+    db.session.refresh(p)
+    votes = ratio_table.query.filter_by(post_id=post_id).all()
+    assert p.ratio == sum(v.value for v in votes)
+
+    clear_data()